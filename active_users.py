@@ -0,0 +1,116 @@
+"""Recently active chat users, for picking random mentions.
+
+`ActiveUsers` keeps users in an array with a user -> index map, so adding, removing
+(swap with the last element) and picking a uniformly random user are O(1). Expiry
+uses a timing wheel: users are grouped into buckets of `bucket_s` seconds by their
+last activity, and whole buckets older than the TTL are dropped at once, so a user
+expires between `ttl_s` and `ttl_s + bucket_s` after their last message.
+"""
+
+import random
+import threading
+import time
+from collections.abc import Iterable, Iterator
+
+
+class ActiveUsers:
+    """Thread-safe: chatters are touched on the event loop, while `random()` is called
+    by mention variables of templates rendered on the template threads."""
+
+    def __init__(self, ttl_s: float, bucket_s: float = 60.0):
+        self.ttl_s = ttl_s
+        self.bucket_s = bucket_s
+        self._users: list[str] = []
+        self._pos: dict[str, int] = {}
+        self._bucket_of: dict[str, int] = {}
+        self._wheel: dict[int, set[str]] = {}
+        self._oldest = 0  # no bucket below this index holds users
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, user: object) -> bool:
+        return user in self._pos
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._users))
+
+    def touch(self, user: str, now: float | None = None):
+        """Marks `user` as active now, adding them if needed, and expires idle users."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._touch(user, now)
+
+    def _touch(self, user: str, now: float):
+        b = int(now // self.bucket_s)
+        old = self._bucket_of.get(user)
+        if old == b:
+            return
+        if old is None:
+            self._pos[user] = len(self._users)
+            self._users.append(user)
+        else:
+            self._unbucket(user, old)
+        self._bucket_of[user] = b
+        self._wheel.setdefault(b, set()).add(user)
+        if len(self._wheel) == 1:
+            self._oldest = b
+
+    def remove(self, user: str):
+        with self._lock:
+            self._remove(user)
+
+    def _remove(self, user: str):
+        i = self._pos.pop(user, None)
+        if i is None:
+            return
+        last = self._users.pop()
+        if last != user:
+            self._users[i] = last
+            self._pos[last] = i
+        self._unbucket(user, self._bucket_of.pop(user))
+
+    def _unbucket(self, user: str, b: int):
+        users = self._wheel[b]
+        users.discard(user)
+        if not users:
+            del self._wheel[b]
+
+    def expire(self, now: float | None = None):
+        """Drops users whose last activity is older than the TTL."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+
+    def _expire(self, now: float):
+        cutoff = int((now - self.ttl_s) // self.bucket_s)
+        while self._wheel and self._oldest < cutoff:
+            for user in list(self._wheel.get(self._oldest, ())):
+                self._remove(user)
+            self._oldest += 1
+        if not self._wheel:
+            self._oldest = cutoff
+
+    def random(self, exclude: Iterable[str] = (), now: float | None = None) -> str | None:
+        """A uniformly random active user not in `exclude`, or None if there is none."""
+        if now is None:
+            now = time.monotonic()
+        exclude = set(exclude)
+        with self._lock:
+            self._expire(now)
+            skip = sorted(self._pos[u] for u in exclude if u in self._pos)
+            n = len(self._users) - len(skip)
+            if n <= 0:
+                return None
+            i = random.randrange(n)
+            # Map i onto the positions that are not skipped.
+            for p in skip:
+                if p > i:
+                    break
+                i += 1
+            return self._users[i]
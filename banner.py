@@ -0,0 +1,132 @@
+"""Discord guild banner rendering.
+
+A banner template renders to `url;;x,y,size,r,g,b,text;;...`: a base image and text
+overlays. `BannerRenderer` gets base images from a `DiskCache` (downloaded with the
+shared async HTTP client) and draws banners on its own single-thread executor (`banner`), so the event
+loop never blocks on HTTP, image decoding or PNG encoding. It caches the decoded base
+images, fonts by size, and the encoded PNG by banner text.
+"""
+
+import dataclasses
+import hashlib
+import logging
+from io import BytesIO
+
+import cachetools
+from PIL import Image, ImageDraw, ImageFont
+
+import executors
+import metrics
+from data import is_dev
+from disk_cache import DiskCache
+
+_render_seconds = metrics.histogram("banner_render_seconds", "Time to produce a banner PNG")
+
+
+@dataclasses.dataclass
+class BannerOverlay:
+    x: int
+    y: int
+    size: int
+    r: int
+    g: int
+    b: int
+    text: str
+
+
+def parse_banner(txt: str) -> tuple[str, list[BannerOverlay]]:
+    """Splits rendered banner text into the base image URL and text overlays."""
+    parts = txt.split(";;")
+    url = parts[0].strip()
+    overlays = []
+    for p in parts[1:]:
+        ox, oy, os_, orr, og, ob, ot = p.split(",", 6)
+        overlays.append(
+            BannerOverlay(
+                x=int(ox),
+                y=int(oy),
+                size=int(os_),
+                r=int(orr),
+                g=int(og),
+                b=int(ob),
+                text=ot,
+            )
+        )
+    return url, overlays
+
+
+class BannerRenderer:
+    """Renders banners on a single worker thread, so the caches need no locking."""
+
+    def __init__(
+        self,
+        cache: DiskCache,
+        font_path: str = "arial.ttf",
+        max_images: int = 8,
+        max_outputs: int = 32,
+    ):
+        self.cache = cache
+        self.font_path = font_path
+        self._executor = executors.Executor("banner", 1)
+        # (url, version) -> decoded image
+        self._images: cachetools.LRUCache[tuple[str, int], Image.Image] = cachetools.LRUCache(
+            max_images
+        )
+        self._fonts: dict[int, ImageFont.FreeTypeFont] = {}
+        self._outputs: cachetools.LRUCache[str, bytes] = cachetools.LRUCache(max_outputs)
+
+    async def render(self, txt: str) -> bytes | None:
+        """PNG bytes for rendered banner text, or None if the base image is unavailable."""
+        url, _ = parse_banner(txt)
+        entry = await self.cache.get(url)
+        if entry is None:
+            return None
+        try:
+            png = await self._executor.run(
+                self.render_sync, txt, self.cache.path(entry), entry.version
+            )
+        except Exception:
+            await self.cache.invalidate(url)  # most likely not a valid image; fetch again next time
+            raise
+        if is_dev():
+            name = hashlib.sha1(txt.encode("utf8")).hexdigest() + ".png"
+            logging.info(f"saving dev result {await self.cache.store(name, png)}")
+        return png
+
+    def render_sync(self, txt: str, img_path: str, version: int = 0) -> bytes:
+        """Renders on the calling thread; `img_path` is the base image, `version` its
+        content version in the disk cache."""
+        key = f"{hashlib.sha1(txt.encode('utf8')).hexdigest()}:{version}"
+        png = self._outputs.get(key)
+        if png is not None:
+            _render_seconds.observe(0.0, cache="hit")
+            return png
+        with _render_seconds.time(cache="miss"):
+            url, overlays = parse_banner(txt)
+            image = self._base_image(url, img_path, version).copy()
+            draw = ImageDraw.Draw(image)
+            for o in overlays:
+                draw.text((o.x, o.y), o.text, (o.r, o.g, o.b), font=self._font(o.size))
+            bb = BytesIO()
+            image.save(bb, format="png")
+            png = bb.getvalue()
+        self._outputs[key] = png
+        return png
+
+    def _base_image(self, url: str, img_path: str, version: int) -> Image.Image:
+        image = self._images.get((url, version))
+        if image is None:
+            image = Image.open(img_path)
+            image.load()
+            self._images[(url, version)] = image
+        return image
+
+    def _font(self, size: int) -> ImageFont.FreeTypeFont:
+        font = self._fonts.get(size)
+        if font is None:
+            font = ImageFont.truetype(self.font_path, size=size)
+            self._fonts[size] = font
+        return font
+
+    def close(self):
+        self._executor.shutdown()
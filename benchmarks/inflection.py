@@ -0,0 +1,139 @@
+"""pymorphy3 calls and time for inflecting a channel's morph-tagged texts.
+
+Simulates `TextDownload` (every text inflected to every case tag) followed by
+`morph_text` for the same texts, repeated as moderators download and re-add them,
+once with the `words` caches disabled and once with them enabled.
+
+Usage: uv run python benchmarks/inflection.py [repeats]
+"""
+
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymorphy3
+import pymorphy3.analyzer
+
+import words
+from commands import text
+
+VOCABULARY = [
+    "кот",
+    "собака",
+    "хомяк",
+    "попугай",
+    "черепаха",
+    "ёжик",
+    "барсук",
+    "енот",
+    "лиса",
+    "волк",
+    "медведь",
+    "заяц",
+    "белка",
+    "рыбка",
+    "лошадь",
+    "корова",
+    "коза",
+    "овца",
+    "свинья",
+    "курица",
+    "утка",
+    "гусь",
+    "индюк",
+    "мышь",
+    "крыса",
+    "змея",
+    "пирожок",
+    "пельмень",
+    "борщ",
+    "блин",
+    "сырник",
+    "вареник",
+    "бутерброд",
+    "арбуз",
+    "яблоко",
+    "груша",
+    "банан",
+    "стул",
+    "стол",
+    "шкаф",
+    "диван",
+    "кровать",
+    "лампа",
+    "чайник",
+    "кружка",
+    "тарелка",
+    "ложка",
+    "вилка",
+    "нож",
+    "стример",
+    "модератор",
+    "зритель",
+    "подписчик",
+    "спонсор",
+    "бот",
+    "чат",
+    "смайлик",
+    "канал",
+    "трансляция",
+]
+PHRASES = [
+    "синий кот",
+    "большая собака",
+    "весёлый хомяк",
+    "старый медведь",
+    "горячий пирожок",
+    "мягкий диван",
+    "добрый модератор",
+    "новый подписчик",
+]
+
+
+def run(texts: list[str], repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for t in texts:
+            for inf in words.case_tags:
+                words.inflect_word(t, inf, ["NOUN"] if " " not in t else [])
+        for t in texts:
+            text.morph_text(t)
+    return time.perf_counter() - start
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    calls: collections.Counter[str] = collections.Counter()
+    morph = words.get_morph()
+    parse = morph.parse
+    inflect = pymorphy3.analyzer.Parse.inflect
+
+    def counting_parse(word):
+        calls["parse"] += 1
+        return parse(word)
+
+    def counting_inflect(self, grammemes):
+        calls["inflect"] += 1
+        return inflect(self, grammemes)
+
+    morph.parse = counting_parse
+    pymorphy3.analyzer.Parse.inflect = counting_inflect
+    texts = VOCABULARY + PHRASES
+
+    cached = words.parse_word, words._inflect_word, text._morph_forms
+    words.parse_word, words._inflect_word, text._morph_forms = (f.__wrapped__ for f in cached)
+    elapsed = run(texts, repeats)
+    print(f"uncached: {elapsed * 1e3:7.1f} ms  {dict(calls)}")
+
+    calls.clear()
+    words.parse_word, words._inflect_word, text._morph_forms = cached
+    elapsed = run(texts, repeats)
+    print(f"cached:   {elapsed * 1e3:7.1f} ms  {dict(calls)}")
+    print(words.cache_info(), text._morph_forms.cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Per-message logging overhead of the command pipeline.
+
+Runs PersistentCommand.run() with the same log calls as the Twitch message handler,
+with template rendering stubbed out so only logging cost is measured, at each root
+log level. Handlers format records the same way as main.setup_logging().
+
+Usage: uv run python benchmarks/invocation_log.py [iterations]
+"""
+
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import commands.pipeline
+from data import EventType, InvocationLog, Message, dictToCommandData
+
+
+def one_message(cmd: commands.pipeline.PersistentCommand):
+    log = InvocationLog("twitch channel somechannel (42)")
+    text = "!laud everyone in the chat"
+    log.debug('%s "%s"', "someone", text)
+    v = {"author": "someone", "text": text, "is_mod": False, "_log": log, "channel_id": 42}
+    msg = Message(
+        id="1",
+        log=log,
+        channel_id=42,
+        txt=text,
+        event=EventType.message,
+        prefix="!",
+        is_discord=False,
+        is_mod=False,
+        private=False,
+        get_variables=lambda: v,
+    )
+    actions, _ = cmd.run(msg)
+    log.debug("actions (except download) %s", [a for a in actions if a.attachment == ""])
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    commands.pipeline.render = lambda text, variables: "rendered text"
+    data = dictToCommandData(
+        {
+            "name": "laud",
+            "pattern": "!prefixlaud\\b",
+            "help": "laud someone",
+            "actions": [{"kind": "message", "text": "{{ author }} hugs {{ text }}"}],
+        }
+    )
+    cmd = commands.pipeline.PersistentCommand(data, "!")
+    with open(os.devnull, "w") as devnull:
+        logging.basicConfig(
+            stream=devnull, format="%(asctime)s %(levelname)s %(message)s", force=True
+        )
+        root = logging.getLogger()
+        for level in [logging.WARNING, logging.INFO, logging.DEBUG]:
+            root.setLevel(level)
+            for _ in range(n // 10):
+                one_message(cmd)
+            start = time.perf_counter()
+            for _ in range(n):
+                one_message(cmd)
+            elapsed = time.perf_counter() - start
+            print(f"{logging.getLevelName(level):8} {elapsed / n * 1e6:6.1f} us/message")
+
+
+if __name__ == "__main__":
+    main()
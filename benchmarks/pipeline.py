@@ -0,0 +1,286 @@
+"""End-to-end benchmark of the message pipeline on synthetic channels.
+
+Creates channels with N texts (tagged, some with inflected forms), M tags and K
+persistent commands whose templates use `txt`, `get`/`set`, categories and mentions,
+then drives `commands.process_message()` with a mix of Discord and Twitch messages
+(commands and plain chatter) and reports throughput, p50/p95/p99 latency and DB round
+trips per message. The synthetic channels are deleted afterwards unless --keep.
+
+Results can be written as JSON (--json) to compare runs over time. With --memory the
+channels live in `memory_db.MemoryDB` instead of PostgreSQL: the difference between the
+two runs is the cost of the database, the --memory run is the pipeline's CPU ceiling.
+
+Usage: uv run python benchmarks/pipeline.py --db postgresql://localhost/moon_bench \\
+    [--channels 4] [--texts 500] [--tags 20] [--commands 10] [--messages 5000] \\
+    [--concurrency 1] [--json results.json]
+       uv run python benchmarks/pipeline.py --memory [...]
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import commands
+import templates
+from data import EventType, InvocationLog, Lazy, Message, dictToCommandData
+from memory_db import MemoryDB
+from storage import DB, db, set_db
+
+USERS = [f"viewer{i}" for i in range(50)]
+WORDS = ["кот", "лиса", "енот", "сова", "ёжик", "барсук", "заяц", "белка", "волк", "хомяк"]
+
+# Command templates, cycled through when creating K commands. {tag} is replaced
+# with a random synthetic tag.
+TEMPLATES = [
+    "{{{{ author }}}} hugs {{{{ mention }}}} with {{{{ txt('{tag} or {tag2}') }}}}",
+    "{{{{ random_mention }}}} gets {{{{ txt('{tag}', 'рд') }}}}",
+    (
+        "{{% set n = get('count', 'counters', '0') | int + 1 %}}"
+        "{{{{ set('count', n | string, 'counters') }}}}{{{{ author }}}} is #{{{{ n }}}}"
+    ),
+    "{{{{ txt(['{tag}', 1, '{tag2}', 3]) }}}} for {{{{ any_mention }}}}",
+    "{{{{ set(author, text, 'seen') }}}}{{{{ category_size('seen') }}}} seen",
+    "{{{{ author }}}}: {{{{ txt('{tag} and not {tag2}') }}}} {{{{ randint(1, 6) }}}}",
+]
+
+
+class CountingCursor:
+    """Forwards to a psycopg2 cursor, counting statements."""
+
+    def __init__(self, cur, counter: "CountingDB"):
+        self._cur = cur
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter.count()
+        return self._cur.execute(*args, **kwargs)
+
+    def __enter__(self):
+        self._cur.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cur.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class CountingDB(DB):
+    """DB that counts round trips, including the liveness check in `cursor()`."""
+
+    def __init__(self, connection: str):
+        self._lock = threading.Lock()
+        self.round_trips = 0
+        super().__init__(connection)
+
+    def count(self):
+        with self._lock:
+            self.round_trips += 1
+
+    def cursor(self):
+        cur = super().cursor()
+        self.count()  # "SELECT 1"
+        return CountingCursor(cur, self)
+
+
+def create_channel(name: str, args, rng: random.Random) -> tuple[int, str]:
+    with db().cursor() as cur:
+        channel_id, prefix = db().twitch_channel_info(cur, name)
+    tag_names = [f"t{i}" for i in range(args.tags)]
+    for t in [*tag_names, "рд"]:
+        db().add_tag(channel_id, t)
+    tag_by_value = db().tag_by_value(channel_id)
+    for i in range(args.texts):
+        word = rng.choice(WORDS)
+        text_id = db().add_text(channel_id, f"{word} {name} {i}")
+        tags: dict[int, str | None] = {
+            tag_by_value[t]: None for t in rng.sample(tag_names, k=min(3, len(tag_names)))
+        }
+        if rng.random() < 0.5:
+            tags[tag_by_value["рд"]] = f"{word}а {name} {i}"
+        db().set_text_tags(channel_id, text_id, tags)
+    with db().cursor() as cur:
+        for k in range(args.commands):
+            text = TEMPLATES[k % len(TEMPLATES)].format(
+                tag=rng.choice(tag_names), tag2=rng.choice(tag_names)
+            )
+            cmd = dictToCommandData(
+                {
+                    "name": f"cmd{k}",
+                    "pattern": f"!prefixcmd{k}\\b",
+                    "actions": [{"kind": "message", "text": text}],
+                }
+            )
+            db().set_command(cur, channel_id, "benchmark", cmd)
+    return channel_id, prefix
+
+
+def delete_channels(channel_ids: list[int]):
+    with db().cursor() as cur:
+        for table in ["texts", "tags", "commands", "variables", "channels"]:
+            cur.execute(f"DELETE FROM {table} WHERE channel_id = ANY(%s)", [channel_ids])
+
+
+def make_message(n: int, channel_id: int, prefix: str, args, rng: random.Random) -> Message:
+    is_discord = n % 2 == 0
+    author = rng.choice(USERS)
+    if rng.random() < args.command_ratio:
+        text = f"{prefix}cmd{rng.randrange(args.commands)} @{rng.choice(USERS)}"
+    else:
+        text = f"just chatting {n} {rng.choice(WORDS)}"
+    media = "discord" if is_discord else "twitch"
+    log = InvocationLog(f"{media} channel {channel_id}")
+    variables = {
+        "author": author,
+        "author_name": author,
+        "mention": Lazy(lambda: "@" + rng.choice(USERS)),
+        "direct_mention": "",
+        "random_mention": Lazy(lambda: "@" + rng.choice(USERS), stick=False),
+        "any_mention": Lazy(lambda: "@" + rng.choice(USERS), stick=False),
+        "media": media,
+        "text": text,
+        "is_mod": False,
+        "prefix": prefix,
+        "bot": "moon_rabbit",
+        "channel_id": channel_id,
+        "_log": log,
+        "_private": False,
+        "_id": str(n),
+    }
+    return Message(
+        id=str(n),
+        log=log,
+        channel_id=channel_id,
+        txt=text,
+        event=EventType.message,
+        prefix=prefix,
+        is_discord=is_discord,
+        is_mod=False,
+        private=False,
+        get_variables=lambda: variables,
+    )
+
+
+async def drive(messages: list[Message], concurrency: int) -> tuple[list[float], float, int]:
+    """Processes `messages` with `concurrency` workers; returns latencies, wall time
+    and the number of actions produced."""
+    latencies: list[float] = []
+    actions = 0
+    it = iter(messages)
+
+    async def worker():
+        nonlocal actions
+        for msg in it:
+            t = time.perf_counter()
+            actions += len(await commands.process_message(msg))
+            latencies.append(time.perf_counter() - t)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, actions
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=os.getenv("DB_CONNECTION"))
+    parser.add_argument("--memory", action="store_true", help="use MemoryDB instead of --db")
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--texts", type=int, default=500)
+    parser.add_argument("--tags", type=int, default=20)
+    parser.add_argument("--commands", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--command_ratio", type=float, default=0.3)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--keep", action="store_true", help="don't delete the channels")
+    args = parser.parse_args()
+    if not args.db and not args.memory:
+        parser.error("--db, DB_CONNECTION or --memory is required")
+    logging.basicConfig(level=logging.WARNING)
+    templates.register_template_globals()
+    rng = random.Random(args.seed)
+    set_db(MemoryDB() if args.memory else CountingDB(args.db))
+    run = f"bench_{os.getpid()}_{int(time.time())}"
+    setup_start = time.perf_counter()
+    channels = [create_channel(f"{run}_{i}", args, rng) for i in range(args.channels)]
+    setup_s = time.perf_counter() - setup_start
+    try:
+        msgs = [
+            make_message(n, *rng.choice(channels), args, rng)
+            for n in range(args.warmup + args.messages)
+        ]
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(drive(msgs[: args.warmup], args.concurrency))
+        before = getattr(db(), "round_trips", 0)
+        latencies, elapsed, actions = loop.run_until_complete(
+            drive(msgs[args.warmup :], args.concurrency)
+        )
+        round_trips = getattr(db(), "round_trips", 0) - before
+        loop.close()
+    finally:
+        if not args.keep and not args.memory:
+            delete_channels([c for c, _ in channels])
+    q = statistics.quantiles(latencies, n=100)
+    results = {
+        "messages": len(latencies),
+        "seconds": elapsed,
+        "messages_per_s": len(latencies) / elapsed,
+        "latency_ms": {
+            "mean": statistics.fmean(latencies) * 1000,
+            "p50": q[49] * 1000,
+            "p95": q[94] * 1000,
+            "p99": q[98] * 1000,
+            "max": max(latencies) * 1000,
+        },
+        "db_round_trips_per_message": round_trips / len(latencies),
+        "actions_per_message": actions / len(latencies),
+        "setup_s": setup_s,
+    }
+    params = {k: v for k, v in vars(args).items() if k not in ("db", "json", "keep")}
+    report = {
+        "benchmark": "pipeline",
+        "time": datetime.datetime.now(datetime.UTC).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": params,
+        "results": results,
+    }
+    lat = results["latency_ms"]
+    print(
+        f"{results['messages']} messages in {elapsed:.2f} s: "
+        f"{results['messages_per_s']:.0f} msg/s, "
+        f"p50 {lat['p50']:.2f} ms, p95 {lat['p95']:.2f} ms, p99 {lat['p99']:.2f} ms, "
+        f"{results['db_round_trips_per_message']:.2f} DB round trips/message"
+    )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
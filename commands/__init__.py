@@ -8,6 +8,7 @@ from commands.builtins import (
     HelpCommand,
     InvalidateCache,
     Multiline,
+    Profile,
     SetCommand,
     SetPrefix,
 )
@@ -43,6 +44,7 @@ __all__ = [
     "text_to_row",
     "Eval",
     "Debug",
+    "Profile",
     "Multiline",
     "SetCommand",
     "SetPrefix",
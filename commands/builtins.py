@@ -17,10 +17,12 @@ limitations under the License.
 import dataclasses
 import json
 import logging
+import math
 import re
 
 import discord
 
+import profiler
 from commands.pipeline import (
     Command,
     PersistentCommand,
@@ -29,6 +31,7 @@ from commands.pipeline import (
     get_commands,
 )
 from data import Action, ActionKind, CommandData, Message, dictToCommandData, render
+from sandbox import BudgetExceeded, RenderBudget
 from storage import cursor, db
 
 
@@ -43,7 +46,12 @@ class Eval(Command):
             return [Action(kind=ActionKind.REPLY, text=self.help(msg.prefix))], False
         # v['_log'].info(f'eval "{text}"')
         v["_render_depth"] = 0
-        s = render(text, v)
+        v["_budget"] = RenderBudget()
+        try:
+            s = render(text, v)
+        except BudgetExceeded as e:
+            msg.log.warning("aborted eval: %s", e)
+            s = f"aborted: {e}"
         if not s:
             s = "<empty>"
         return [Action(kind=ActionKind.REPLY, text=s)], False
@@ -69,9 +77,7 @@ class SetCommand(Command):
         parts = text.split(" ", 1)
         name = parts[0]
         if len(parts) == 1:
-            cursor().execute(
-                "DELETE FROM commands WHERE channel_id = %s AND name = %s", (channel_id, name)
-            )
+            db().delete_command(channel_id, name)
             return [Action(kind=ActionKind.REPLY, text=f"Deleted command '{name}'")], False
         command_text = parts[1]
         cmd = CommandData(pattern="!prefix" + re.escape(name) + "\\b")
@@ -81,7 +87,7 @@ class SetCommand(Command):
             log.info("failed to parse command as JSON, assuming literal text")
             cmd.actions.append(Action(text=command_text, kind=ActionKind.NEW_MESSAGE))
         cmd.name = name
-        log.info(f"parsed command {cmd}")
+        log.info("parsed command %s", cmd)
         v = msg.get_variables()
         id = db().set_command(cursor(), channel_id, v["author_name"], cmd)
         log.info(f"channel={channel_id} author={v['author_name']} added new command '{name}' #{id}")
@@ -240,6 +246,51 @@ class Debug(Command):
         return True
 
 
+class Profile(Command):
+    def run(self, msg: Message) -> tuple[list[Action], bool]:
+        text = command_prefix(msg.txt, msg.prefix, ["profile"])
+        if not text:
+            return [], True
+        parts = text.split()
+        channel_id = msg.channel_id
+        if parts and parts[0] == "on":
+            try:
+                minutes = float(parts[1]) if len(parts) > 1 else profiler.DEFAULT_DURATION_S / 60
+            except ValueError:
+                minutes = math.nan
+            if not math.isfinite(minutes) or minutes <= 0:
+                return [Action(ActionKind.PRIVATE_MESSAGE, self.help_full(msg.prefix))], False
+            minutes = min(minutes, profiler.MAX_DURATION_S / 60)
+            profiler.enable(channel_id, minutes * 60)
+            reply = f"profiling on for {minutes:g} minutes"
+        elif parts and parts[0] == "off":
+            profiler.disable(channel_id)
+            reply = "profiling off"
+        elif parts and parts[0] == "reset":
+            profiler.reset(channel_id)
+            reply = "profile cleared"
+        else:
+            remaining = profiler.remaining_s(channel_id)
+            state = f"on for {remaining / 60:.0f} more minutes" if remaining else "off"
+            reply = f"profiling {state}\n```\n{profiler.report(channel_id)}\n```"
+        return [Action(kind=ActionKind.PRIVATE_MESSAGE, text=reply)], False
+
+    def for_twitch(self):
+        return False
+
+    def help(self, prefix: str):
+        return f"{prefix}profile"
+
+    def help_full(self, prefix: str):
+        return (
+            f'"{prefix}profile on [<minutes, up to {profiler.MAX_DURATION_S // 60}>]" OR "{prefix}profile" (report) OR '
+            f'"{prefix}profile off" OR "{prefix}profile reset"'
+        )
+
+    def private_mod_only(self):
+        return True
+
+
 class HelpCommand(Command):
     def run(self, msg: Message) -> tuple[list[Action], bool]:
         text = command_prefix(msg.txt, msg.prefix, ["commands", "help"])
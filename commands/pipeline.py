@@ -14,7 +14,6 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import asyncio
 import dataclasses
 import json
 import logging
@@ -25,31 +24,57 @@ from typing import Protocol
 
 import ttldict2
 
+import executors
+import metrics
+import profiler
 from data import (
     Action,
     ActionKind,
     CommandData,
     InvocationLog,
+    Lazy,
     Message,
     is_dev,
     render,
 )
+from sandbox import BudgetExceeded, RenderBudget
 from storage import db
 
 # id: str -> Message
 messages = ttldict2.TTLDict(ttl_seconds=600.0)
 
+_process_seconds = metrics.histogram(
+    "process_message_seconds", "Time to run all commands on an incoming message"
+)
+_process_errors = metrics.counter(
+    "process_message_errors_total", "Messages whose processing raised an exception"
+)
+_command_seconds = metrics.histogram(
+    "persistent_command_seconds", "Time to render the actions of a matched persistent command"
+)
+_command_errors = metrics.counter(
+    "persistent_command_errors_total", "Matched persistent commands that failed to render"
+)
+_budget_exceeded = metrics.counter(
+    "template_budget_exceeded_total", "Renders aborted by a render budget, by budget"
+)
+_commands_cache_lookups = metrics.counter(
+    "commands_cache_lookups_total", "Channel command list lookups by result (hit, miss)"
+)
+
 # channel_id -> timestamp of the last "error occurred" chat reply
 _ERROR_REPLY_COOLDOWN_SECS = 30 * 60
 _last_error_reply: dict[int, float] = {}
 
 
 async def process_message(msg: Message) -> list[Action]:
-    logging.debug(f'process message "{msg.txt}" type {msg.event}')
+    logging.debug('process message "%s" type %s', msg.txt, msg.event)
     messages[msg.id] = msg
     actions: list[Action] = []
+    start = time.perf_counter()
+    token = profiler.set_channel(msg.channel_id)
     try:
-        cmds = await asyncio.to_thread(get_commands, msg.channel_id, msg.prefix)
+        cmds = await executors.DB.run(get_commands, msg.channel_id, msg.prefix)
         for cmd in cmds:
             if cmd.mod_only() and not msg.is_mod:
                 continue
@@ -59,14 +84,14 @@ async def process_message(msg: Message) -> list[Action]:
                 continue
             if (not msg.is_discord) and not cmd.for_twitch():
                 continue
-            a, next = await asyncio.to_thread(cmd.run, msg)
+            a, next = await cmd.executor(msg).run(cmd.run, msg)
             actions.extend(a)
             if not next:
                 break
         actions.extend(msg.additionalActions)
-        log_actions = [a for a in actions if a.attachment == ""]
-        msg.log.debug(f"actions (except download) {log_actions}")
+        msg.log.debug("actions (except download) %s", [a for a in actions if a.attachment == ""])
     except Exception as e:
+        _process_errors.inc()
         msg.log.error(f"{e}\n{traceback.format_exc()}")
         now = time.monotonic()
         if now - _last_error_reply.get(msg.channel_id, 0.0) >= _ERROR_REPLY_COOLDOWN_SECS:
@@ -74,6 +99,11 @@ async def process_message(msg: Message) -> list[Action]:
             actions.append(Action(kind=ActionKind.REPLY, text="error occurred"))
         if is_dev():
             raise
+    finally:
+        profiler.reset_channel(token)
+        _process_seconds.observe(
+            time.perf_counter() - start, media="discord" if msg.is_discord else "twitch"
+        )
     return actions
 
 
@@ -113,6 +143,10 @@ class Command(Protocol):
     def hidden_help(self):
         return True
 
+    def executor(self, msg: Message) -> executors.Executor:
+        """Where `run(msg)` is called; long jobs go to `executors.BATCH`."""
+        return executors.TEMPLATE
+
 
 # str -> List[Command]
 commands_cache = ttldict2.TTLDict(ttl_seconds=600.0)
@@ -121,6 +155,7 @@ commands_cache = ttldict2.TTLDict(ttl_seconds=600.0)
 def get_commands(channel_id: int, prefix: str) -> list[Command]:
     key = f"commands_{channel_id}_{prefix}"
     r = commands_cache.get(key)
+    _commands_cache_lookups.inc(result="hit" if r else "miss")
     if not r:
         from commands.builtins import (
             Debug,
@@ -128,6 +163,7 @@ def get_commands(channel_id: int, prefix: str) -> list[Command]:
             HelpCommand,
             InvalidateCache,
             Multiline,
+            Profile,
             SetCommand,
             SetPrefix,
         )
@@ -148,6 +184,7 @@ def get_commands(channel_id: int, prefix: str) -> list[Command]:
             HelpCommand(),
             Eval(),
             Debug(),
+            Profile(),
             Multiline(),
             SetCommand(),
             SetPrefix(),
@@ -178,7 +215,7 @@ class PersistentCommand(Command):
     def __init__(self, data, prefix):
         self.data = data
         p = data.pattern.replace("!prefix", re.escape(prefix) + " ?")
-        logging.debug(f"regex {p}")
+        logging.debug("regex %s", p)
         self.regex = re.compile(p, re.IGNORECASE)
 
     def for_discord(self):
@@ -188,27 +225,42 @@ class PersistentCommand(Command):
         return self.data.twitch
 
     def run(self, msg: Message) -> tuple[list[Action], bool]:
-        if msg.event != self.data.event_type or not re.search(self.regex, msg.txt):
+        if msg.event != self.data.event_type:
+            return [], True
+        with profiler.section("regex", self.data.name):
+            matched = re.search(self.regex, msg.txt)
+        if not matched:
             return [], True
         variables = msg.get_variables()
         if self.data.mod and not variables["is_mod"]:
             logging.debug("non mod called persistent")
             return [], True
         log: InvocationLog = variables["_log"]
-        log.info(f"matched command {json.dumps(dataclasses.asdict(self.data), ensure_ascii=False)}")
+        log.info("matched command %s", self.data.name)
+        log.debug("command %s", Lazy(self.data_json))
         actions: list[Action] = []
         try:
-            for e in self.data.actions:
-                variables["_render_depth"] = 0
-                a = Action(kind=e.kind, text=render(e.text, variables))
-                if a.text:
-                    actions.append(a)
+            with _command_seconds.time(), profiler.section("command", self.data.name):
+                for e in self.data.actions:
+                    variables["_render_depth"] = 0
+                    variables["_budget"] = RenderBudget()
+                    a = Action(kind=e.kind, text=render(e.text, variables))
+                    if a.text:
+                        actions.append(a)
             return actions, True
+        except BudgetExceeded as e:
+            _budget_exceeded.inc(budget=e.budget)
+            log.warning("aborted rendering '%s': %s", self.data.name, e)
+            return [], True
         except Exception as e:
-            log.error(f"failed to render '{self.data.name}': {str(e)}")
+            _command_errors.inc()
+            log.error("failed to render '%s': %s", self.data.name, e)
             log.error(traceback.format_exc())
             return [], True
 
+    def data_json(self) -> str:
+        return json.dumps(dataclasses.asdict(self.data), ensure_ascii=False)
+
     def help(self, prefix: str):
         if self.data.help:
             return self.data.help.replace("!prefix", prefix)
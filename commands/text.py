@@ -15,13 +15,15 @@ limitations under the License.
 """
 
 import csv
+import functools
 import io
 import logging
 import re
-import urllib.request
 
 import discord
 
+import executors
+import http_client
 import query
 import words
 from commands.pipeline import Command, command_prefix
@@ -75,16 +77,20 @@ def text_to_row(channel_id: int, text_id: int) -> str | None:
 
 
 def morph_text(text_value: str) -> dict[str, str | None]:
-    name_value: dict[str, str | None] = {}
-    parts = re.split(r"(\s+)", text_value.strip())
+    return dict(_morph_forms(text_value.strip()))
+
+
+@functools.lru_cache(maxsize=4096)
+def _morph_forms(text_value: str) -> tuple[tuple[str, str], ...]:
+    forms: list[tuple[str, str]] = []
+    parts = re.split(r"(\s+)", text_value)
     ww = [parts[i] for i in range(0, len(parts), 2)]
-    parses = [words.get_morph().parse(w) for w in ww]
-    for i in range(len(parses)):
-        parses[i] = [p for p in parses[i] if "nomn" in list(p.tag.grammemes)]
-    logging.debug(f"morph parses for parts {parses}")
+    # One (cached) parse per word, reused for every case below.
+    parses = [[p for p in words.parse_word(w) if "nomn" in p.tag.grammemes] for w in ww]
+    logging.debug("morph parses for parts %s", parses)
     if any(parses):
         for inf in words.case_tags:
-            ss = set(words.get_morph().cyr2lat(inf).split(","))
+            ss = set(words.grammemes(inf))
             t = ""
             for i in range(len(parts)):
                 j = i // 2
@@ -96,8 +102,8 @@ def morph_text(text_value: str) -> dict[str, str | None]:
                     t += parts[i]
                 else:
                     t += x.word
-            name_value[inf] = t
-    return name_value
+            forms.append((inf, t))
+    return tuple(forms)
 
 
 def import_text_row(
@@ -313,8 +319,11 @@ class TextSetNew(Command):
 
 
 class TextUpload(Command):
+    def matches(self, msg: Message) -> bool:
+        return msg.txt.strip() == msg.prefix + "upload"
+
     def run(self, msg: Message) -> tuple[list[Action], bool]:
-        if msg.txt.strip() != msg.prefix + "upload":
+        if not self.matches(msg):
             return [], True
         v = msg.get_variables()
         log = msg.log
@@ -323,8 +332,7 @@ class TextUpload(Command):
         log.info("looking for attachments")
         for att in discord_msg.attachments:
             log.info(f"attachment {att.filename} {att.size} {att.content_type}")
-            req = urllib.request.Request(att.url, headers={"User-Agent": "Mozilla/5.0"})
-            content = urllib.request.urlopen(req).read().decode("utf-8")
+            content = http_client.client().fetch_blocking(att.url).decode("utf-8")
             break
         channel_id = msg.channel_id
         all_tags: set[str] = set()
@@ -361,6 +369,9 @@ class TextUpload(Command):
     def help(self, prefix: str):
         return f"{prefix}upload"
 
+    def executor(self, msg: Message) -> executors.Executor:
+        return executors.BATCH if self.matches(msg) else executors.TEMPLATE
+
     def for_twitch(self):
         return False
 
@@ -425,6 +436,11 @@ class TextDownload(Command):
     def help_full(self, prefix: str):
         return f"{prefix}download [<substring>[;<tag query>]]"
 
+    def executor(self, msg: Message) -> executors.Executor:
+        if command_prefix(msg.txt, msg.prefix, ["download"]):
+            return executors.BATCH
+        return executors.TEMPLATE
+
 
 class TextSearch(Command):
     def run(self, msg: Message) -> tuple[list[Action], bool]:
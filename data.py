@@ -21,9 +21,11 @@ from enum import Enum, StrEnum
 
 import dacite
 from dacite.config import Config
-from jinja2.sandbox import SandboxedEnvironment
 
-templates = SandboxedEnvironment()
+import metrics
+import sandbox
+
+templates = sandbox.BudgetedSandbox()
 _is_dev = False
 
 
@@ -36,8 +38,14 @@ def is_dev() -> bool:
     return _is_dev
 
 
+_render_seconds = metrics.histogram(
+    "template_render_seconds", "Time to compile and render one template, nested ones included"
+)
+
+
 def render(text: str, vars: dict):
-    return templates.from_string(text).render(vars).strip()
+    with _render_seconds.time():
+        return sandbox.render(templates, text, vars).strip()
 
 
 @dataclasses.dataclass
@@ -87,25 +95,39 @@ def dictToCommandData(data: dict) -> CommandData:
 
 
 class InvocationLog:
+    """Per-invocation log that is also shown to moderators by `!debug`.
+
+    Messages use logging's %-style arguments and are stored unformatted, they are
+    only formatted when a log handler or `messages` (i.e. `!debug`) consumes them.
+    """
+
     def __init__(self, prefix):
-        self.messages = []
+        self.records: list[tuple[int, str, tuple]] = []
         self.prefix = prefix + " "
 
-    def info(self, s):
-        logging.info(self.prefix + s)
-        self.messages.append((logging.INFO, s))
+    def _add(self, level: int, s: str, args: tuple):
+        self.records.append((level, s, args))
+        if logging.getLogger().isEnabledFor(level):
+            if args:
+                logging.log(level, "%s" + s, self.prefix, *args)
+            else:
+                logging.log(level, "%s%s", self.prefix, s)
+
+    @property
+    def messages(self) -> list[tuple[int, str]]:
+        return [(level, s % args if args else s) for level, s, args in self.records]
+
+    def info(self, s, *args):
+        self._add(logging.INFO, s, args)
 
-    def warning(self, s):
-        logging.warning(self.prefix + s)
-        self.messages.append((logging.WARNING, s))
+    def warning(self, s, *args):
+        self._add(logging.WARNING, s, args)
 
-    def debug(self, s):
-        logging.debug(self.prefix + s)
-        self.messages.append((logging.DEBUG, s))
+    def debug(self, s, *args):
+        self._add(logging.DEBUG, s, args)
 
-    def error(self, s):
-        logging.error(self.prefix + s)
-        self.messages.append((logging.ERROR, s))
+    def error(self, s, *args):
+        self._add(logging.ERROR, s, args)
 
 
 def fold_actions(actions: list[Action]) -> list[Action]:
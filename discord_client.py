@@ -1,102 +1,107 @@
 import asyncio
-import dataclasses
-import hashlib
 import logging
 import logging.handlers
-import os
-import random
 import time
 import traceback
 from io import BytesIO
 from typing import Any
-from urllib.parse import urlparse
 
 import discord
-import requests
-import ttldict2
-from PIL import Image, ImageDraw, ImageFont
 
 import commands
-from data import Action, ActionKind, EventType, InvocationLog, Lazy, Message, is_dev
+import executors
+import inbox
+import metrics
+from active_users import ActiveUsers
+from banner import BannerRenderer
+from data import Action, ActionKind, EventType, InvocationLog, Lazy, Message
+from disk_cache import DiskCache
 from storage import db
 
+_action_seconds = metrics.histogram(
+    "discord_action_seconds", "Time from receiving a message to delivering an action"
+)
+_action_retries = metrics.counter("discord_action_retries_total", "Actions retried after a 429")
+_action_failures = metrics.counter("discord_action_failures_total", "Actions that failed to send")
+MAX_SEND_ATTEMPTS = 3
+
 
 def discord_literal(t):
     return t.replace("<@!", "<@")
 
 
-def download_file(url: str) -> str | None:
-    url_parts = urlparse(url)
-    name, ext = os.path.splitext(url_parts.path)
-    h = hashlib.new("SHA1")
-    h.update(url.encode("utf8"))
-    url_hash = h.hexdigest()
-    os.makedirs("runtime/img", exist_ok=True)
-    file_name = f"runtime/img/{url_hash}{ext}"
-    existing_error = False
-    if os.path.isfile(file_name):
-        with open(file_name, "rb") as f:
-            if f.read(6) == b"ERROR:":
-                existing_error = True
-        if not existing_error:
-            logging.debug(f'"{file_name}" already exist')
-            return file_name
-    try:
-        r = requests.get(url, allow_redirects=True)
-        r.raise_for_status()
-        with open(file_name, "wb") as f:
-            f.write(r.content)
-        return file_name
-    except Exception as e:
-        with open(file_name, "w", encoding="utf-8") as f:
-            f.write(f"ERROR: {e}")
-        if not existing_error:
-            raise e
-        return None
-
-
-@dataclasses.dataclass
-class BannerOverlay:
-    x: int
-    y: int
-    size: int
-    r: int
-    g: int
-    b: int
-    text: str
-
-
-def create_banner_image(
-    url: str, overlays: list[BannerOverlay], full_text_for_hash: str
-) -> BytesIO | None:
-    img_path = download_file(url)
-    if img_path is None:
-        return None
-    try:
-        image = Image.open(img_path)
-        image.load()
-    except Exception as e:
-        if os.path.isfile(img_path):
-            os.remove(img_path)
-        raise e
-    image_editable = ImageDraw.Draw(image)
-
-    for o in overlays:
-        title_font = ImageFont.truetype("arial.ttf", size=o.size)
-        image_editable.text((o.x, o.y), o.text, (o.r, o.g, o.b), font=title_font)
-
-    if is_dev():
-        h = hashlib.new("SHA1")
-        h.update(full_text_for_hash.encode("utf8"))
-        os.makedirs("runtime/img", exist_ok=True)
-        result_file = f"runtime/img/{h.hexdigest()}.png"
-        logging.info(f"saving dev result {result_file}")
-        image.save(result_file)
-
-    bb = BytesIO()
-    image.save(bb, format="png")
-    bb.seek(0)
-    return bb
+def action_destination(message: discord.Message, a: Action) -> tuple[str, int]:
+    """Actions with the same destination must be delivered in order, others may overlap."""
+    if a.kind == ActionKind.PRIVATE_MESSAGE:
+        return ("dm", message.author.id)
+    if a.kind == ActionKind.REACT_EMOJI:
+        return ("reaction", message.id)
+    return ("channel", message.channel.id)
+
+
+async def send_action(message: discord.Message, a: Action):
+    if a.kind == ActionKind.NEW_MESSAGE:
+        await message.channel.send(a.text)
+    if a.kind == ActionKind.REPLY:
+        if a.attachment:
+            await message.reply(
+                a.text,
+                file=discord.File(
+                    BytesIO(a.attachment.encode("utf-8")), filename=a.attachment_name
+                ),
+            )
+        else:
+            await message.reply(a.text)
+    if a.kind == ActionKind.PRIVATE_MESSAGE:
+        await message.author.send(a.text)
+    if a.kind == ActionKind.REACT_EMOJI:
+        await message.add_reaction(a.text)
+
+
+async def send_with_backoff(message: discord.Message, a: Action):
+    """discord.py already waits out short rate limits; this retries the ones it gives up on."""
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        try:
+            await send_action(message, a)
+            return
+        except discord.RateLimited as e:
+            delay = e.retry_after
+        except discord.HTTPException as e:
+            if e.status != 429:
+                raise
+            delay = 2.0**attempt
+        if attempt + 1 < MAX_SEND_ATTEMPTS:
+            _action_retries.inc(kind=a.kind.name)
+            logging.warning(
+                "[discord] rate limited sending %s, retrying in %.1fs", a.kind.name, delay
+            )
+            await asyncio.sleep(delay)
+    raise RuntimeError(f"rate limited {MAX_SEND_ATTEMPTS} times")
+
+
+async def deliver_actions(message: discord.Message, actions: list[Action], received: float):
+    """Sends actions concurrently, keeping their order within each destination.
+
+    `received` is the `time.monotonic()` when the message arrived; per-kind latency from
+    then to delivery goes to `discord_action_seconds`.
+    """
+    queues: dict[tuple[str, int], list[Action]] = {}
+    for a in actions:
+        if len(a.text) > 2000:
+            a.text = a.text[:1997] + "..."
+        queues.setdefault(action_destination(message, a), []).append(a)
+
+    async def deliver(queue: list[Action]):
+        for a in queue:
+            try:
+                await send_with_backoff(message, a)
+            except Exception as e:
+                _action_failures.inc(kind=a.kind.name)
+                logging.error("[discord] failed to send %s: %s", a.kind.name, e)
+                continue
+            _action_seconds.observe(time.monotonic() - received, kind=a.kind.name)
+
+    await asyncio.gather(*(deliver(q) for q in queues.values()))
 
 
 # https://discordpy.readthedocs.io/en/latest/api.html
@@ -107,8 +112,15 @@ class DiscordClient(discord.Client):
         self.mods: dict[str, str] = {}
         self.profile = profile
         self.dev_message = dev_message
+        self.banners = BannerRenderer(DiskCache("runtime/img"))
+        self.inbox = inbox.Inbox("discord")
         super().__init__(*args, **kwargs)
 
+    async def close(self):
+        self.inbox.close()
+        self.banners.close()
+        await super().close()
+
     async def on_ready(self):
         print(f"We have logged in as {self.user}")
         if self.dev_message:
@@ -123,6 +135,7 @@ class DiscordClient(discord.Client):
                         continue
 
     async def on_message(self, message: discord.Message):
+        received = time.monotonic()
         # Don't react to own messages.
         if message.author == self.user:
             return
@@ -149,7 +162,7 @@ class DiscordClient(discord.Client):
             if is_mod:
                 self.mods[str(message.author.id)] = guild_id
         try:
-            channel_id, prefix = await asyncio.to_thread(
+            channel_id, prefix = await executors.DB.run(
                 db().discord_channel_info, db().cursor(), guild_id
             )
         except Exception as e:
@@ -159,18 +172,16 @@ class DiscordClient(discord.Client):
             f"guild={guild_id} message_channel={message.channel.id} channel={channel_id} author={message.author.id}"
         )
         if channel_id not in self.channels:
-            allowed_channels = await asyncio.to_thread(
-                db().get_discord_allowed_channels, channel_id
-            )
+            allowed_channels = await executors.DB.run(db().get_discord_allowed_channels, channel_id)
             self.channels[channel_id] = {
-                "active_users": ttldict2.TTLDict(ttl_seconds=3600.0 * 2),
+                "active_users": ActiveUsers(ttl_s=3600.0 * 2),
                 "allowed_channels": allowed_channels,
             }
         text = commands.command_prefix(message.content, prefix, ["allow_here"])
         discord_channel = str(message.channel.id)
         if text and is_mod:
             self.channels[channel_id]["allowed_channels"].add(discord_channel)
-            await asyncio.to_thread(
+            await executors.DB.run(
                 db().set_discord_allowed_channels,
                 channel_id,
                 self.channels[channel_id]["allowed_channels"],
@@ -181,7 +192,7 @@ class DiscordClient(discord.Client):
         text = commands.command_prefix(message.content, prefix, ["disallow_here"])
         if text and is_mod:
             self.channels[channel_id]["allowed_channels"].discard(discord_channel)
-            await asyncio.to_thread(
+            await executors.DB.run(
                 db().set_discord_allowed_channels,
                 channel_id,
                 self.channels[channel_id]["allowed_channels"],
@@ -200,9 +211,8 @@ class DiscordClient(discord.Client):
             await self.on_cron()
             return
         if not message.author.bot:
-            self.channels[channel_id]["active_users"][discord_literal(message.author.mention)] = "+"
-        self.channels[channel_id]["active_users"].drop_old_items()
-        log.info(f'message "{message.content}"')
+            self.channels[channel_id]["active_users"].touch(discord_literal(message.author.mention))
+        log.info('message "%s"', message.content)
         variables: dict | None = None
         # postpone variable calculations as much as possible
         message_id = str(message.id)
@@ -221,19 +231,19 @@ class DiscordClient(discord.Client):
                     "author_name": discord_literal(str(message.author.display_name)),
                     "mention": Lazy(
                         lambda: self.any_mention(
-                            message, self.channels[channel_id]["active_users"].keys(), exclude
+                            message, self.channels[channel_id]["active_users"], exclude
                         )
                     ),
                     "direct_mention": Lazy(lambda: self.mentions(message)),
                     "random_mention": Lazy(
                         lambda: self.random_mention(
-                            message, self.channels[channel_id]["active_users"].keys(), exclude
+                            message, self.channels[channel_id]["active_users"], exclude
                         ),
                         stick=False,
                     ),
                     "any_mention": Lazy(
                         lambda: self.any_mention(
-                            message, self.channels[channel_id]["active_users"].keys(), [bot]
+                            message, self.channels[channel_id]["active_users"], [bot]
                         ),
                         stick=False,
                     ),
@@ -262,51 +272,37 @@ class DiscordClient(discord.Client):
             private=private,
             get_variables=get_vars,
         )
-        if self.profile:
-            start = time.time_ns()
-            i = 0
-            ns = 1000_000_000
-            while time.time_ns() - start < ns:
-                i += 1
+
+        async def process():
+            if self.profile:
+                start = time.time_ns()
+                i = 0
+                ns = 1000_000_000
+                while time.time_ns() - start < ns:
+                    i += 1
+                    actions = await commands.process_message(msg)
+                actions.append(
+                    Action(ActionKind.REPLY, text=f"{i} iterations in {time.time_ns() - start} ns")
+                )
+            else:
                 actions = await commands.process_message(msg)
-            actions.append(
-                Action(ActionKind.REPLY, text=f"{i} iterations in {time.time_ns() - start} ns")
+            await asyncio.gather(
+                executors.DB.run(db().add_log, channel_id, log),
+                deliver_actions(message, actions, received),
             )
-        else:
-            actions = await commands.process_message(msg)
-        await asyncio.to_thread(db().add_log, channel_id, log)
-        for a in actions:
-            if len(a.text) > 2000:
-                a.text = a.text[:1997] + "..."
-            if a.kind == ActionKind.NEW_MESSAGE:
-                await message.channel.send(a.text)
-            if a.kind == ActionKind.REPLY:
-                if a.attachment:
-                    await message.reply(
-                        a.text,
-                        file=discord.File(
-                            BytesIO(a.attachment.encode("utf-8")), filename=a.attachment_name
-                        ),
-                    )
-                else:
-                    await message.reply(a.text)
-            if a.kind == ActionKind.PRIVATE_MESSAGE:
-                await message.author.send(a.text)
-            if a.kind == ActionKind.REACT_EMOJI:
-                await message.add_reaction(a.text)
-
-    def random_mention(self, msg, users: list[str], exclude: list[str]):
-        users = [x for x in users if x not in exclude]
-        if users:
-            return random.choice(users)
-        return discord_literal(msg.author.mention)
+
+        kind = inbox.Kind.COMMAND if message.content.startswith(prefix) else inbox.Kind.CHATTER
+        self.inbox.submit(channel_id, process, kind)
+
+    def random_mention(self, msg, users: ActiveUsers, exclude: list[str]):
+        return users.random(exclude=exclude) or discord_literal(msg.author.mention)
 
     def mentions(self, msg):
         if msg.mentions:
             return " ".join([discord_literal(x.mention) for x in msg.mentions])
         return ""
 
-    def any_mention(self, msg, users: list[str], exclude: list[str]):
+    def any_mention(self, msg, users: ActiveUsers, exclude: list[str]):
         direct = self.mentions(msg)
         return direct if direct else self.random_mention(msg, users, exclude)
 
@@ -324,14 +320,14 @@ class DiscordClient(discord.Client):
                 guild_id_str = f"{g.id}"
                 if "BANNER" not in g.features:
                     continue
-                channel_id, prefix = await asyncio.to_thread(
+                channel_id, prefix = await executors.DB.run(
                     db().discord_channel_info, db().cursor(), guild_id_str
                 )
-                banner_template = await asyncio.to_thread(
+                banner_template = await executors.DB.run(
                     db().get_variable, channel_id, "banner_template", "admin", ""
                 )
                 log = InvocationLog(f"guild={guild_id_str} banner update")
-                log.debug(f'banner template "{banner_template}"')
+                log.debug('banner template "%s"', banner_template)
                 if not banner_template:
                     continue
                 if guild_id_str not in self.guild_data:
@@ -382,27 +378,11 @@ class DiscordClient(discord.Client):
                 if self.guild_data[guild_id_str]["banner_text"] == txt:
                     log.debug("banner text is the same")
                     continue
-                parts = txt.split(";;")
-                log.debug(parts[0])
-                url = parts[0].strip()
-                overlays = []
-                for p in parts[1:]:
-                    ox, oy, os, orr, og, ob, ot = p.split(",", 6)
-                    overlays.append(
-                        BannerOverlay(
-                            x=int(ox),
-                            y=int(oy),
-                            size=int(os),
-                            r=int(orr),
-                            g=int(og),
-                            b=int(ob),
-                            text=ot,
-                        )
-                    )
-                bb = create_banner_image(url, overlays, txt)
-                if bb is None:
+                log.debug("banner %s", txt)
+                png = await self.banners.render(txt)
+                if png is None:
                     continue
-                await g.edit(banner=bb.read())
+                await g.edit(banner=png)
                 self.guild_data[guild_id_str]["banner_text"] = txt
             except Exception as e:
                 logging.error(f"'cron update': {e}\n{traceback.format_exc()}")
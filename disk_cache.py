@@ -0,0 +1,222 @@
+"""Size-bounded on-disk cache of downloaded files (banner base images).
+
+Files live in one directory as `<sha1(url)><ext>`; an in-memory index (persisted to
+`index.json` in the same directory) keeps each entry's size, validators and fetch
+time, so lookups never touch the disk:
+
+- fresh entries are served as-is; entries older than `revalidate_after_s` are
+  revalidated with If-None-Match / If-Modified-Since, and served stale if that fails;
+- failed downloads are remembered for `negative_ttl_s` instead of being retried on
+  every call;
+- least recently used files are evicted once the directory exceeds `max_bytes`.
+
+Meant to be used from the event loop only. The index lives on the loop; writes of
+files and of the index and removal of evicted files run on a single `disk_cache`
+thread, in the order they were made. Stat calls stay on the loop.
+"""
+
+import collections
+import contextlib
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+import executors
+import http_client
+import metrics
+
+INDEX_FILE = "index.json"
+
+_lookups = metrics.counter("disk_cache_lookups_total", "Disk cache lookups by result")
+_bytes = metrics.gauge("disk_cache_bytes", "Bytes stored in the disk cache")
+# One thread, so index writes and removals happen in order.
+_io = executors.Executor("disk_cache", 1)
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    url: str
+    file: str  # name inside the cache directory; empty for failed downloads
+    size: int = 0
+    etag: str = ""
+    last_modified: str = ""
+    fetched_at: float = 0.0  # time.time() of the last download or revalidation
+    version: int = 0  # changes whenever the file content changes
+    error: str = ""
+    error_until: float = 0.0  # time.time() until which a failed download is not retried
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DiskCache:
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 200 * 1024 * 1024,
+        negative_ttl_s: float = 600.0,
+        revalidate_after_s: float = 3600.0,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.negative_ttl_s = negative_ttl_s
+        self.revalidate_after_s = revalidate_after_s
+        # sha1(url) -> entry, least recently used first.
+        self._index: collections.OrderedDict[str, CacheEntry] = collections.OrderedDict()
+        self.total_bytes = 0
+        self._load()
+
+    def path(self, entry: CacheEntry) -> str:
+        return os.path.join(self.directory, entry.file)
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), encoding="utf-8") as f:
+                raw = json.load(f)
+            for key, e in raw.items():
+                entry = CacheEntry(**e)
+                if entry.file and os.path.isfile(self.path(entry)):
+                    self._index[key] = entry
+                    self.total_bytes += entry.size
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError, AttributeError) as e:
+            logging.warning(f"disk cache {self.directory}: ignoring broken index: {e}")
+        # Files the index doesn't know about (older layouts, ERROR markers, partial
+        # downloads) can't be revalidated or accounted for.
+        known = {e.file for e in self._index.values()} | {INDEX_FILE}
+        for name in os.listdir(self.directory):
+            full = os.path.join(self.directory, name)
+            if name not in known and os.path.isfile(full):
+                os.remove(full)
+        _bytes.set(self.total_bytes, cache=self.directory)
+
+    async def _save(self):
+        # Snapshot on the loop, where the index changes; serialize and write on `_io`.
+        await _io.run(
+            self._write_index, [(k, dataclasses.asdict(e)) for k, e in self._index.items()]
+        )
+
+    def _write_index(self, items: list[tuple[str, dict]]):
+        tmp = os.path.join(self.directory, INDEX_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dict(items), f)
+        os.replace(tmp, os.path.join(self.directory, INDEX_FILE))
+
+    @staticmethod
+    def _remove_files(paths: list[str]):
+        for path in paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha1(url.encode("utf8")).hexdigest()
+
+    async def get(self, url: str) -> CacheEntry | None:
+        """The cached file for `url`, downloading or revalidating it as needed.
+
+        Raises DownloadError if the file can't be fetched and there is no usable copy,
+        then returns None for the same URL until the negative TTL expires.
+        """
+        key = self.key(url)
+        now = time.time()
+        entry = self._index.get(key)
+        if entry is not None:
+            self._index.move_to_end(key)
+            if entry.error and now < entry.error_until:
+                _lookups.inc(cache=self.directory, result="negative")
+                return None
+            if entry.file and now - entry.fetched_at < self.revalidate_after_s:
+                _lookups.inc(cache=self.directory, result="hit")
+                return entry
+        return await self._fetch(key, url, entry, now)
+
+    async def _fetch(self, key: str, url: str, entry: CacheEntry | None, now: float):
+        _, ext = os.path.splitext(urlparse(url).path)
+        if entry is None or not entry.file:
+            entry = CacheEntry(url=url, file=f"{key}{ext}")
+        headers = {}
+        if os.path.isfile(self.path(entry)):
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        try:
+            resp = await http_client.client().download(url, self.path(entry), headers=headers)
+        except Exception as e:
+            if entry.size and os.path.isfile(self.path(entry)):
+                # Keep serving the copy we have; try again after the negative TTL.
+                logging.warning(f"disk cache: revalidating {url} failed, serving stale: {e}")
+                entry.fetched_at = now - self.revalidate_after_s + self.negative_ttl_s
+                self._index[key] = entry
+                _lookups.inc(cache=self.directory, result="stale")
+                return entry
+            _lookups.inc(cache=self.directory, result="error")
+            self._index[key] = CacheEntry(
+                url=url, file="", error=str(e), error_until=now + self.negative_ttl_s
+            )
+            await self._save()
+            raise DownloadError(str(e)) from e
+        if resp is None:
+            _lookups.inc(cache=self.directory, result="revalidated")
+        else:
+            _lookups.inc(cache=self.directory, result="miss")
+            self.total_bytes -= entry.size
+            entry.size = os.path.getsize(self.path(entry))
+            self.total_bytes += entry.size
+            entry.etag = resp.get("ETag", "")
+            entry.last_modified = resp.get("Last-Modified", "")
+            entry.version = time.time_ns()
+        entry.fetched_at = now
+        entry.error = ""
+        entry.error_until = 0.0
+        self._index[key] = entry
+        self._index.move_to_end(key)
+        await self._evict()
+        await self._save()
+        return entry
+
+    async def store(self, name: str, data: bytes) -> str:
+        """Writes generated content (e.g. dev-mode banner renders) under the byte budget."""
+        key = self.key(f"local:{name}")
+        entry = CacheEntry(url=f"local:{name}", file=name, size=len(data), fetched_at=time.time())
+        await _io.run(self._write_file, self.path(entry), data)
+        old = self._index.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old.size
+        self._index[key] = entry
+        self.total_bytes += entry.size
+        await self._evict()
+        await self._save()
+        return self.path(entry)
+
+    async def _evict(self):
+        evicted = []
+        while self.total_bytes > self.max_bytes and len(self._index) > 1:
+            _, old = self._index.popitem(last=False)
+            if old.file:
+                self.total_bytes -= old.size
+                evicted.append(self.path(old))
+        _bytes.set(self.total_bytes, cache=self.directory)
+        if evicted:
+            await _io.run(self._remove_files, evicted)
+
+    async def invalidate(self, url: str):
+        """Forgets `url`, e.g. when its file turned out not to be a valid image."""
+        entry = self._index.pop(self.key(url), None)
+        if entry is not None and entry.file:
+            self.total_bytes -= entry.size
+            await _io.run(self._remove_files, [self.path(entry)])
+            await self._save()
@@ -1,13 +1,32 @@
+// MOON_RABBIT_SHARDS=n runs the bot as n processes, each owning a part of the
+// channels (see sharding.py). Each shard needs its own Twitch
+// EventSub conduit: MOON_RABBIT_TWITCH_CONDUITS=id1,id2,...
+const shards = parseInt(process.env.MOON_RABBIT_SHARDS || '1', 10);
+const conduits = (process.env.MOON_RABBIT_TWITCH_CONDUITS || '').split(',').filter(Boolean);
+if (shards > 1 && conduits.length < shards) {
+  throw new Error(`MOON_RABBIT_SHARDS=${shards} needs as many MOON_RABBIT_TWITCH_CONDUITS, ` +
+                  `got ${conduits.length}`);
+}
+
+function bot(i) {
+  let args = 'run python3 main.py --discord --twitch moon_robot';
+  if (shards === 1) {
+    return {name: 'moon-rabbit', args: `${args} --log runtime/merged`};
+  }
+  args += ` --shard_id ${i} --shard_count ${shards} --twitch_conduit_id ${conduits[i]}`;
+  args += ` --log runtime/merged-${i}`;
+  return {name: `moon-rabbit-${i}`, args};
+}
+
 module.exports = {
   apps: [
-    {
-      name: 'moon-rabbit',
+    ...Array.from({length: shards}, (_, i) => ({
+      ...bot(i),
       script: 'uv',
-      args: 'run python3 main.py --discord --twitch moon_robot --log runtime/merged',
       cwd: '/var/moon-rabbit',
       autorestart: true,
       log_date_format: "YYYY-MM-DD HH:mm:ss",
-    },
+    })),
     {
       name: 'moon-rabbit-backup',
       script: './runtime/pg_backup.sh',
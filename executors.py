@@ -0,0 +1,113 @@
+"""Named thread pools, one per kind of blocking work.
+
+`asyncio.to_thread` runs everything on the loop's single default executor, so a
+burst of slow `+upload` imports could take every worker and starve chat replies.
+Blocking work goes through one of these instead:
+
+- `DB` — short database calls (channel info, command lists, logs, tokens, expiry);
+- `TEMPLATE` — running commands: regexes, Jinja renders, word inflection;
+- `BATCH` — long jobs like `+upload` and `+download`, which may queue behind each
+  other without holding up the rest.
+
+    channel_id, prefix = await executors.DB.run(db().discord_channel_info, cur, guild_id)
+
+Like `to_thread`, `run()` copies the caller's context variables into the worker.
+Each executor exports `executor_queued{executor}` (submitted, not started),
+`executor_active{executor}`, `executor_workers{executor}` and
+`executor_wait_seconds{executor}` (time from submit to start).
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+import metrics
+
+DB_WORKERS = 8
+TEMPLATE_WORKERS = 4
+BATCH_WORKERS = 2
+
+_queued = metrics.gauge("executor_queued", "Tasks submitted to an executor and not started")
+_active = metrics.gauge("executor_active", "Tasks running on an executor")
+_workers = metrics.gauge("executor_workers", "Threads of an executor")
+_wait = metrics.histogram(
+    "executor_wait_seconds",
+    "Time tasks waited for an executor thread",
+    buckets=metrics.WAIT_BUCKETS,
+)
+
+
+class Executor:
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        # Plain counts, copied into the gauges on collection: a labelled gauge update
+        # per transition would cost more than the rest of `run()`.
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        _executors.append(self)
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> concurrent.futures.Future:
+        ctx = contextvars.copy_context()
+        submitted = time.monotonic()
+
+        def call():
+            started = time.monotonic()
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+            _wait.observe(started - submitted, executor=self.name)
+            try:
+                return ctx.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+        with self._lock:
+            self.queued += 1
+        future = self._pool.submit(call)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: concurrent.futures.Future):
+        if future.cancelled():  # never started
+            with self._lock:
+                self.queued -= 1
+
+    async def run(self, fn: Callable, /, *args, **kwargs) -> Any:
+        """Runs `fn(*args, **kwargs)` on the executor and returns its result."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self in _executors:
+            _executors.remove(self)
+
+
+_executors: list[Executor] = []
+
+DB = Executor("db", DB_WORKERS)
+TEMPLATE = Executor("template", TEMPLATE_WORKERS)
+BATCH = Executor("batch", BATCH_WORKERS)
+
+
+@metrics.on_collect
+def _collect():
+    for e in _executors:
+        _queued.set(e.queued, executor=e.name)
+        _active.set(e.active, executor=e.name)
+        _workers.set(e.max_workers, executor=e.name)
+
+
+def shutdown():
+    """Cancels queued tasks of every executor; running ones finish in the background."""
+    while _executors:
+        _executors.pop().shutdown()
@@ -0,0 +1,161 @@
+"""Shared async HTTP client for downloads (banner images, uploaded text files).
+
+One pooled `aiohttp.ClientSession` per process, created lazily on the event loop:
+
+    data = await http_client.client().fetch(url)
+    await http_client.client().download(url, "runtime/img/x.png")
+
+Every request has a total timeout and a size limit; bodies are streamed and the
+request is aborted as soon as the limit is exceeded. `download` writes the file on
+the `http_download` thread, never on the loop. Code running on a worker thread
+(e.g. commands) uses `fetch_blocking`, which runs the request on the event loop.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+from collections.abc import Mapping
+from typing import BinaryIO
+
+import aiohttp
+
+import executors
+
+DEFAULT_TIMEOUT_S = 15.0
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+_CHUNK = 64 * 1024
+
+# One thread, so the chunks of a download are written in order.
+_io = executors.Executor("http_download", 1)
+
+
+class ResponseTooLarge(Exception):
+    pass
+
+
+class HttpClient:
+    def __init__(
+        self,
+        timeout_s: float = DEFAULT_TIMEOUT_S,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        limit: int = 20,
+        limit_per_host: int = 4,
+    ):
+        self.timeout_s = timeout_s
+        self.max_bytes = max_bytes
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._session: aiohttp.ClientSession | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def session(self) -> aiohttp.ClientSession:
+        """The pooled session, (re)created on the running loop if needed."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            if self._session is not None and not self._session.closed:
+                self._close_on_old_loop(self._session, self._loop)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit, limit_per_host=self.limit_per_host
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout_s),
+                headers={"User-Agent": "Mozilla/5.0"},
+            )
+            self._loop = loop
+        return self._session
+
+    @staticmethod
+    def _close_on_old_loop(session: aiohttp.ClientSession, old: asyncio.AbstractEventLoop | None):
+        # The session's transports belong to `old`, so it must be closed there.
+        logging.debug("http client session moved to a different event loop")
+        if old is None or old.is_closed():
+            logging.warning("http client: dropping a session whose event loop is closed")
+            return
+        asyncio.run_coroutine_threadsafe(session.close(), old)
+
+    async def _chunks(self, resp: aiohttp.ClientResponse, max_bytes: int):
+        resp.raise_for_status()
+        if resp.content_length is not None and resp.content_length > max_bytes:
+            raise ResponseTooLarge(f"{resp.url}: {resp.content_length} bytes > {max_bytes}")
+        size = 0
+        async for chunk in resp.content.iter_chunked(_CHUNK):
+            size += len(chunk)
+            if size > max_bytes:
+                raise ResponseTooLarge(f"{resp.url}: more than {max_bytes} bytes")
+            yield chunk
+
+    async def fetch(self, url: str, max_bytes: int | None = None) -> bytes:
+        """GETs `url` into memory."""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        async with self.session().get(url) as resp:
+            return b"".join([c async for c in self._chunks(resp, limit)])
+
+    async def download(
+        self,
+        url: str,
+        path: str,
+        max_bytes: int | None = None,
+        headers: Mapping[str, str] | None = None,
+    ) -> Mapping[str, str] | None:
+        """GETs `url` into `path`; the file only appears once the download is complete.
+
+        Returns the response headers, or None if the server answered 304 Not Modified to
+        a conditional request (`headers` with If-None-Match / If-Modified-Since).
+        """
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        tmp = f"{path}.part"
+        f = None
+        try:
+            async with self.session().get(url, headers=headers) as resp:
+                if resp.status == 304:
+                    return None
+                f = await _io.run(open, tmp, "wb")
+                async for chunk in self._chunks(resp, limit):
+                    await _io.run(f.write, chunk)
+                result = resp.headers
+            await _io.run(_finish, f, tmp, path)
+            return result
+        finally:
+            if f is not None:
+                await _io.run(_discard, f, tmp)
+
+    def fetch_blocking(self, url: str, max_bytes: int | None = None) -> bytes:
+        """`fetch` for worker threads; must not be called on the event loop thread."""
+        if self._loop is None or self._loop.is_closed():
+            raise RuntimeError("http client is not attached to an event loop")
+        future = asyncio.run_coroutine_threadsafe(self.fetch(url, max_bytes), self._loop)
+        return future.result(timeout=self.timeout_s + 1.0)
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Binds the client to `loop` before first use, so worker threads can use it."""
+        self._loop = loop
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def _finish(f: BinaryIO, tmp: str, path: str):
+    f.close()
+    os.replace(tmp, path)
+
+
+def _discard(f: BinaryIO, tmp: str):
+    f.close()
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(tmp)
+
+
+_client: HttpClient | None = None
+_lock = threading.Lock()
+
+
+def client() -> HttpClient:
+    global _client
+    with _lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
@@ -0,0 +1,12 @@
+"""Imported first by `main.py`: times the imports that follow, for the startup report.
+
+See `startup.time_imports()`; `main.py` calls `stop()` after its imports.
+"""
+
+import startup
+
+startup.time_imports()
+
+
+def stop():
+    startup.imports_done()
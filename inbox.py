@@ -0,0 +1,155 @@
+"""Per-channel incoming event queues with bounded concurrency and load shedding.
+
+Event handlers `submit()` the processing of an event and return immediately. Each
+channel has a FIFO queue drained by one task, so a channel's events are processed
+in the order they arrived, one at a time; at most `max_active` channels are
+processed at once, taking turns every `burst` events. When a queue grows,
+cheap-to-lose events go first:
+
+- `Kind.CHATTER` (messages that don't start with the command prefix) is refused
+  once the channel has `shed_at` queued events, and dropped when it has waited
+  longer than `chatter_ttl_s` — a reply to it would be late anyway;
+- commands and platform events (`Kind.COMMAND`, `Kind.EVENT`) are only refused when
+  the channel has `max_pending` queued events.
+
+Clients tell commands from chatter by the command prefix alone. Custom commands whose
+pattern matches plain chat (a greeting, a keyword) are `Kind.CHATTER` too, and are
+shed like it under load: matching every channel command on the event loop would be
+the work this queue exists to defer, and a late reaction to chatter is worth little.
+"""
+
+import asyncio
+import collections
+import dataclasses
+import enum
+import logging
+import time
+from collections.abc import Awaitable, Callable, Hashable
+
+import metrics
+
+_queued = metrics.gauge("inbox_queued", "Incoming events waiting to be processed")
+_active = metrics.gauge("inbox_active_channels", "Channels whose events are being processed")
+_wait = metrics.histogram(
+    "inbox_wait_seconds",
+    "Time incoming events waited before processing, by kind",
+    buckets=metrics.WAIT_BUCKETS,
+)
+_dropped = metrics.counter(
+    "inbox_dropped_total", "Incoming events dropped before processing, by kind and reason"
+)
+
+
+class Kind(enum.Enum):
+    COMMAND = "command"
+    EVENT = "event"
+    CHATTER = "chatter"
+
+
+@dataclasses.dataclass
+class _Incoming:
+    kind: Kind
+    received: float
+    process: Callable[[], Awaitable[None]]
+
+
+class Inbox:
+    def __init__(
+        self,
+        name: str,
+        max_active: int = 8,
+        shed_at: int = 20,
+        max_pending: int = 100,
+        chatter_ttl_s: float = 10.0,
+        burst: int = 10,
+    ):
+        self.name = name
+        self.burst = burst
+        self.shed_at = shed_at
+        self.max_pending = max_pending
+        self.chatter_ttl_s = chatter_ttl_s
+        self._slots = asyncio.Semaphore(max_active)
+        self._queues: dict[Hashable, collections.deque[_Incoming]] = {}
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        self._active = 0
+        _inboxes.append(self)
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def pending(self, channel: Hashable) -> int:
+        q = self._queues.get(channel)
+        return len(q) if q else 0
+
+    def submit(self, channel: Hashable, process: Callable[[], Awaitable[None]], kind: Kind) -> bool:
+        """Queues `process()` behind the channel's earlier events. Returns False, without
+        calling it, if the event was shed. Never blocks."""
+        q = self._queues.get(channel)
+        if q is None:
+            q = self._queues[channel] = collections.deque()
+        limit = self.shed_at if kind == Kind.CHATTER else self.max_pending
+        if len(q) >= limit:
+            _dropped.inc(inbox=self.name, kind=kind.value, reason="full")
+            if kind != Kind.CHATTER:
+                logging.warning(
+                    "[inbox %s] queue of %s full, dropping %s", self.name, channel, kind
+                )
+            return False
+        q.append(_Incoming(kind, time.monotonic(), process))
+        task = self._tasks.get(channel)
+        if task is None or task.done():
+            self._tasks[channel] = asyncio.get_running_loop().create_task(self._run(channel))
+        return True
+
+    async def _run(self, channel: Hashable):
+        q = self._queues[channel]
+        while q:
+            # A channel gives its slot back after `burst` events, so a flooded
+            # channel takes turns with the others instead of holding a slot.
+            async with self._slots:
+                self._active += 1
+                try:
+                    for _ in range(self.burst):
+                        if not q:
+                            break
+                        await self._process(q.popleft())
+                finally:
+                    self._active -= 1
+        # Forget idle channels; a new event creates the queue again.
+        self._queues.pop(channel, None)
+        self._tasks.pop(channel, None)
+
+    async def _process(self, item: _Incoming):
+        waited = time.monotonic() - item.received
+        if item.kind == Kind.CHATTER and waited > self.chatter_ttl_s:
+            _dropped.inc(inbox=self.name, kind=item.kind.value, reason="stale")
+            return
+        _wait.observe(waited, inbox=self.name, kind=item.kind.value)
+        try:
+            await item.process()
+        except Exception:
+            logging.exception("[inbox %s] processing failed", self.name)
+
+    async def drain(self):
+        """Waits until everything queued so far has been processed or dropped."""
+        while tasks := [t for t in self._tasks.values() if not t.done()]:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        """Cancels processing and discards queued events."""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._queues.clear()
+        if self in _inboxes:
+            _inboxes.remove(self)
+
+
+_inboxes: list[Inbox] = []
+
+
+@metrics.on_collect
+def _collect():
+    for inbox in _inboxes:
+        _queued.set(len(inbox), inbox=inbox.name)
+        _active.set(inbox._active, inbox=inbox.name)
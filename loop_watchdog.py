@@ -0,0 +1,121 @@
+"""Event loop lag watchdog.
+
+A heartbeat task sleeps for `interval_s` at a time and observes how late it wakes up
+as `event_loop_lag_seconds`. A sampling thread watches the heartbeat: once the loop
+has not come back for `threshold_s`, the callback running on it is blocking, and the
+thread captures the loop thread's current stack, logs it and counts it in
+`event_loop_blocks_total{where}` (the innermost frame). Each block is reported once,
+with its stack taken while it is still blocking; the last `max_blocks` are kept for
+`recent()`.
+
+    watchdog = LoopWatchdog(loop)
+    watchdog.start()
+"""
+
+import asyncio
+import collections
+import dataclasses
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+_lag = metrics.histogram("event_loop_lag_seconds", "How late the event loop heartbeat woke up")
+_lag_quantile = metrics.gauge(
+    "event_loop_lag_quantile_seconds", "Event loop lag percentiles since start"
+)
+_blocks = metrics.counter(
+    "event_loop_blocks_total", "Callbacks that blocked the event loop, by innermost frame"
+)
+
+
+@metrics.on_collect
+def _collect_quantiles():
+    for q in (0.5, 0.9, 0.99):
+        _lag_quantile.set(_lag.quantile(q), quantile=str(q))
+
+
+@dataclasses.dataclass
+class Block:
+    at: float  # time.time() when it was captured
+    blocked_s: float  # how long the loop had been blocked at that point
+    where: str
+    stack: str
+
+
+class LoopWatchdog:
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        interval_s: float = 0.1,
+        threshold_s: float = 0.25,
+        max_blocks: int = 20,
+    ):
+        self.loop = loop
+        self.interval_s = interval_s
+        self.threshold_s = threshold_s
+        self._blocks: collections.deque[Block] = collections.deque(maxlen=max_blocks)
+        self._lock = threading.Lock()
+        self._beat: float | None = None  # time.monotonic() when the heartbeat went to sleep
+        self._reported_beat: float | None = None
+        self._loop_thread: int | None = None
+        self._stopped = threading.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = self.loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self.loop.call_soon_threadsafe(self._task.cancel)
+
+    def recent(self) -> list[Block]:
+        with self._lock:
+            return list(self._blocks)
+
+    async def _heartbeat(self):
+        self._loop_thread = threading.get_ident()
+        try:
+            while True:
+                start = time.monotonic()
+                self._beat = start
+                await asyncio.sleep(self.interval_s)
+                lag = max(0.0, time.monotonic() - start - self.interval_s)
+                _lag.observe(lag)
+                if lag >= self.threshold_s:
+                    logging.warning(f"event loop was blocked for {lag * 1000:.0f} ms")
+        finally:
+            # Cancelled at shutdown: the loop stops beating, that's not a block.
+            self._stopped.set()
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval_s / 2):
+            beat = self._beat
+            if beat is None or beat == self._reported_beat:
+                continue
+            blocked = time.monotonic() - beat - self.interval_s
+            if blocked < self.threshold_s:
+                continue
+            self._reported_beat = beat
+            self._capture(blocked)
+
+    def _capture(self, blocked_s: float):
+        frame = sys._current_frames().get(self._loop_thread or 0)
+        if frame is None:
+            return
+        summary = traceback.extract_stack(frame)
+        last = summary[-1]
+        where = f"{os.path.basename(last.filename)}:{last.name}"
+        stack = "".join(traceback.format_list(summary))
+        with self._lock:
+            self._blocks.append(Block(time.time(), blocked_s, where, stack))
+        _blocks.inc(where=where)
+        logging.warning(
+            f"event loop blocked for {blocked_s * 1000:.0f} ms so far in {where}:\n{stack}"
+        )
@@ -21,12 +21,17 @@
 # TODO DB indexes
 """Bot entry point."""
 
+import import_timer  # isort: skip  # must come first to time the imports below
+
 import argparse
 import asyncio
+import atexit
+import copy
 import datetime
 import logging
 import logging.handlers
 import os
+import queue
 import sys
 import traceback
 
@@ -34,19 +39,28 @@ import discord
 import twitchio
 from dotenv import load_dotenv
 
+import executors
+import http_client
+import loop_watchdog
+import metrics_http
+import sharding
+import startup
 import templates
 import twitch_client
+import words
 from data import set_is_dev
 from discord_client import DiscordClient
 from notifier import NtfyHandler
 from storage import DB, db, set_db
 
+import_timer.stop()
+
 
 async def expireVariables():
     while True:
         try:
-            await asyncio.to_thread(db().expire_variables)
-            await asyncio.to_thread(db().expire_old_queries)
+            await executors.DB.run(db().expire_variables)
+            await executors.DB.run(db().expire_old_queries)
         except Exception:
             logging.exception("expireVariables failed")
         await asyncio.sleep(300)
@@ -63,6 +77,8 @@ async def shutdown(
     if twitch_bot:
         logging.info("Closing Twitch client...")
         shutdown_tasks.append(twitch_bot.close())
+    shutdown_tasks.append(http_client.client().close())
+    shutdown_tasks.append(metrics_http.stop())
 
     if shutdown_tasks:
         try:
@@ -80,6 +96,22 @@ async def shutdown(
         for task in tasks:
             task.cancel()
         await asyncio.gather(*tasks, return_exceptions=True)
+    executors.shutdown()
+
+
+class UnformattedQueueHandler(logging.handlers.QueueHandler):
+    """Puts records on the queue without formatting them.
+
+    The stdlib `QueueHandler.prepare()` formats the whole record (timestamp, traceback)
+    on the calling thread. Here only the message is merged with its arguments, which
+    snapshots mutable arguments; `exc_info` is kept for the listener's formatters.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
 
 
 class DiscordClientFilter(logging.Filter):
@@ -143,12 +175,18 @@ def run_loop(
     loop: asyncio.AbstractEventLoop,
     discord_client: DiscordClient | None,
     twitch_bot: twitch_client.TwitchClient | None,
+    loop_block_ms: int = 250,
+    maintenance: bool = True,
 ):
-    """Run the main event loop and handle graceful shutdown."""
+    """Run the main event loop and handle graceful shutdown. `maintenance` runs the
+    DB-wide background tasks; with several shards only the primary one does."""
+    watchdog = loop_watchdog.LoopWatchdog(loop, threshold_s=loop_block_ms / 1000)
     try:
         logging.info("running the async loop")
         loop.set_exception_handler(exception_handler)
-        loop.create_task(expireVariables())
+        if maintenance:
+            loop.create_task(expireVariables())
+        watchdog.start()
         loop.run_forever()
     except KeyboardInterrupt:
         logging.info("Caught KeyboardInterrupt, shutting down...")
@@ -156,6 +194,8 @@ def run_loop(
         logging.error(f"Caught unexpected exception: {e}\n{traceback.format_exc()}")
     finally:
         logging.info("Commencing shutdown...")
+        # The loop isn't running between run_forever() and shutdown: not a block.
+        watchdog.stop()
         # Run the shutdown tasks until complete
         loop.run_until_complete(shutdown(discord_client, twitch_bot))
         loop.close()
@@ -168,45 +208,64 @@ async def cron(client: DiscordClient | twitch_client.TwitchClient, cron_interval
         await asyncio.sleep(cron_interval_s)
 
 
-def setup_logging(log_prefix: str, also_log_to_stdout: bool):
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "OFF"]
+
+
+def setup_logging(
+    log_prefix: str,
+    also_log_to_stdout: bool,
+    debug_level: str = "DEBUG",
+    info_level: str = "INFO",
+    errors_level: str = "ERROR",
+    stdout_level: str = "DEBUG",
+) -> logging.handlers.QueueListener:
     """Configure multi-level file logging with automatic size-based rotation.
 
-    Creates three log files:
-      {log_prefix}.debug.log  — all levels (50MB, 8 backups)
-      {log_prefix}.info.log   — INFO+ (20MB, 8 backups)
-      {log_prefix}.errors.log — ERROR+ (10MB, 8 backups)
+    Creates three log files (each can be turned off by setting its level to "OFF"):
+      {log_prefix}.debug.log  — debug_level+ (50MB, 8 backups)
+      {log_prefix}.info.log   — info_level+ (20MB, 8 backups)
+      {log_prefix}.errors.log — errors_level+ (10MB, 8 backups)
+
+    Loggers only merge the message and put the record on a queue; formatting
+    (timestamps, tracebacks), disk writes and rotation happen on the QueueListener
+    thread. The root level is the lowest enabled handler level,
+    so disabled records are rejected before they are even formatted.
     """
     log_fmt = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
-    debugHandler = logging.handlers.RotatingFileHandler(
-        f"{log_prefix}.debug.log", encoding="utf-8", maxBytes=50_000_000, backupCount=8
-    )
-    debugHandler.setLevel(logging.DEBUG)
-    debugHandler.setFormatter(log_fmt)
-    infoHandler = logging.handlers.RotatingFileHandler(
-        f"{log_prefix}.info.log", encoding="utf-8", maxBytes=20_000_000, backupCount=8
-    )
-    infoHandler.setLevel(logging.INFO)
-    infoHandler.setFormatter(log_fmt)
-    errHandler = logging.handlers.RotatingFileHandler(
-        f"{log_prefix}.errors.log", encoding="utf-8", maxBytes=10_000_000, backupCount=8
-    )
-    errHandler.setLevel(logging.ERROR)
-    errHandler.setFormatter(log_fmt)
-    logging.basicConfig(
-        handlers=[debugHandler, infoHandler, errHandler],
-        format="%(asctime)s %(levelname)s %(message)s",
-        level=logging.DEBUG,
-    )
-    if also_log_to_stdout:
+    handlers: list[logging.Handler] = []
+    for suffix, level, max_bytes in [
+        ("debug", debug_level, 50_000_000),
+        ("info", info_level, 20_000_000),
+        ("errors", errors_level, 10_000_000),
+    ]:
+        if level == "OFF":
+            continue
+        h = logging.handlers.RotatingFileHandler(
+            f"{log_prefix}.{suffix}.log", encoding="utf-8", maxBytes=max_bytes, backupCount=8
+        )
+        h.setLevel(level)
+        h.setFormatter(log_fmt)
+        handlers.append(h)
+    if also_log_to_stdout and stdout_level != "OFF":
         stdoutHandler = logging.StreamHandler()
+        stdoutHandler.setLevel(stdout_level)
         stdoutHandler.setFormatter(log_fmt)
-        logging.getLogger().addHandler(stdoutHandler)
+        handlers.append(stdoutHandler)
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # runs before logging.shutdown(), drains the queue
+    root = logging.getLogger()
+    root.addHandler(UnformattedQueueHandler(log_queue))
+    root.setLevel(min((h.level for h in handlers), default=logging.ERROR))
     logging.getLogger("discord.client").addFilter(DiscordClientFilter())
+    # ntfy formats exception info itself; its emit() only enqueues, so it stays on the root.
     ntfy = NtfyHandler.from_env()
     if ntfy is not None:
-        logging.getLogger().addHandler(ntfy)
+        root.addHandler(ntfy)
         logging.info("ntfy notifications enabled")
         ntfy.send("moon-rabbit started", "Application has started successfully.")
+    return listener
 
 
 def require_env(name: str) -> str:
@@ -218,7 +277,8 @@ def require_env(name: str) -> str:
 
 
 def main():
-    templates.register_template_globals()
+    with startup.phase("templates"):
+        templates.register_template_globals()
     parser = argparse.ArgumentParser(description="moon rabbit")
     parser.add_argument("--twitch")
     parser.add_argument("--discord", action="store_true")
@@ -227,22 +287,64 @@ def main():
     parser.add_argument("--channel_id")
     parser.add_argument("--also_log_to_stdout", action="store_true")
     parser.add_argument("--log", default="bot")
+    parser.add_argument("--debug_log_level", default="DEBUG", choices=LOG_LEVELS)
+    parser.add_argument("--info_log_level", default="INFO", choices=LOG_LEVELS)
+    parser.add_argument("--errors_log_level", default="ERROR", choices=LOG_LEVELS)
+    parser.add_argument("--stdout_log_level", default="DEBUG", choices=LOG_LEVELS)
     parser.add_argument("--profile", action="store_true")
     parser.add_argument("--cron_interval_s", default="600")
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=4343,
+        help="Port of the /metrics server without --twitch (with it, /metrics is on 4343); "
+        "plus the shard id",
+    )
+    parser.add_argument(
+        "--loop_block_ms",
+        type=int,
+        default=250,
+        help="Log the stack of event loop callbacks that block it for longer than this",
+    )
+    parser.add_argument(
+        "--shard_id", type=int, default=0, help="This process's shard, see sharding.py"
+    )
+    parser.add_argument("--shard_count", type=int, default=1)
+    parser.add_argument(
+        "--twitch_conduit_id",
+        help="EventSub conduit of this process; each shard needs its own",
+    )
     parser.add_argument(
         "--dev",
         action="store_true",
         help="Dev mode: send a smoke-test message to all channels on connect",
     )
     args = parser.parse_args()
+    try:
+        shard = sharding.Shard(args.shard_id, args.shard_count)
+    except ValueError as e:
+        parser.error(str(e))
+    if shard.count > 1 and args.twitch and not args.twitch_conduit_id:
+        # Without it twitchio takes over the existing conduit, in every shard.
+        parser.error("--twitch_conduit_id is required with --shard_count > 1")
     load_dotenv()
-    setup_logging(args.log, args.also_log_to_stdout)
+    setup_logging(
+        args.log,
+        args.also_log_to_stdout,
+        debug_level=args.debug_log_level,
+        info_level=args.info_log_level,
+        errors_level=args.errors_log_level,
+        stdout_level=args.stdout_log_level,
+    )
+    words.prewarm()
     db_connection = require_env("DB_CONNECTION")
     logging.info(f"connecting to {db_connection}")
-    set_db(DB(db_connection))
-    db().check_database()
+    with startup.phase("database"):
+        set_db(DB(db_connection))
+        db().check_database()
     logging.info(f"args {args}")
     loop = asyncio.new_event_loop()
+    http_client.client().attach(loop)
     # loop = asyncio.get_running_loop()
     dev_msg = None
     if args.dev:
@@ -257,9 +359,15 @@ def main():
             logging.info("starting Discord Bot")
             intents = discord.Intents.default()
             intents.message_content = True
-            discordClient = DiscordClient(
-                intents=intents, loop=loop, profile=args.profile, dev_message=dev_msg
-            )
+            with startup.phase("discord client"):
+                discordClient = DiscordClient(
+                    intents=intents,
+                    loop=loop,
+                    profile=args.profile,
+                    dev_message=dev_msg,
+                    shard_id=shard.id,
+                    shard_count=shard.count,
+                )
             discord_token = require_env("DISCORD_TOKEN")
             loop.create_task(discordClient.start(discord_token))
             loop.create_task(cron(discordClient, int(args.cron_interval_s)))
@@ -267,11 +375,14 @@ def main():
             logging.error(f"{e}\n{traceback.format_exc()}")
     if args.twitch:
         try:
-            twitch_bot = twitch_client.TwitchClient(
-                twitch_bot=args.twitch,
-                dev_message=dev_msg,
-                domain=require_env("TWITCH_OAUTH_DOMAIN").removesuffix("/"),
-            )
+            with startup.phase("twitch client"):
+                twitch_bot = twitch_client.TwitchClient(
+                    twitch_bot=args.twitch,
+                    dev_message=dev_msg,
+                    domain=require_env("TWITCH_OAUTH_DOMAIN").removesuffix("/"),
+                    shard=shard,
+                    conduit_id=args.twitch_conduit_id,
+                )
             logging.info(
                 f"Channel Owner Authorization URL {twitch_bot.adapter.get_authorization_url(scopes=twitchio.Scopes(channel_bot=True, channel_read_redemptions=True, channel_read_hype_train=True), force_verify=True)}"  # type: ignore
             )
@@ -282,8 +393,11 @@ def main():
             loop.create_task(cron(twitch_bot, int(args.cron_interval_s)))
         except Exception as e:
             logging.error(f"{e}\n{traceback.format_exc()}")
+    if args.discord and not args.twitch:
+        loop.create_task(metrics_http.start("0.0.0.0", shard.port(args.metrics_port)))
     if args.twitch or args.discord:
-        run_loop(loop, discordClient, twitch_bot)
+        startup.report()
+        run_loop(loop, discordClient, twitch_bot, args.loop_block_ms, shard.primary)
         sys.exit(0)
     print("add --twitch or --discord argument to run bot")
     sys.exit(1)
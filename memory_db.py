@@ -0,0 +1,292 @@
+"""In-process storage backend with the semantics of the PostgreSQL schema.
+
+`MemoryDB` is a `storage.DB` whose rows live in dicts instead of PostgreSQL; the
+channel cache, random text selection and inflected forms are inherited unchanged.
+It is selected the same way as the real backend:
+
+    storage.set_db(MemoryDB())
+
+Meant for benchmarks (the pipeline at its CPU ceiling, and the database overhead by
+comparison) and fast tests. Nothing is persisted, and code that runs its own SQL
+through `cursor()` (the Twitch client's bot and channel lookup) is not supported.
+"""
+
+import contextlib
+import copy
+import dataclasses
+import itertools
+import json
+import logging
+import threading
+import time
+
+import storage
+from data import CommandData, dictToCommandData
+
+
+@dataclasses.dataclass
+class _Channel:
+    channel_id: int
+    discord_guild_id: str | None = None
+    discord_command_prefix: str | None = None
+    twitch_channel_name: str | None = None
+    twitch_command_prefix: str | None = None
+    discord_allowed_channels: str | None = None
+
+
+@dataclasses.dataclass
+class _Command:
+    id: int
+    author: str
+    data: dict
+
+
+class _NoSQLCursor(contextlib.AbstractContextManager):
+    """What `cursor()` returns: usable as a context manager, but can't run SQL."""
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, *args, **kwargs):
+        raise NotImplementedError("MemoryDB does not run SQL")
+
+
+class MemoryDB(storage.DB):
+    def __init__(self):
+        # Not calling DB.__init__: there is no connection.
+        self.connection_string = "memory"
+        self.channels = {}
+        self.channels_lock = threading.Lock()
+        self.logs = {}
+        self.rng = storage.random
+        # One lock for all tables; statements are short, like single SQL statements.
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._channels: dict[int, _Channel] = {}
+        self._tags: dict[int, tuple[int, str]] = {}  # id -> (channel_id, value)
+        self._texts: dict[int, tuple[int, str]] = {}  # id -> (channel_id, value)
+        self._text_tags: dict[int, dict[int, str | None]] = {}  # text_id -> tag_id -> value
+        self._commands: dict[tuple[int, str], _Command] = {}  # (channel_id, name)
+        # (channel_id, category) -> name -> (value, expires)
+        self._variables: dict[tuple[int, str], dict[str, tuple[str, int]]] = {}
+        self._tokens: dict[str, tuple[str, str]] = {}
+
+    def cursor(self):
+        return _NoSQLCursor()
+
+    # Channels.
+
+    def new_channel_id(self):
+        with self._lock:
+            return max(self._channels, default=-1) + 1
+
+    def twitch_channel_info(self, cur, name: str) -> tuple[int, str]:
+        with self._lock:
+            for c in self._channels.values():
+                if c.twitch_channel_name == name:
+                    return c.channel_id, c.twitch_command_prefix or ""
+            c = _Channel(self.new_channel_id(), twitch_channel_name=name, twitch_command_prefix="+")
+            self._channels[c.channel_id] = c
+        logging.info(f"added Twitch channel ID '{name}' #{c.channel_id} '+'")
+        return c.channel_id, "+"
+
+    def discord_channel_info(self, cur, guild_id: str) -> tuple[int, str]:
+        with self._lock:
+            for c in self._channels.values():
+                if c.discord_guild_id == guild_id:
+                    return c.channel_id, c.discord_command_prefix or ""
+            c = _Channel(
+                self.new_channel_id(), discord_guild_id=guild_id, discord_command_prefix="+"
+            )
+            self._channels[c.channel_id] = c
+        logging.info(f"added Discord channel ID '{guild_id}' #{c.channel_id}")
+        return c.channel_id, "+"
+
+    def set_twitch_prefix(self, channel_id: int, prefix: str):
+        with self._lock:
+            if channel_id in self._channels:
+                self._channels[channel_id].twitch_command_prefix = prefix
+
+    def set_discord_prefix(self, channel_id: int, prefix: str):
+        with self._lock:
+            if channel_id in self._channels:
+                self._channels[channel_id].discord_command_prefix = prefix
+
+    def get_discord_allowed_channels(self, channel_id: int) -> set[str]:
+        c = self._channels.get(channel_id)
+        if c is None or not c.discord_allowed_channels:
+            return set()
+        return set(c.discord_allowed_channels.split(","))
+
+    def set_discord_allowed_channels(self, channel_id: int, allowed: set[str]):
+        with self._lock:
+            if channel_id in self._channels:
+                self._channels[channel_id].discord_allowed_channels = ",".join(allowed)
+
+    def check_database(self):
+        for c in self._channels.values():
+            logging.info((c.channel_id, c.discord_guild_id, c.twitch_channel_name))
+
+    # Tags and texts.
+
+    def _select_tags(self, channel_id: int) -> list[tuple[int, str]]:
+        with self._lock:
+            return [(i, v) for i, (c, v) in self._tags.items() if c == channel_id]
+
+    def _insert_tag(self, channel_id: int, tag_name: str):
+        with self._lock:
+            if (channel_id, tag_name) not in self._tags.values():
+                self._tags[next(self._ids)] = (channel_id, tag_name)
+
+    def _delete_tag_row(self, channel_id: int, tag_id: int) -> int:
+        with self._lock:
+            if self._tags.get(tag_id, (None,))[0] != channel_id:
+                return 0
+            del self._tags[tag_id]
+            for values in self._text_tags.values():
+                values.pop(tag_id, None)
+            return 1
+
+    def _select_texts(self, channel_id: int) -> tuple[list[int], list[tuple[int, int, str | None]]]:
+        with self._lock:
+            ids = [i for i, (c, _) in self._texts.items() if c == channel_id]
+            rows = [(i, t, v) for i in ids for t, v in self._text_tags.get(i, {}).items()]
+            return ids, rows
+
+    def _select_text_values(self, channel_id: int, substring: str = "") -> list[tuple[int, str]]:
+        with self._lock:
+            return [
+                (i, v) for i, (c, v) in self._texts.items() if c == channel_id and substring in v
+            ]
+
+    def _insert_text(self, channel_id: int, value: str) -> int:
+        with self._lock:
+            existing = self.find_text(channel_id, value)
+            if existing is not None:
+                return existing
+            text_id = next(self._ids)
+            self._texts[text_id] = (channel_id, value)
+            return text_id
+
+    def _update_text(self, channel_id: int, id: int, value: str):
+        with self._lock:
+            if self._texts.get(id, (None,))[0] == channel_id:
+                self._texts[id] = (channel_id, value)
+
+    def _delete_text_row(self, channel_id: int, text_id: int) -> int:
+        with self._lock:
+            if self._texts.get(text_id, (None,))[0] != channel_id:
+                return 0
+            del self._texts[text_id]
+            self._text_tags.pop(text_id, None)
+            return 1
+
+    def _replace_text_tags(self, text_id: int, new_tags: dict[int, str | None]):
+        with self._lock:
+            self._text_tags[text_id] = dict(new_tags)
+
+    def get_text(self, channel_id: int, id: int) -> str | None:
+        c, value = self._texts.get(id, (None, None))
+        return value if c == channel_id else None
+
+    def find_text(self, channel_id: int, value: str) -> int | None:
+        with self._lock:
+            for i, (c, v) in self._texts.items():
+                if c == channel_id and v == value:
+                    return i
+            return None
+
+    def get_text_tag_values(self, channel_id: int, text_id: int) -> dict[int, str | None]:
+        if self._texts.get(text_id, (None,))[0] != channel_id:
+            return {}
+        return dict(self._text_tags.get(text_id, {}))
+
+    def get_text_tag_value(self, channel_id: int, text_id: int, tag_id: int) -> str | None:
+        return self.get_text_tag_values(channel_id, text_id).get(tag_id)
+
+    # Commands.
+
+    def get_commands(self, channel_id, prefix) -> list[CommandData]:
+        with self._lock:
+            dicts = [
+                copy.deepcopy(c.data) for (ch, _), c in self._commands.items() if ch == channel_id
+            ]
+        return [dictToCommandData(x) for x in dicts]
+
+    def set_command(self, cur, channel_id: int, author: str, cmd: CommandData) -> int:
+        # Through JSON like the jsonb column, so enums are stored as their values.
+        data = json.loads(json.dumps(dataclasses.asdict(cmd)))
+        with self._lock:
+            existing = self._commands.get((channel_id, cmd.name))
+            if existing is not None:
+                existing.data = data
+                return existing.id
+            c = _Command(id=next(self._ids), author=author, data=data)
+            self._commands[(channel_id, cmd.name)] = c
+            return c.id
+
+    def delete_command(self, channel_id: int, name: str):
+        with self._lock:
+            self._commands.pop((channel_id, name), None)
+
+    # Variables.
+
+    def set_variable(self, channel_id: int, name: str, value: str, category: str, expires: int):
+        with self._lock:
+            if value == "":
+                self._variables.get((channel_id, category), {}).pop(name, None)
+                return
+            self._variables.setdefault((channel_id, category), {})[name] = (value, expires)
+
+    def get_variable(self, channel_id: int, name: str, category: str, default_value: str):
+        value, expires = self._variables.get((channel_id, category), {}).get(name, (None, 0))
+        if value is None or expires < time.time():
+            return default_value
+        return value
+
+    def _live_variables(self, channel_id: int, category: str) -> list[tuple[str, str]]:
+        now = int(time.time())
+        with self._lock:
+            items = list(self._variables.get((channel_id, category), {}).items())
+        return [(name, value) for name, (value, expires) in items if expires >= now]
+
+    def count_variables_in_category(self, channel_id: int, category: str) -> int:
+        return len(self._live_variables(channel_id, category))
+
+    def list_variables(self, channel_id: int, category: str) -> list[tuple[str, str]]:
+        return self._live_variables(channel_id, category)
+
+    def delete_category(self, channel_id: int, category: str) -> int:
+        with self._lock:
+            return len(self._variables.pop((channel_id, category), {}))
+
+    def expire_variables(
+        self,
+        batch_size: int = storage.EXPIRE_BATCH_SIZE,
+        max_batches: int = storage.EXPIRE_MAX_BATCHES,
+    ) -> int:
+        now = int(time.time())
+        limit = batch_size * max_batches
+        total = 0
+        with storage._variables_expiry_seconds.time(), self._lock:
+            for key, names in list(self._variables.items()):
+                for name, (_, expires) in list(names.items()):
+                    if total >= limit:
+                        break
+                    if expires < now:
+                        del names[name]
+                        total += 1
+                if not names:
+                    del self._variables[key]
+        storage._variables_expired.inc(total)
+        return total
+
+    # Twitch tokens.
+
+    def save_twitch_token(self, user_id: str, token: str, refresh: str):
+        with self._lock:
+            self._tokens[user_id] = (token, refresh)
+
+    def load_twitch_tokens(self) -> list[tuple[str, str]]:
+        with self._lock:
+            return list(self._tokens.values())
@@ -0,0 +1,237 @@
+"""Process-wide operational metrics: counters, gauges and histograms.
+
+Metrics are created on first use and live for the whole process:
+
+    deleted = metrics.counter("variables_expired_total", "Expired variables deleted")
+    deleted.inc(n)
+
+Every metric accepts optional string labels (`inc(channel="1")`), each label
+combination is tracked as a separate series. All operations are thread-safe.
+
+`exposition()` renders every metric in the Prometheus text format (served on
+`/metrics` by `metrics_http`). Values kept elsewhere, like `functools.lru_cache`
+statistics, are copied into gauges by functions registered with `on_collect()`,
+which run before each exposition.
+"""
+
+import bisect
+import contextlib
+import logging
+import math
+import threading
+import time
+from collections.abc import Callable, Iterator
+
+LabelKey = tuple[tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# For queueing delays, which are often exactly zero and can reach minutes.
+WAIT_BUCKETS = (0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+
+def _key(labels: dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        k = _key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_key(labels), 0.0)
+
+    def series(self) -> dict[LabelKey, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        k = _key(labels)
+        with self._lock:
+            self._values[k] = value
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class HistogramSeries:
+    def __init__(self, n_buckets: int):
+        self.buckets = [0] * n_buckets
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.bounds = tuple(sorted(buckets))
+        self._series: dict[LabelKey, HistogramSeries] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        k = _key(labels)
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            s = self._series.get(k)
+            if s is None:
+                s = HistogramSeries(len(self.bounds))
+                self._series[k] = s
+            if i < len(self.bounds):
+                s.buckets[i] += 1
+            s.count += 1
+            s.sum += value
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observes the wall time of the `with` block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            s = self._series.get(_key(labels))
+            return s.count if s else 0
+
+    def quantile(self, q: float, **labels) -> float:
+        """Estimates quantile `q` (0..1) from bucket counts, as Prometheus does."""
+        with self._lock:
+            s = self._series.get(_key(labels))
+            if not s or not s.count:
+                return 0.0
+            rank = q * s.count
+            seen = 0
+            lower = 0.0
+            for bound, n in zip(self.bounds, s.buckets, strict=True):
+                if n and seen + n >= rank:
+                    return lower + (bound - lower) * (rank - seen) / n
+                seen += n
+                lower = bound
+            return self.bounds[-1]
+
+    def series(self) -> dict[LabelKey, HistogramSeries]:
+        with self._lock:
+            z = {}
+            for k, s in self._series.items():
+                c = HistogramSeries(len(self.bounds))
+                c.buckets = list(s.buckets)
+                c.count = s.count
+                c.sum = s.sum
+                z[k] = c
+            return z
+
+
+_lock = threading.Lock()
+_registry: dict[str, Metric] = {}
+
+
+def _get_or_create(cls, name: str, help: str, **kwargs):
+    with _lock:
+        m = _registry.get(name)
+        if m is None:
+            m = cls(name, help, **kwargs)
+            _registry[name] = m
+        elif type(m) is not cls:
+            raise ValueError(f"metric {name} is already registered as {m.kind}")
+        return m
+
+
+def counter(name: str, help: str) -> Counter:
+    return _get_or_create(Counter, name, help)
+
+
+def gauge(name: str, help: str) -> Gauge:
+    return _get_or_create(Gauge, name, help)
+
+
+def histogram(name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return _get_or_create(Histogram, name, help, buckets=buckets)
+
+
+def all_metrics() -> list[Metric]:
+    with _lock:
+        return list(_registry.values())
+
+
+_collectors: list[Callable[[], None]] = []
+
+
+def on_collect(fn: Callable[[], None]) -> Callable[[], None]:
+    """Registers `fn` to update metrics right before each `exposition()`."""
+    with _lock:
+        _collectors.append(fn)
+    return fn
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key: LabelKey, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    if v == int(v) and abs(v) < 1e15:
+        return str(int(v))
+    return repr(v)
+
+
+def exposition() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        collectors = list(_collectors)
+    for fn in collectors:
+        try:
+            fn()
+        except Exception:
+            logging.exception("metrics collector %s failed", fn)
+    lines = []
+    for m in sorted(all_metrics(), key=lambda m: m.name):
+        help_text = m.help.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {m.name} {help_text}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        if isinstance(m, Histogram):
+            for key, s in sorted(m.series().items()):
+                cumulative = 0
+                for bound, n in zip(m.bounds, s.buckets, strict=True):
+                    cumulative += n
+                    le = (("le", _number(bound)),)
+                    lines.append(f"{m.name}_bucket{_labels(key, le)} {cumulative}")
+                inf = (("le", "+Inf"),)
+                lines.append(f"{m.name}_bucket{_labels(key, inf)} {s.count}")
+                lines.append(f"{m.name}_sum{_labels(key)} {_number(s.sum)}")
+                lines.append(f"{m.name}_count{_labels(key)} {s.count}")
+        elif isinstance(m, Counter):
+            for key, v in sorted(m.series().items()):
+                lines.append(f"{m.name}{_labels(key)} {_number(v)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,48 @@
+"""Serves `metrics.exposition()` on `/metrics` for Prometheus.
+
+With Twitch enabled the route is added to the client's `AiohttpAdapter`, the OAuth
+server on port 4343. A Discord-only bot has no HTTP server, so `start()` runs a
+small one just for the route:
+
+    metrics_http.add_route(adapter)          # before the adapter starts
+    await metrics_http.start("0.0.0.0", 4343)
+"""
+
+import asyncio
+import logging
+
+from aiohttp import web
+
+import metrics
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_runner: web.AppRunner | None = None
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    # Collectors may take locks held by worker threads; keep them off the event loop.
+    text = await asyncio.to_thread(metrics.exposition)
+    return web.Response(body=text.encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+def add_route(app: web.Application):
+    app.router.add_get("/metrics", handle_metrics)
+
+
+async def start(host: str, port: int):
+    """Starts a standalone server with only `/metrics`."""
+    global _runner
+    app = web.Application()
+    add_route(app)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    logging.info(f"metrics on http://{host}:{port}/metrics")
+
+
+async def stop():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -13,9 +13,13 @@ Required env vars:
     NTFY_SERVER  — optional, defaults to "https://ntfy.sh"
 """
 
+import contextlib
+import dataclasses
 import hashlib
 import logging
 import os
+import queue
+import threading
 import time
 import traceback
 import urllib.error
@@ -23,16 +27,36 @@ import urllib.request
 from typing import Optional
 
 
+@dataclasses.dataclass
+class _Notification:
+    fingerprint: str  # empty for one-off notifications that bypass deduplication
+    title: str
+    body: str
+    priority: str
+    tags: str
+    record: logging.LogRecord | None = None
+    repeats: int = 1
+
+
 class NtfyHandler(logging.Handler):
     """Logging handler that sends ERROR+ records to an ntfy topic.
 
     Deduplicates by fingerprinting the error site: same exception type+message,
     or same call-site+message-prefix, within dedup_window_s are suppressed.
     Failed HTTP calls do not advance the dedup clock, so the next occurrence retries.
+
+    emit() never touches the network: records are queued and delivered by a background
+    thread, so an ntfy outage cannot stall the logging caller (e.g. the asyncio loop).
+    Records that are already queued with the same fingerprint are coalesced into one
+    notification, records arriving while the queue is full are dropped and counted,
+    and everything queued during a POST is delivered as one batch.
     """
 
     DEFAULT_SERVER = "https://ntfy.sh"
     DEFAULT_DEDUP_WINDOW_S = 3600
+    DEFAULT_MAX_QUEUE = 100
+    DEFAULT_MAX_BATCH = 10
+    MAX_BODY = 4096
 
     def __init__(
         self,
@@ -40,12 +64,25 @@ class NtfyHandler(logging.Handler):
         server: str = DEFAULT_SERVER,
         dedup_window_s: int = DEFAULT_DEDUP_WINDOW_S,
         timeout_s: int = 5,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        max_batch: int = DEFAULT_MAX_BATCH,
     ):
         super().__init__(level=logging.ERROR)
         self._url = f"{server.rstrip('/')}/{topic}"
         self._dedup_window_s = dedup_window_s
         self._timeout_s = timeout_s
+        self._max_batch = max_batch
         self._seen: dict[str, float] = {}
+        self._queue: queue.Queue[_Notification | None] = queue.Queue(maxsize=max_queue)
+        self._pending: dict[str, _Notification] = {}  # fingerprint -> queued notification
+        self._unfinished = 0
+        self._state = threading.Condition()
+        self._worker: threading.Thread | None = None
+        # Delivery statistics, read by whoever wants to export them.
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
         self.setFormatter(
             logging.Formatter("%(asctime)s %(levelname)s %(name)s:%(lineno)d %(message)s")
         )
@@ -72,49 +109,159 @@ class NtfyHandler(logging.Handler):
             raw = f"{record.pathname}:{record.lineno}:{msg}"
         return hashlib.sha256(raw.encode()).hexdigest()[:16]
 
+    def _recently_sent(self, fp: str, now: float) -> bool:
+        sent_at = self._seen.get(fp)
+        return sent_at is not None and now - sent_at < self._dedup_window_s
+
     def send(self, title: str, body: str) -> None:
-        """Send a one-off notification, bypassing deduplication."""
-        try:
-            req = urllib.request.Request(
-                self._url,
-                data=body[:4096].encode("utf-8"),
-                headers={
-                    "Title": title,
-                    "Priority": "default",
-                    "Tags": "white_check_mark",
-                    "Content-Type": "text/plain; charset=utf-8",
-                },
-                method="POST",
+        """Queue a one-off notification, bypassing deduplication."""
+        self._enqueue(
+            _Notification(
+                fingerprint="",
+                title=title,
+                body=body[: self.MAX_BODY],
+                priority="default",
+                tags="white_check_mark",
             )
-            with urllib.request.urlopen(req, timeout=self._timeout_s):
-                pass
-        except Exception:
-            logging.getLogger(__name__).warning("ntfy send failed", exc_info=True)
+        )
 
     def emit(self, record: logging.LogRecord) -> None:
         fp = self._fingerprint(record)
-        now = time.monotonic()
-        if now - self._seen.get(fp, 0.0) < self._dedup_window_s:
-            return
+        with self._state:
+            if self._recently_sent(fp, time.monotonic()):
+                return
+            pending = self._pending.get(fp)
+            if pending is not None:
+                pending.repeats += 1
+                self.coalesced += 1
+                return
         try:
             body = self.format(record)
             if record.exc_info and record.exc_info[1] is not None:
                 tb_lines = traceback.format_exception(*record.exc_info)
                 body += "\n" + "".join(tb_lines[-6:])
-            body = body[:4096]
+            self._enqueue(
+                _Notification(
+                    fingerprint=fp,
+                    title=f"[{record.levelname}] {record.name}",
+                    body=body[: self.MAX_BODY],
+                    priority="high" if record.levelno >= logging.CRITICAL else "default",
+                    tags="rotating_light" if record.levelno >= logging.ERROR else "warning",
+                    record=record,
+                )
+            )
+        except Exception:
+            self.handleError(record)  # writes to stderr, never raises
+
+    def _enqueue(self, n: _Notification) -> None:
+        with self._state:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="ntfy-delivery", daemon=True)
+                self._worker.start()
+            try:
+                self._queue.put_nowait(n)
+            except queue.Full:
+                self.dropped += 1
+                return
+            self._unfinished += 1
+            if n.fingerprint:
+                self._pending[n.fingerprint] = n
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            n = self._queue.get()
+            if n is None:
+                return
+            batch = [n]
+            while len(batch) < self._max_batch:
+                try:
+                    n = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if n is None:
+                    stop = True  # deliver what we have, then exit
+                    break
+                batch.append(n)
+            self._deliver(batch)
+
+    def _deliver(self, batch: list[_Notification]) -> None:
+        with self._state:
+            for n in batch:
+                self._pending.pop(n.fingerprint, None)
+            # Another record with the same fingerprint may have been sent meanwhile.
+            now = time.monotonic()
+            todo = [
+                n for n in batch if not (n.fingerprint and self._recently_sent(n.fingerprint, now))
+            ]
+        try:
+            if todo:
+                self._post(todo)
+        finally:
+            with self._state:
+                self._unfinished -= len(batch)
+                self._state.notify_all()
+
+    def _post(self, batch: list[_Notification]) -> None:
+        first = batch[0]
+        if len(batch) == 1:
+            title, priority, tags = first.title, first.priority, first.tags
+        else:
+            title = f"{first.title} (+{len(batch) - 1} more)"
+            priority = "high" if any(n.priority == "high" for n in batch) else "default"
+            tags = first.tags
+        parts = []
+        for n in batch:
+            body = n.body
+            if n.repeats > 1:
+                body = f"(repeated {n.repeats} times) {body}"
+            if len(batch) > 1:
+                body = f"{n.title}\n{body}"
+            parts.append(body)
+        body = "\n\n---\n\n".join(parts)[: self.MAX_BODY]
+        try:
             req = urllib.request.Request(
                 self._url,
                 data=body.encode("utf-8"),
                 headers={
-                    "Title": f"[{record.levelname}] {record.name}",
-                    "Priority": "high" if record.levelno >= logging.CRITICAL else "default",
-                    "Tags": "rotating_light" if record.levelno >= logging.ERROR else "warning",
+                    "Title": title,
+                    "Priority": priority,
+                    "Tags": tags,
                     "Content-Type": "text/plain; charset=utf-8",
                 },
                 method="POST",
             )
             with urllib.request.urlopen(req, timeout=self._timeout_s):
                 pass
-            self._seen[fp] = now  # only mark sent after successful POST
         except Exception:
-            self.handleError(record)  # writes to stderr, never raises
+            self.failed += len(batch)
+            for n in batch:
+                if n.record is not None:
+                    self.handleError(n.record)  # writes to stderr, never raises
+                else:
+                    logging.getLogger(__name__).warning("ntfy send failed", exc_info=True)
+            return
+        now = time.monotonic()
+        with self._state:
+            self.sent += len(batch)
+            for n in batch:
+                if n.fingerprint:
+                    self._seen[n.fingerprint] = now  # only mark sent after successful POST
+
+    def flush(self, timeout_s: float | None = None) -> bool:
+        """Wait until every queued notification is delivered; returns False on timeout."""
+        if timeout_s is None:
+            timeout_s = 2.0 * self._timeout_s
+        with self._state:
+            return self._state.wait_for(lambda: self._unfinished == 0, timeout=timeout_s)
+
+    def close(self) -> None:
+        self.flush()
+        with self._state:
+            worker = self._worker
+            self._worker = None
+        if worker is not None:
+            with contextlib.suppress(queue.Full):
+                self._queue.put(None, timeout=self._timeout_s)
+            worker.join(timeout=self._timeout_s)
+        super().close()
@@ -0,0 +1,131 @@
+"""Per-channel outgoing message queue with priorities, coalescing and deadlines.
+
+Event handlers `put()` messages and return immediately; a background task per
+outbox delivers them one at a time through `send`, which is expected to do its own
+rate limiting. While a send waits, later messages pile up and are merged:
+
+- direct replies go before event output, which goes before cron output;
+- consecutive messages of the same priority are joined into one message of up to
+  `max_len` characters;
+- messages still queued after their deadline are dropped.
+"""
+
+import asyncio
+import dataclasses
+import enum
+import heapq
+import itertools
+import logging
+import time
+from collections.abc import Awaitable, Callable
+
+import metrics
+
+_dropped = metrics.counter("outbox_dropped_total", "Outgoing messages dropped before sending")
+_coalesced = metrics.counter(
+    "outbox_coalesced_total", "Outgoing messages merged into a previous message"
+)
+
+
+class Priority(enum.IntEnum):
+    REPLY = 0
+    EVENT = 1
+    CRON = 2
+
+
+# How long a message may wait in the queue before it is no longer worth sending.
+DEFAULT_TTL_S = {Priority.REPLY: 60.0, Priority.EVENT: 60.0, Priority.CRON: 30.0}
+
+
+@dataclasses.dataclass(order=True)
+class _Outgoing:
+    priority: Priority
+    seq: int
+    deadline: float = dataclasses.field(compare=False)
+    text: str = dataclasses.field(compare=False)
+
+
+class Outbox:
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[None]],
+        name: str,
+        max_len: int = 500,
+        max_pending: int = 50,
+        separator: str = " ",
+    ):
+        self.send = send
+        self.name = name
+        self.max_len = max_len
+        self.max_pending = max_pending
+        self.separator = separator
+        self._heap: list[_Outgoing] = []
+        self._seq = itertools.count()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def put(self, text: str, priority: Priority = Priority.REPLY, ttl_s: float | None = None):
+        """Queues `text` and makes sure the delivery task is running. Never blocks."""
+        if not text:
+            return
+        if len(self._heap) >= self.max_pending:
+            _dropped.inc(outbox=self.name, reason="full")
+            logging.warning("[outbox %s] queue full, dropping %r", self.name, text)
+            return
+        if ttl_s is None:
+            ttl_s = DEFAULT_TTL_S[priority]
+        heapq.heappush(
+            self._heap, _Outgoing(priority, next(self._seq), time.monotonic() + ttl_s, text)
+        )
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _next(self) -> str | None:
+        """Pops the next message to send, merged with followers of the same priority."""
+        now = time.monotonic()
+        while self._heap:
+            first = heapq.heappop(self._heap)
+            if first.deadline >= now:
+                break
+            _dropped.inc(outbox=self.name, reason="stale")
+            logging.info("[outbox %s] dropping stale message %r", self.name, first.text)
+        else:
+            return None
+        parts = [first.text]
+        size = len(first.text)
+        while self._heap:
+            nxt = self._heap[0]
+            if nxt.priority != first.priority:
+                break
+            if nxt.deadline < now:
+                heapq.heappop(self._heap)
+                _dropped.inc(outbox=self.name, reason="stale")
+                continue
+            if size + len(self.separator) + len(nxt.text) > self.max_len:
+                break
+            heapq.heappop(self._heap)
+            parts.append(nxt.text)
+            size += len(self.separator) + len(nxt.text)
+            _coalesced.inc(outbox=self.name)
+        return self.separator.join(parts)
+
+    async def _run(self):
+        while (text := self._next()) is not None:
+            try:
+                await self.send(text)
+            except Exception:
+                logging.exception("[outbox %s] send failed", self.name)
+
+    async def drain(self):
+        """Waits until everything queued so far has been delivered or dropped."""
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    def close(self):
+        """Cancels delivery and discards pending messages."""
+        self._heap.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
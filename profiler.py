@@ -0,0 +1,185 @@
+"""Opt-in per-channel profiler for commands, template functions and DB methods.
+
+Off by default. A mod turns it on for a channel (`+profile on`, see
+`commands.builtins.Profile`) for a limited time; while it is on, every profiled
+section that runs for the channel records its wall and CPU (thread) time:
+
+    with profiler.section("regex", name):
+        ...
+
+    @profiler.profiled("db")
+    def get_variable(...): ...
+
+Sections are attributed to the channel set by `set_channel()` (done by
+`commands.process_message()`; `executors.Executor.run()` copies the context into
+its worker threads). Samples go to a per-channel ring buffer of the last
+`BUFFER_SIZE` sections, and `report()` aggregates them by kind and name. Times are
+inclusive: a `txt` that renders a nested template also contains the DB methods it
+called.
+
+With profiling off for the channel, a section costs a dict lookup.
+"""
+
+import collections
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import threading
+import time
+from collections.abc import Callable, Iterator
+
+BUFFER_SIZE = 5000
+DEFAULT_DURATION_S = 30 * 60
+MAX_DURATION_S = 24 * 60 * 60
+
+
+@dataclasses.dataclass
+class Sample:
+    kind: str  # "command", "regex", "template", "db"
+    name: str
+    wall_s: float
+    cpu_s: float
+
+
+@dataclasses.dataclass
+class Stats:
+    kind: str
+    name: str
+    calls: int = 0
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    max_wall_s: float = 0.0
+
+
+_channel: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "profiler_channel", default=None
+)
+_lock = threading.Lock()
+# channel_id -> time.monotonic() when profiling turns itself off
+_enabled: dict[int, float] = {}
+_samples: dict[int, collections.deque[Sample]] = {}
+
+
+def enable(channel_id: int, duration_s: float = DEFAULT_DURATION_S):
+    with _lock:
+        _enabled[channel_id] = time.monotonic() + duration_s
+        _samples.setdefault(channel_id, collections.deque(maxlen=BUFFER_SIZE))
+
+
+def disable(channel_id: int):
+    with _lock:
+        _enabled.pop(channel_id, None)
+
+
+def reset(channel_id: int):
+    with _lock:
+        _samples.pop(channel_id, None)
+        if channel_id in _enabled:
+            _samples[channel_id] = collections.deque(maxlen=BUFFER_SIZE)
+
+
+def remaining_s(channel_id: int) -> float:
+    """Seconds until profiling turns off for the channel, 0 if it is off."""
+    until = _enabled.get(channel_id)
+    return max(0.0, until - time.monotonic()) if until is not None else 0.0
+
+
+def set_channel(channel_id: int | None) -> contextvars.Token:
+    return _channel.set(channel_id)
+
+
+def reset_channel(token: contextvars.Token):
+    _channel.reset(token)
+
+
+def _active_channel() -> int | None:
+    if not _enabled:
+        return None
+    channel_id = _channel.get()
+    until = _enabled.get(channel_id) if channel_id is not None else None
+    if until is None:
+        return None
+    if time.monotonic() > until:
+        disable(channel_id)
+        return None
+    return channel_id
+
+
+_off = contextlib.nullcontext()
+
+
+def section(kind: str, name: str) -> contextlib.AbstractContextManager:
+    if not _enabled:
+        return _off
+    return _section(kind, name)
+
+
+@contextlib.contextmanager
+def _section(kind: str, name: str) -> Iterator[None]:
+    channel_id = _active_channel()
+    if channel_id is None:
+        yield
+        return
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        sample = Sample(kind, name, time.perf_counter() - wall, time.thread_time() - cpu)
+        with _lock:
+            buffer = _samples.get(channel_id)
+            if buffer is not None:
+                buffer.append(sample)
+
+
+def profiled(kind: str, name: str = "") -> Callable[[Callable], Callable]:
+    """Decorator profiling every call as a `kind` section named `name` (default: the
+    function name). Jinja attributes like `pass_context` are kept."""
+
+    def decorator(fn: Callable) -> Callable:
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with section(kind, label):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def stats(channel_id: int) -> list[Stats]:
+    """Samples in the channel's buffer aggregated by (kind, name), slowest total first."""
+    with _lock:
+        samples = list(_samples.get(channel_id, ()))
+    by_key: dict[tuple[str, str], Stats] = {}
+    for s in samples:
+        st = by_key.get((s.kind, s.name))
+        if st is None:
+            st = by_key[(s.kind, s.name)] = Stats(s.kind, s.name)
+        st.calls += 1
+        st.wall_s += s.wall_s
+        st.cpu_s += s.cpu_s
+        st.max_wall_s = max(st.max_wall_s, s.wall_s)
+    return sorted(by_key.values(), key=lambda st: -st.wall_s)
+
+
+def report(channel_id: int, top: int = 20) -> str:
+    rows = stats(channel_id)
+    if not rows:
+        return "no samples"
+    lines = [
+        f"{'kind':8} {'name':20} {'calls':>6} {'wall ms':>9} {'avg ms':>7} {'max ms':>7} {'cpu ms':>8}"
+    ]
+    for st in rows[:top]:
+        lines.append(
+            f"{st.kind:8} {st.name[:20]:20} {st.calls:6} {st.wall_s * 1000:9.1f} "
+            f"{st.wall_s * 1000 / st.calls:7.2f} {st.max_wall_s * 1000:7.1f} {st.cpu_s * 1000:8.1f}"
+        )
+    if len(rows) > top:
+        lines.append(f"... {len(rows) - top} more")
+    return "\n".join(lines)
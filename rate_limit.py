@@ -0,0 +1,101 @@
+"""Token-bucket rate limiting for outgoing chat messages.
+
+A `SendScheduler` keeps one bucket per destination (e.g. Twitch broadcaster) plus a
+global bucket for the whole bot. A send waits for a token from both, so a busy
+channel only delays itself while the global cap still holds across channels.
+
+Tokens are reserved up front (the bucket may go negative), so concurrent waiters are
+served in arrival order without polling.
+"""
+
+import asyncio
+import dataclasses
+import time
+
+import metrics
+
+_queue_depth = metrics.gauge("send_queue_depth", "Messages waiting for a send token")
+_wait_seconds = metrics.histogram(
+    "send_wait_seconds", "Time a message waited for a send token", buckets=metrics.WAIT_BUCKETS
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class Rate:
+    """`count` messages per `period_s` seconds, with bursts of up to `burst` messages."""
+
+    count: int
+    period_s: float
+    burst: int
+
+    @property
+    def per_second(self) -> float:
+        return self.count / self.period_s
+
+
+class TokenBucket:
+    def __init__(self, rate: Rate, now: float | None = None):
+        self.rate = rate
+        self.tokens = float(rate.burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(float(self.rate.burst), self.tokens + elapsed * self.rate.per_second)
+        self.updated = now
+
+    def set_rate(self, rate: Rate, now: float | None = None):
+        self._refill(time.monotonic() if now is None else now)
+        self.rate = rate
+        self.tokens = min(self.tokens, float(rate.burst))
+
+    def reserve(self, now: float | None = None) -> float:
+        """Takes one token and returns how many seconds to wait until it is valid."""
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= 1.0
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate.per_second
+
+
+class SendScheduler:
+    def __init__(self, normal: Rate, elevated: Rate, global_rate: Rate, name: str):
+        self.normal = normal
+        self.elevated = elevated
+        self.name = name
+        self.global_bucket = TokenBucket(global_rate)
+        self.buckets: dict[str, TokenBucket] = {}
+        self.waiting: dict[str, int] = {}
+
+    def bucket(self, key: str, elevated: bool) -> TokenBucket:
+        rate = self.elevated if elevated else self.normal
+        b = self.buckets.get(key)
+        if b is None:
+            b = TokenBucket(rate)
+            self.buckets[key] = b
+        elif b.rate != rate:
+            b.set_rate(rate)
+        return b
+
+    async def acquire(self, key: str, elevated: bool = False) -> float:
+        """Waits until a message to `key` may be sent; returns the time waited.
+
+        The global token is only reserved once the channel token is due, so messages
+        held back by their own channel do not use up global capacity while waiting.
+        """
+        start = time.monotonic()
+        self.waiting[key] = self.waiting.get(key, 0) + 1
+        _queue_depth.inc(client=self.name, channel=key)
+        try:
+            delay = self.bucket(key, elevated).reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            delay = self.global_bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        finally:
+            self.waiting[key] -= 1
+            _queue_depth.dec(client=self.name, channel=key)
+        waited = time.monotonic() - start
+        _wait_seconds.observe(waited, client=self.name)
+        return waited
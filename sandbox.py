@@ -0,0 +1,322 @@
+"""Sandboxed Jinja environment that enforces per-render budgets.
+
+Moderators write the templates, and they run on the shared worker threads, so one
+template must not be able to stall every channel. A `RenderBudget` is created for
+each top-level render (a command action, `+eval`) and shared with the templates it
+renders through `txt()`. It limits:
+
+- wall time, checked on every operation and output chunk;
+- operations: calls, loop iterations (`{% for %}` and `range()`) and `+`/`*`/`**`
+  operators;
+- output length of each render, and results that would exceed it of `+`/`*`/`**`,
+  `~`, the `center`, `indent`, `wordwrap`, `format`, `join` and `replace` filters and
+  the padding, format, `join` and `replace` methods of strings;
+- calls of template functions that touch the database (marked with `touches_db`).
+
+Exceeding a limit raises `BudgetExceeded`, which aborts the whole top-level render.
+The wall time limit can't interrupt a single long call, only stop before the next one.
+"""
+
+import dataclasses
+import re
+import string
+import time
+from collections.abc import Callable, Iterable, Iterator
+
+import jinja2
+from jinja2 import filters, nodes
+from jinja2.runtime import LoopContext
+from jinja2.sandbox import SandboxedEnvironment, safe_range
+from jinja2.visitor import NodeTransformer
+
+RENDER_TIME_S = 1.0
+RENDER_OPERATIONS = 100_000
+RENDER_OUTPUT_CHARS = 10_000
+RENDER_DB_CALLS = 200
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, budget: str, limit: float):
+        super().__init__(f"{budget} budget exceeded (limit {limit:g})")
+        self.budget = budget
+
+
+@dataclasses.dataclass
+class RenderBudget:
+    time_s: float = RENDER_TIME_S
+    operations: int = RENDER_OPERATIONS
+    output_chars: int = RENDER_OUTPUT_CHARS
+    db_calls: int = RENDER_DB_CALLS
+    used_operations: int = 0
+    used_db_calls: int = 0
+    deadline: float = dataclasses.field(init=False)
+
+    def __post_init__(self):
+        self.deadline = time.monotonic() + self.time_s
+
+    def check_time(self):
+        if time.monotonic() > self.deadline:
+            raise BudgetExceeded("time", self.time_s)
+
+    def operation(self):
+        self.used_operations += 1
+        if self.used_operations > self.operations:
+            raise BudgetExceeded("operations", self.operations)
+        self.check_time()
+
+    def db_call(self):
+        self.used_db_calls += 1
+        if self.used_db_calls > self.db_calls:
+            raise BudgetExceeded("db_calls", self.db_calls)
+
+    def check_output(self, n: int):
+        if n > self.output_chars:
+            raise BudgetExceeded("output", self.output_chars)
+
+
+def touches_db(fn: Callable) -> Callable:
+    """Marks a template function whose calls count against `RenderBudget.db_calls`."""
+    fn.touches_db = True  # type: ignore[attr-defined]
+    return fn
+
+
+class _Range:
+    """`range()` for templates: each iteration is an operation."""
+
+    def __init__(self, r: range, budget: RenderBudget):
+        self.r = r
+        self.budget = budget
+
+    def __len__(self) -> int:
+        return len(self.r)
+
+    def __getitem__(self, i):
+        return self.r[i]
+
+    def __iter__(self) -> Iterator[int]:
+        for i in self.r:
+            self.budget.operation()
+            yield i
+
+
+def _iterate(iterable: Iterable, budget: RenderBudget) -> Iterator:
+    for x in iterable:
+        budget.operation()
+        yield x
+
+
+@jinja2.pass_context
+def _loop_filter(context, iterable):
+    """Wrapped around the iterable of every `{% for %}`: each iteration is an operation."""
+    budget: RenderBudget | None = context.get("_budget")
+    if budget is None or isinstance(iterable, _Range):  # ranges count themselves
+        return iterable
+    return _iterate(iterable, budget)
+
+
+@jinja2.pass_context
+def _concat_filter(context, value: str) -> str:
+    """Wrapped around every `~`: its operands are within the budget, so checking the
+    result keeps repeated concatenation from growing past it."""
+    budget: RenderBudget | None = context.get("_budget")
+    if budget is not None:
+        budget.check_output(len(value))
+    return value
+
+
+class _Instrument(NodeTransformer):
+    """Routes `{% for %}` iterables and `~` results through the budget filters."""
+
+    def visit_For(self, node: nodes.For) -> nodes.Node:
+        node = self.generic_visit(node)
+        node.iter = nodes.Filter(
+            node.iter, "_budgeted_loop", [], [], None, None, lineno=node.iter.lineno
+        )
+        return node
+
+    def visit_Concat(self, node: nodes.Concat) -> nodes.Node:
+        node = self.generic_visit(node)
+        return nodes.Filter(node, "_budgeted_concat", [], [], None, None, lineno=node.lineno)
+
+
+def _sequence_length(x) -> int | None:
+    return len(x) if isinstance(x, str | list | tuple) else None
+
+
+def _int(x) -> int:
+    """Width-like argument; anything else is left for the callee to reject."""
+    return x if isinstance(x, int) else 0
+
+
+_PERCENT_SPEC = re.compile(r"%(?:\([^)]*\))?[#0 +-]*(\*|\d*)(?:\.(\*|\d*))?")
+
+
+def _format_size(fmt: str, values: Iterable) -> int:
+    """Upper bound of the length of `fmt` formatted with `values`, %-style or `str.format`."""
+    values = list(values)
+    widths = []
+    for m in _PERCENT_SPEC.finditer(fmt):
+        widths += m.groups()
+    try:
+        for _, _, spec, _ in string.Formatter().parse(fmt):
+            if spec:
+                widths += re.findall(r"\d+", spec)
+                if "{" in spec:  # nested width, such as "{:{w}}"
+                    widths.append("*")
+    except ValueError:
+        pass  # not a format string, the call reports it
+    star = max((_int(v) for v in values), default=0)
+    width = sum(star if w == "*" else int(w or 0) for w in widths)
+    return len(fmt) + width + sum(len(str(v)) for v in values)
+
+
+def _format_filter_size(value, *args, **kwargs) -> int:
+    return _format_size(str(value), kwargs.values() if kwargs else args)
+
+
+def _center_size(value, width=80, *args) -> int:
+    return max(len(str(value)), _int(width))
+
+
+def _indent_size(s, width=4, *args, **kwargs) -> int:
+    s = str(s)
+    width = len(width) if isinstance(width, str) else _int(width)
+    return len(s) + (s.count("\n") + 1) * width
+
+
+def _wordwrap_size(s, width=79, break_long_words=True, wrapstring=None, *args, **kwargs) -> int:
+    s = str(s)
+    lines = len(s) // max(_int(width), 1) + 1
+    return len(s) + lines * len(str(wrapstring or "\n"))
+
+
+def _join_size(value, d="", *args, **kwargs) -> int:
+    if not isinstance(value, str | list | tuple):
+        return 0  # an iterator: the result is checked after the call
+    return sum(len(str(x)) for x in value) + len(str(d)) * max(len(value) - 1, 0)
+
+
+def _replace_size(s, old="", new="", count=None, *args, **kwargs) -> int:
+    s, old, new = str(s), str(old), str(new)
+    n = len(s) + 1 if not old else s.count(old)
+    if isinstance(count, int) and count >= 0:
+        n = min(n, count)
+    return len(s) + n * max(len(new) - len(old), 0)
+
+
+# Output size of a filter, estimated from its arguments before calling it.
+_FILTER_SIZES: dict[str, Callable[..., int]] = {
+    "center": _center_size,
+    "indent": _indent_size,
+    "wordwrap": _wordwrap_size,
+    "format": _format_filter_size,
+    "join": _join_size,
+    "replace": _replace_size,
+}
+
+
+def _str_method_size(s: str, name: str, args: tuple, kwargs: dict) -> int | None:
+    if name in ("center", "ljust", "rjust", "zfill"):
+        return max(len(s), _int(args[0])) if args else None
+    if name == "expandtabs":
+        return len(s) + s.count("\t") * _int(args[0] if args else kwargs.get("tabsize", 8))
+    if name == "format":
+        return _format_size(s, [*args, *kwargs.values()])
+    if name == "format_map" and args and isinstance(args[0], dict):
+        return _format_size(s, args[0].values())
+    if name == "join" and args:
+        return _join_size(args[0], s)
+    if name == "replace" and len(args) >= 2:
+        return _replace_size(s, *args[:3])
+    return None
+
+
+def _sized_filter(name: str, f: Callable, size: Callable[..., int]) -> Callable:
+    pass_environment = f is filters.do_wordwrap
+    pass_eval_context = f in (filters.do_join, filters.do_replace)
+
+    @jinja2.pass_context
+    def sized(context, value, *args, **kwargs):
+        budget: RenderBudget | None = context.get("_budget")
+        if budget is not None:
+            budget.check_output(size(value, *args, **kwargs))
+        if pass_environment:
+            result = f(context.environment, value, *args, **kwargs)
+        elif pass_eval_context:
+            result = f(context.eval_ctx, value, *args, **kwargs)
+        else:
+            result = f(value, *args, **kwargs)
+        if budget is not None:
+            budget.check_output(len(result))
+        return result
+
+    sized.__name__ = f"sized_{name}"
+    return sized
+
+
+class BudgetedSandbox(SandboxedEnvironment):
+    intercepted_binops = frozenset(["+", "*", "**"])
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.filters["_budgeted_loop"] = _loop_filter
+        self.filters["_budgeted_concat"] = _concat_filter
+        for name, size in _FILTER_SIZES.items():
+            self.filters[name] = _sized_filter(name, self.filters[name], size)
+
+    def _parse(self, source, name, filename):
+        return _Instrument().visit(super()._parse(source, name, filename))
+
+    def call(self, context, obj, /, *args, **kwargs):
+        budget: RenderBudget | None = context.get("_budget")
+        if budget is not None:
+            budget.operation()
+            if getattr(obj, "touches_db", False):
+                budget.db_call()
+            # The sandbox wraps `str.format` at attribute access.
+            method = getattr(obj, "__wrapped__", obj)
+            if isinstance(getattr(method, "__self__", None), str):
+                size = _str_method_size(method.__self__, method.__name__, args, kwargs)
+                if size is not None:
+                    budget.check_output(size)
+            elif isinstance(obj, LoopContext) and args:
+                # `loop(children)` of a recursive loop iterates outside of `_parse`'s filter.
+                args = (_loop_filter(context, args[0]), *args[1:])
+        result = super().call(context, obj, *args, **kwargs)
+        if budget is not None and obj is safe_range:
+            return _Range(result, budget)
+        return result
+
+    def call_binop(self, context, operator, left, right):
+        budget: RenderBudget | None = context.get("_budget")
+        if budget is not None:
+            budget.operation()
+            if operator == "+":
+                left_size, right_size = _sequence_length(left), _sequence_length(right)
+                if left_size is not None and right_size is not None:
+                    budget.check_output(left_size + right_size)
+            elif operator == "*":
+                for seq, n in ((left, right), (right, left)):
+                    size = _sequence_length(seq)
+                    if size is not None and isinstance(n, int):
+                        budget.check_output(size * n)
+            elif isinstance(left, int) and isinstance(right, int) and right > 0:
+                # Result digits, roughly: keep big number arithmetic within the output limit.
+                budget.check_output(int(abs(left).bit_length() * right * 0.302))
+        return super().call_binop(context, operator, left, right)
+
+
+def render(env: jinja2.Environment, text: str, vars: dict) -> str:
+    """Renders `text` within `vars["_budget"]`; a budget is started if there is none."""
+    budget: RenderBudget | None = vars.get("_budget")
+    if budget is None:
+        budget = RenderBudget()
+        vars = {**vars, "_budget": budget}
+    chunks = []
+    size = 0
+    for chunk in env.from_string(text).generate(vars):
+        size += len(chunk)
+        budget.check_output(size)
+        budget.check_time()
+        chunks.append(chunk)
+    return "".join(chunks)
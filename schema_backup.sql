@@ -347,6 +347,13 @@ ALTER TABLE ONLY public.variables
     ADD CONSTRAINT uniq_variable UNIQUE (channel_id, name, category);
 
 
+--
+-- Name: variables_expires_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX variables_expires_idx ON public.variables USING btree (expires);
+
+
 --
 -- Name: text_tags text_tags_tag_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
 --
@@ -0,0 +1,45 @@
+"""Static partitioning of channels across bot processes.
+
+One process is bounded by one GIL. To use more cores, PM2 runs `count` copies of
+the bot (`--shard_id i --shard_count n`, see `ecosystem.config.cjs`), and each
+one only handles its part of the channels, so their caches never overlap:
+
+- Discord guilds by Discord's own sharding (`(guild_id >> 22) % count`): the
+  gateway only sends a shard its guilds, and DMs to shard 0;
+- Twitch channels by internal `channel_id % count`, unless the `channels` row has a
+  Discord guild too: then it goes with the guild, so that both platforms of a channel
+  share one process and one `ChannelCache`. Each shard subscribes to EventSub for
+  its channels only, over its own conduit (`--twitch_conduit_id`).
+
+Shard 0 is the primary: it runs DB-wide maintenance (variable expiry) and serves
+the Twitch OAuth callback on the base port; other shards listen on
+`base port + shard id`.
+"""
+
+import dataclasses
+
+
+@dataclasses.dataclass(frozen=True)
+class Shard:
+    id: int = 0
+    count: int = 1
+
+    def __post_init__(self):
+        if self.count < 1 or not 0 <= self.id < self.count:
+            raise ValueError(f"bad shard {self.id} of {self.count}")
+
+    @property
+    def primary(self) -> bool:
+        return self.id == 0
+
+    def owns_channel(self, channel_id: int, discord_guild_id: str | None = None) -> bool:
+        """Whether this shard serves the `channels` row."""
+        if discord_guild_id:
+            return (int(discord_guild_id) >> 22) % self.count == self.id
+        return channel_id % self.count == self.id
+
+    def port(self, base: int) -> int:
+        return base + self.id
+
+    def __str__(self) -> str:
+        return f"shard {self.id}/{self.count}"
@@ -0,0 +1,94 @@
+"""Startup timing report: how long each subsystem takes to import and initialize.
+
+`time_imports()` (called by `import_timer`, which `main.py` imports before anything
+else) charges the time of every new top-level package import to that package,
+including whatever it imports in turn, until `imports_done()`. Initialization steps
+are timed with `phase()`, from any thread:
+
+    with startup.phase("database"):
+        set_db(DB(connection))
+
+`report()` logs both, slowest first. Every entry is also exported as the
+`startup_seconds{phase}` gauge.
+"""
+
+import builtins
+import contextlib
+import logging
+import sys
+import threading
+import time
+from collections.abc import Iterator
+
+import metrics
+
+_started = time.perf_counter()
+_seconds = metrics.gauge("startup_seconds", "Time spent importing and initializing a subsystem")
+
+_lock = threading.Lock()
+_imports: dict[str, float] = {}
+_phases: dict[str, float] = {}
+_depth = 0
+_original_import = builtins.__import__
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    global _depth
+    top = name.partition(".")[0]
+    if level or _depth or top in sys.modules or threading.current_thread() is not _main:
+        return _original_import(name, globals, locals, fromlist, level)
+    _depth += 1
+    t = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        _record(_imports, f"import {top}", time.perf_counter() - t)
+
+
+_main = threading.current_thread()
+
+
+def time_imports():
+    """Starts timing imports made by the calling thread."""
+    global _main
+    _main = threading.current_thread()
+    builtins.__import__ = _timed_import
+
+
+def imports_done():
+    """Stops timing imports; the rest of the startup is timed with `phase()`."""
+    if builtins.__import__ is _timed_import:
+        builtins.__import__ = _original_import
+        _record(_phases, "imports (total)", time.perf_counter() - _started)
+
+
+def _record(table: dict[str, float], name: str, seconds: float):
+    with _lock:
+        table[name] = table.get(name, 0.0) + seconds
+    _seconds.set(table[name], phase=name)
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(_phases, name, time.perf_counter() - t)
+
+
+def timings() -> dict[str, float]:
+    """Seconds per import and initialization phase."""
+    with _lock:
+        return {**_imports, **_phases}
+
+
+def report():
+    """Logs the timings collected so far, slowest first."""
+    lines = [
+        f"  {seconds * 1000:8.1f} ms  {name}"
+        for name, seconds in sorted(timings().items(), key=lambda kv: -kv[1])
+    ]
+    elapsed = time.perf_counter() - _started
+    logging.info("startup took %.1f ms:\n%s", elapsed * 1000, "\n".join(lines))
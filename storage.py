@@ -20,6 +20,7 @@ import dataclasses
 import functools
 import logging
 import random
+import threading
 import time
 from typing import Any
 
@@ -30,11 +31,43 @@ import psycopg2.extras
 import ttldict2
 from llist import dllist  # type: ignore
 
+import metrics
+import profiler
 import query
+import words
 from data import CommandData, dictToCommandData
 
 psycopg2.extensions.register_adapter(dict, psycopg2.extras.Json)
 
+# Expired variables are deleted lazily in short batches, reads already treat them as absent.
+EXPIRE_BATCH_SIZE = 500
+EXPIRE_MAX_BATCHES = 100
+
+_variables_expired = metrics.counter(
+    "variables_expired_total", "Expired variables deleted by the background expiry pass"
+)
+_variables_expiry_seconds = metrics.histogram(
+    "variables_expiry_pass_seconds", "Wall time of one variable expiry pass"
+)
+_text_form_lookups = metrics.counter(
+    "text_form_lookups_total", "Inflected text lookups by where the form came from"
+)
+_query_seconds = metrics.histogram(
+    "db_query_seconds", "Time to execute one SQL statement, by statement type"
+)
+_channel_cache_lookups = metrics.counter(
+    "channel_cache_lookups_total", "Channel text/tag cache lookups by result (hit, miss)"
+)
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that observes `db_query_seconds{statement}` for every execute."""
+
+    def execute(self, query, vars=None):
+        statement = query.lstrip().partition(" ")[0].upper() if isinstance(query, str) else "SQL"
+        with _query_seconds.time(statement=statement):
+            return super().execute(query, vars)
+
 
 @dataclasses.dataclass
 class ListInfo:
@@ -52,6 +85,8 @@ class TextEntry:
     queue_nodes: dict[int, Any]
     tags: set[int]
     in_all: Any | None
+    # Inflected forms indexed by `words.case_id`, None if the text has none (yet).
+    forms: list[str | None] | None = None
 
 
 @dataclasses.dataclass
@@ -63,6 +98,15 @@ class QueryQueue:
 
 @dataclasses.dataclass
 class ChannelCache:
+    """Texts, tags and random-pick queues of one channel.
+
+    Queues, text entries and `active_queries` are mutated in place and only touched
+    with `lock` held. Per-message methods hold it for in-memory work only, not during
+    SQL; reloads after tag changes hold it while they read the rows. `tag_by_id` and
+    `tag_by_value` are replaced, not mutated, on reload, and so are the `tags` sets of
+    text entries: they can be read without the lock.
+    """
+
     channel_id: int
     active_queries: Any  # str -> str
     query_to_id: dict[str, int]
@@ -73,14 +117,16 @@ class ChannelCache:
     tag_by_id: dict[int, str]
     tag_by_value: dict[str, int]
     query_counter = 0
+    lock: Any = dataclasses.field(default_factory=threading.RLock, repr=False, compare=False)
 
 
 class DB:
     def __init__(self, connection: str):
         self.connection_string: str = connection
-        self.conn = psycopg2.connect(connection)
-        self.conn.set_session(autocommit=True)
+        self.conn = self._connect()
         self.channels: dict[int, ChannelCache] = {}
+        # Held while a channel is loaded, so it is loaded once.
+        self.channels_lock = threading.Lock()
         self.logs = {}
         self.rng = random
 
@@ -88,8 +134,13 @@ class DB:
         logging.warning("DB connection closed; reconnecting")
         with contextlib.suppress(Exception):
             self.conn.close()
-        self.conn = psycopg2.connect(self.connection_string)
-        self.conn.set_session(autocommit=True)
+        self.conn = self._connect()
+
+    def _connect(self):
+        conn = psycopg2.connect(self.connection_string)
+        conn.set_session(autocommit=True)
+        conn.cursor_factory = TimedCursor
+        return conn
 
     def cursor(self) -> psycopg2.extensions.cursor:
         """Return a cursor, reconnecting first if the connection is closed."""
@@ -104,22 +155,30 @@ class DB:
             return self.conn.cursor()
 
     def channel(self, channel_id: int) -> ChannelCache:
-        if channel_id in self.channels:
-            return self.channels[channel_id]
-        ch = ChannelCache(
-            channel_id=channel_id,
-            active_queries=ttldict2.TTLDict(ttl_seconds=float(10.0 * 3600 * 24)),
-            queries={},
-            all_text_by_id={},
-            all_texts_list=dllist(),
-            tag_by_id={},
-            tag_by_value={},
-            query_to_id={},
-        )
-        self.reload_texts(ch)
-        self.reload_tags(ch)
-        self.channels[channel_id] = ch
-        return ch
+        ch = self.channels.get(channel_id)
+        if ch is not None:
+            _channel_cache_lookups.inc(result="hit")
+            return ch
+        with self.channels_lock:
+            ch = self.channels.get(channel_id)
+            if ch is not None:
+                _channel_cache_lookups.inc(result="hit")
+                return ch
+            _channel_cache_lookups.inc(result="miss")
+            ch = ChannelCache(
+                channel_id=channel_id,
+                active_queries=ttldict2.TTLDict(ttl_seconds=float(10.0 * 3600 * 24)),
+                queries={},
+                all_text_by_id={},
+                all_texts_list=dllist(),
+                tag_by_id={},
+                tag_by_value={},
+                query_to_id={},
+            )
+            self.reload_tags(ch)
+            self.reload_texts(ch)
+            self.channels[channel_id] = ch
+            return ch
 
     @functools.lru_cache(maxsize=1000)
     def twitch_channel_info(self, cur: psycopg2.extensions.cursor, name: str) -> tuple[int, str]:
@@ -166,41 +225,117 @@ class DB:
         return id, prefix
 
     def reload_tags(self, ch: ChannelCache):
+        with ch.lock:  # so an older reload can't overwrite a newer one
+            rows = self._select_tags(ch.channel_id)
+            ch.tag_by_id = {row[0]: row[1] for row in rows}
+            ch.tag_by_value = {row[1]: row[0] for row in rows}
+
+    # Methods starting with _select, _insert, _update, _delete and _replace only read or
+    # write rows; the channel cache is maintained by their callers. `memory_db.MemoryDB`
+    # overrides them together with the methods that have no cache part.
+
+    def _select_tags(self, channel_id: int) -> list[tuple[int, str]]:
         with self.cursor() as cur:
-            ch.tag_by_id.clear()
-            ch.tag_by_value.clear()
-            cur.execute("SELECT id, value FROM tags WHERE channel_id = %s", [ch.channel_id])
-            for row in cur.fetchall():
-                ch.tag_by_id[row[0]] = row[1]
-                ch.tag_by_value[row[1]] = row[0]
+            cur.execute("SELECT id, value FROM tags WHERE channel_id = %s", [channel_id])
+            return cur.fetchall()
+
+    def _select_texts(self, channel_id: int) -> tuple[list[int], list[tuple[int, int, str | None]]]:
+        """Text ids of the channel and their (text_id, tag_id, value) tags."""
+        with self.cursor() as cur:
+            cur.execute("SELECT id FROM texts t WHERE t.channel_id = %s", [channel_id])
+            ids = [row[0] for row in cur.fetchall()]
+            cur.execute(
+                "SELECT tt.text_id, tt.tag_id, tt.value FROM texts t JOIN text_tags tt ON tt.text_id = t.id WHERE t.channel_id = %s",
+                [channel_id],
+            )
+            return ids, cur.fetchall()
 
     def reload_texts(self, ch: ChannelCache):
+        with ch.lock:
+            self._load_texts(ch)
+
+    def _load_texts(self, ch: ChannelCache):
+        ids, tag_rows = self._select_texts(ch.channel_id)
         ch.all_texts_list.clear()
         ch.queries.clear()
         ch.query_to_id.clear()
         ch.active_queries.clear()
         ch.all_text_by_id.clear()
         z: dict[int, set[int]] = {}
-        with self.cursor() as cur:
-            cur.execute("SELECT id FROM texts t WHERE t.channel_id = %s", [ch.channel_id])
-            for row in cur.fetchall():
-                z[row[0]] = set()
-            cur.execute(
-                "SELECT tt.text_id, tt.tag_id FROM texts t JOIN text_tags tt ON tt.text_id = t.id WHERE t.channel_id = %s",
-                [ch.channel_id],
-            )
-            for row in cur.fetchall():
-                text, tag = row
-                z[text].add(tag)
+        values: dict[int, dict[int, str | None]] = {}
+        for text_id in ids:
+            z[text_id] = set()
+        for text, tag, value in tag_rows:
+            z[text].add(tag)
+            if value is not None:
+                values.setdefault(text, {})[tag] = value
         lst: list[TextEntry] = []
         for text_id, tags in z.items():
-            te = TextEntry(id=text_id, queue_nodes={}, tags=tags, in_all=None)
+            te = TextEntry(
+                id=text_id,
+                queue_nodes={},
+                tags=tags,
+                in_all=None,
+                forms=self._forms_table(ch, values.get(text_id, {})),
+            )
             lst.append(te)
             ch.all_text_by_id[text_id] = te
         self.rng.shuffle(lst)
         for te in lst:
             te.in_all = ch.all_texts_list.append(te)
 
+    @staticmethod
+    def _forms_table(
+        ch: ChannelCache, tag_values: dict[int, str | None]
+    ) -> list[str | None] | None:
+        """Inflected forms from case tag values (рд=..., тв,мн=...), see `words.case_id`."""
+        forms: list[str | None] | None = None
+        for tag_id, value in tag_values.items():
+            i = words.case_id.get(ch.tag_by_id.get(tag_id, ""))
+            if i is None or value is None:
+                continue
+            if forms is None:
+                forms = [None] * len(words.case_tags)
+            forms[i] = value
+        return forms
+
+    @profiler.profiled("db")
+    def get_text_form(self, channel_id: int, text_id: int, inf: str) -> str | None:
+        """Text `text_id` inflected to `inf` ("рд", "тв,мн", ...).
+
+        Served from the channel's forms table. Texts without a stored value for the
+        form (legacy "morph" texts) are inflected once and the result kept in the table;
+        inflections outside `words.case_tags` are regular tag values read from the DB.
+        """
+        ch = self.channel(channel_id)
+        i = words.case_id.get(inf)
+        te = ch.all_text_by_id.get(text_id)
+        if i is None or te is None:
+            _text_form_lookups.inc(result="db")
+            tag_id = ch.tag_by_value.get(inf)
+            if tag_id is None:
+                return None
+            return self.get_text_tag_value(channel_id, text_id, tag_id)
+        forms = te.forms
+        if forms is not None and forms[i] is not None:
+            _text_form_lookups.inc(result="table")
+            return forms[i]
+        txt = self.get_text(channel_id, text_id)
+        if txt is None:
+            return None
+        _text_form_lookups.inc(result="inflected")
+        tag_filter = [
+            words.morph_tags[name]
+            for name in (ch.tag_by_id.get(t, "") for t in te.tags)
+            if name in words.morph_tags
+        ]
+        form = words.inflect_word(txt, inf, tag_filter)
+        with ch.lock:
+            if te.forms is None:
+                te.forms = [None] * len(words.case_tags)
+            te.forms[i] = form
+        return form
+
     def new_channel_id(self):
         with self.cursor() as cur:
             cur.execute("SELECT MAX(channel_id) FROM channels")
@@ -218,19 +353,27 @@ class DB:
     def add_tag(self, channel_id: int, tag_name: str):
         if not query.good_tag_name(tag_name):
             raise Exception("bad tag name")
+        self._insert_tag(channel_id, tag_name)
+        self.reload_tags(self.channel(channel_id))
+
+    def _insert_tag(self, channel_id: int, tag_name: str):
         with self.cursor() as cur:
             cur.execute(
                 "INSERT INTO tags (channel_id, value) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
                 (channel_id, tag_name),
             )
-            self.reload_tags(self.channel(channel_id))
 
     def delete_tag(self, channel_id: int, tag_id: int):
-        with self.cursor() as cur:
-            cur.execute("DELETE FROM tags WHERE channel_id = %s AND id = %s", (channel_id, tag_id))
-            ch = self.channel(channel_id)
+        n = self._delete_tag_row(channel_id, tag_id)
+        ch = self.channel(channel_id)
+        with ch.lock:
             self.reload_tags(ch)
             self.reload_texts(ch)
+        return n
+
+    def _delete_tag_row(self, channel_id: int, tag_id: int) -> int:
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM tags WHERE channel_id = %s AND id = %s", (channel_id, tag_id))
             return cur.rowcount
 
     def get_text_tags(self, channel_id: int, text_id: int) -> set[int] | None:
@@ -239,6 +382,7 @@ class DB:
             return None
         return te.tags
 
+    @profiler.profiled("db")
     def get_text_tag_values(self, channel_id: int, text_id: int) -> dict[int, str | None]:
         z = {}
         with self.cursor() as cur:
@@ -250,6 +394,7 @@ class DB:
                 z[row[0]] = row[1]
             return z
 
+    @profiler.profiled("db")
     def get_text_tag_value(self, channel_id: int, text_id: int, tag_id: int) -> str | None:
         with self.cursor() as cur:
             cur.execute(
@@ -266,19 +411,20 @@ class DB:
     ) -> tuple[dict[int, str | None] | None, bool]:
         """returns previous and new tags if text exists"""
         ch = self.channel(channel_id)
-        te: TextEntry | None = ch.all_text_by_id.get(text_id)
-        if not te:
+        if text_id not in ch.all_text_by_id:
             logging.warning(f"text {text_id} is not found")
             return (None, False)
         previous_tags = self.get_text_tag_values(channel_id, text_id)
-        with self.cursor() as cur:
-            cur.execute("DELETE FROM text_tags WHERE text_id = %s", (text_id,))
-            for name, value in new_tags.items():
-                cur.execute(
-                    "INSERT INTO text_tags (text_id, tag_id, value) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
-                    (text_id, name, value),
-                )
+        self._replace_text_tags(text_id, new_tags)
+        with ch.lock:
+            te: TextEntry | None = ch.all_text_by_id.get(text_id)
+            if te is not None:  # unless deleted meanwhile
+                self._retag(ch, te, new_tags)
+        return (previous_tags, True)
+
+    def _retag(self, ch: ChannelCache, te: TextEntry, new_tags: dict[int, str | None]):
         te.tags = set(new_tags.keys())
+        te.forms = self._forms_table(ch, new_tags)
         prev: set[int] = set(te.queue_nodes.keys())
         current: set[int] = set()
         for qq in ch.queries.values():
@@ -295,22 +441,39 @@ class DB:
         for qid in current - prev:
             qq = ch.queries[qid]
             te.queue_nodes[qid] = qq.queue.appendleft(te)
-        return (previous_tags, True)
+
+    def _replace_text_tags(self, text_id: int, new_tags: dict[int, str | None]):
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM text_tags WHERE text_id = %s", (text_id,))
+            for name, value in new_tags.items():
+                cur.execute(
+                    "INSERT INTO text_tags (text_id, tag_id, value) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                    (text_id, name, value),
+                )
 
     def delete_text(self, channel_id: int, text_id: int) -> int:
         ch = self.channel(channel_id)
-        te = ch.all_text_by_id.get(text_id)
-        if te:
-            for node in te.queue_nodes.values():
-                node.owner().remove(node)
-            if te.in_all:
-                te.in_all.owner().remove(te.in_all)
+        # The row and the cache entry change together, or a concurrent add_text of the
+        # same value could cache the id of a deleted row.
+        with ch.lock:
+            te = ch.all_text_by_id.pop(text_id, None)
+            if te:
+                for node in te.queue_nodes.values():
+                    node.owner().remove(node)
+                te.queue_nodes.clear()
+                if te.in_all:
+                    te.in_all.owner().remove(te.in_all)
+                    te.in_all = None
+            return self._delete_text_row(channel_id, text_id)
+
+    def _delete_text_row(self, channel_id: int, text_id: int) -> int:
         with self.cursor() as cur:
             cur.execute(
                 "DELETE FROM texts WHERE id = %s AND channel_id = %s", (text_id, channel_id)
             )
             return cur.rowcount
 
+    @profiler.profiled("db")
     def get_text(self, channel_id: int, id: int) -> str | None:
         with self.cursor() as cur:
             cur.execute(
@@ -332,69 +495,97 @@ class DB:
             return None
 
     def add_text(self, channel_id: int, value: str) -> int:
+        ch = self.channel(channel_id)
+        # Held across the insert, see delete_text.
+        with ch.lock:
+            text_id = self._insert_text(channel_id, value)
+            if text_id in ch.all_text_by_id:
+                # The text already exists, keep its tags and queue positions.
+                return text_id
+            te = TextEntry(id=text_id, queue_nodes={}, tags=set(), in_all=None)
+            ch.all_text_by_id[text_id] = te
+            te.in_all = ch.all_texts_list.append(te)
+        # No need to check against queries as we don't expect any query to match a text w/o any tags.
+        return text_id
+
+    def _insert_text(self, channel_id: int, value: str) -> int:
+        """Id of the new text, or of the existing text with the same value."""
         with self.cursor() as cur:
             cur.execute(
                 "INSERT INTO texts (channel_id, value) VALUES (%s, %s) ON CONFLICT ON CONSTRAINT uniq_text_value DO UPDATE SET value = %s RETURNING id;",
                 (channel_id, value, value),
             )
-            text_id = cur.fetchone()[0]
-            ch = self.channel(channel_id)
-            te = TextEntry(id=text_id, queue_nodes={}, tags=set(), in_all=None)
-            ch.all_text_by_id[text_id] = te
-            te.in_all = ch.all_texts_list.append(te)
-            # No need to check against queries as we don't expect any query to match a text w/o any tags.
-            return text_id
+            return cur.fetchone()[0]
 
     def set_text(self, channel_id: int, value: str, id: int) -> str | None:
         txt = self.get_text(channel_id, id)
         if not txt:
             return None
+        self._update_text(channel_id, id, value)
+        ch = self.channel(channel_id)
+        te = ch.all_text_by_id.get(id)
+        if te is not None and te.forms is not None:
+            # Drop forms inflected from the old value; stored ones are still valid.
+            forms = self._forms_table(ch, self.get_text_tag_values(channel_id, id))
+            with ch.lock:
+                te.forms = forms
+        return txt
+
+    def _update_text(self, channel_id: int, id: int, value: str):
         with self.cursor() as cur:
             cur.execute(
                 "UPDATE texts SET value = %s WHERE channel_id = %s and id = %s",
                 (value, channel_id, id),
             )
-            return txt
 
     def text_search(
         self, channel_id: int, txt: str, q: str = ""
     ) -> list[tuple[int, str, set[int]]]:
-        with self.cursor() as cur:
-            cur.execute(
-                "select id, value from texts WHERE (channel_id = %s) AND (value LIKE %s)",
-                (channel_id, "%" + escape_like(txt.strip()) + "%"),
-            )
-            ch = self.channel(channel_id)
-            qt: lark.Tree | None = None
-            if q:
-                qt = query.parse_query(ch.tag_by_value, q)
-            z: list[tuple[int, str, set[int]]] = []
-            for row in cur.fetchall():
-                text_id, text = row[0], row[1]
-                tags = self.get_text_tags(channel_id, text_id)
-                if not tags:
-                    tags = set()
-                if not qt or query.match_tags(qt, tags):
-                    z.append((text_id, text, tags))
-            return z
+        rows = self._select_text_values(channel_id, txt.strip())
+        ch = self.channel(channel_id)
+        qt: lark.Tree | None = None
+        if q:
+            qt = query.parse_query(ch.tag_by_value, q)
+        z: list[tuple[int, str, set[int]]] = []
+        for row in rows:
+            text_id, text = row[0], row[1]
+            tags = self.get_text_tags(channel_id, text_id)
+            if not tags:
+                tags = set()
+            if not qt or query.match_tags(qt, tags):
+                z.append((text_id, text, tags))
+        return z
 
     def all_texts(self, channel_id: int) -> list[tuple[int, str, set[int]]]:
+        z = []
+        for row in self._select_text_values(channel_id):
+            text_id = int(row[0])
+            value = str(row[1])
+            tags = self.get_text_tags(channel_id, text_id)
+            if not tags:
+                tags = set()
+            z.append((text_id, value, tags))
+        return z
+
+    def _select_text_values(self, channel_id: int, substring: str = "") -> list[tuple[int, str]]:
+        """(id, value) of the channel's texts, only those containing `substring` if set."""
         with self.cursor() as cur:
-            cur.execute("SELECT id, value from texts t WHERE (channel_id = %s)", (channel_id,))
-            # tt = self.get_text_tags(channel_id)
-            # self.get_tags(channel_id)
-            z = []
-            for row in cur.fetchall():
-                text_id = int(row[0])
-                value = str(row[1])
-                tags = self.get_text_tags(channel_id, text_id)
-                if not tags:
-                    tags = set()
-                z.append((text_id, value, tags))
-            return z
+            if substring:
+                cur.execute(
+                    "select id, value from texts WHERE (channel_id = %s) AND (value LIKE %s)",
+                    (channel_id, "%" + escape_like(substring) + "%"),
+                )
+            else:
+                cur.execute("SELECT id, value from texts t WHERE (channel_id = %s)", (channel_id,))
+            return cur.fetchall()
 
+    @profiler.profiled("db")
     def get_random_text_id(self, channel_id: int, q: str) -> int | None:
         ch = self.channel(channel_id)
+        with ch.lock:
+            return self._pick_text_id(ch, q)
+
+    def _pick_text_id(self, ch: ChannelCache, q: str) -> int | None:
         qq: QueryQueue | None = None
         qid: int | None = ch.query_to_id.get(q)
         if qid is None:
@@ -434,6 +625,7 @@ class DB:
         ch.active_queries[q] = "+"
         return t.id
 
+    @profiler.profiled("db")
     def get_commands(self, channel_id, prefix) -> list[CommandData]:
         with self.cursor() as cur:
             cur.execute("SELECT data FROM commands WHERE channel_id = %s;", [channel_id])
@@ -458,6 +650,13 @@ class DB:
         )
         return cur.fetchone()[0]
 
+    def delete_command(self, channel_id: int, name: str):
+        with self.cursor() as cur:
+            cur.execute(
+                "DELETE FROM commands WHERE channel_id = %s AND name = %s", (channel_id, name)
+            )
+
+    @profiler.profiled("db")
     def set_variable(self, channel_id: int, name: str, value: str, category: str, expires: int):
         with self.cursor() as cur:
             if value == "":
@@ -481,6 +680,7 @@ class DB:
                 },
             )
 
+    @profiler.profiled("db")
     def get_variable(self, channel_id: int, name: str, category: str, default_value: str):
         with self.cursor() as cur:
             cur.execute(
@@ -495,25 +695,28 @@ class DB:
                 return default_value
             return value
 
+    @profiler.profiled("db")
     def count_variables_in_category(self, channel_id: int, category: str) -> int:
         with self.cursor() as cur:
             cur.execute(
-                "SELECT count(*) FROM variables WHERE channel_id = %s AND category = %s",
-                [channel_id, category],
+                "SELECT count(*) FROM variables WHERE channel_id = %s AND category = %s AND expires >= %s",
+                [channel_id, category, int(time.time())],
             )
             return cur.fetchone()[0]
 
+    @profiler.profiled("db")
     def list_variables(self, channel_id: int, category: str) -> list[tuple[str, str]]:
         with self.cursor() as cur:
             cur.execute(
-                "SELECT name, value FROM variables WHERE channel_id = %s AND category = %s",
-                [channel_id, category],
+                "SELECT name, value FROM variables WHERE channel_id = %s AND category = %s AND expires >= %s",
+                [channel_id, category, int(time.time())],
             )
             z = []
             for row in cur.fetchall():
                 z.append((row[0], row[1]))
             return z
 
+    @profiler.profiled("db")
     def delete_category(self, channel_id: int, category: str) -> int:
         with self.cursor() as cur:
             cur.execute(
@@ -522,12 +725,36 @@ class DB:
             )
             return cur.rowcount
 
-    def expire_variables(self):
-        with self.cursor() as cur:
-            cur.execute("DELETE FROM variables WHERE expires < %s", [int(time.time())])
-            n = cur.rowcount
-            if n:
-                logging.debug(f"deleted {n} expired variables")
+    def expire_variables(
+        self, batch_size: int = EXPIRE_BATCH_SIZE, max_batches: int = EXPIRE_MAX_BATCHES
+    ) -> int:
+        """Deletes expired variables in batches of at most `batch_size` rows.
+
+        Every batch is a separate short statement on the `variables_expires_idx` index,
+        so concurrent `set()` calls are never blocked for long. A pass stops after
+        `max_batches`, the rest is picked up by the next pass. Returns the number of rows deleted.
+        """
+        now = int(time.time())
+        total = 0
+        with _variables_expiry_seconds.time(), self.cursor() as cur:
+            for _ in range(max_batches):
+                cur.execute(
+                    """
+                    DELETE FROM variables WHERE ctid IN (
+                        SELECT ctid FROM variables WHERE expires < %s LIMIT %s
+                    )""",
+                    [now, batch_size],
+                )
+                n = cur.rowcount
+                total += n
+                if n < batch_size:
+                    break
+            else:
+                logging.info(f"expired variables backlog remains after {max_batches} batches")
+        _variables_expired.inc(total)
+        if total:
+            logging.debug(f"deleted {total} expired variables")
+        return total
 
     def add_log(self, channel_id, entry):
         if channel_id not in self.logs:
@@ -576,26 +803,31 @@ class DB:
             self.conn.commit()
 
     def expire_old_queries(self):
-        for ch in self.channels.values():
-            prev = set(ch.active_queries.keys())
-            ch.active_queries.drop_old_items()
-            active = set(ch.active_queries.keys())
-            for query_text in prev - active:
-                qid = ch.query_to_id[query_text]
-                qq = ch.queries[qid]
-                logging.debug(f"query {query_text} {qid} has expired")
-                t: TextEntry
-                for t in qq.queue:
-                    t.queue_nodes.pop(qid, None)
-                qq.queue.clear()
-                ch.queries.pop(qid, None)
-                ch.query_to_id.pop(query_text, None)
+        for ch in list(self.channels.values()):
+            with ch.lock:
+                self._expire_queries(ch)
+
+    def _expire_queries(self, ch: ChannelCache):
+        prev = set(ch.active_queries.keys())
+        ch.active_queries.drop_old_items()
+        active = set(ch.active_queries.keys())
+        for query_text in prev - active:
+            qid = ch.query_to_id[query_text]
+            qq = ch.queries[qid]
+            logging.debug(f"query {query_text} {qid} has expired")
+            t: TextEntry
+            for t in qq.queue:
+                t.queue_nodes.pop(qid, None)
+            qq.queue.clear()
+            ch.queries.pop(qid, None)
+            ch.query_to_id.pop(query_text, None)
 
     def check_database(self):
         with self.cursor() as cur:
             cur.execute("SELECT id, discord_guild_id, twitch_channel_name FROM channels")
             for row in cur.fetchall():
                 logging.info(row)
+            cur.execute("CREATE INDEX IF NOT EXISTS variables_expires_idx ON variables (expires)")
 
     def save_twitch_token(self, user_id: str, token: str, refresh: str):
         with self.cursor() as cur:
@@ -5,11 +5,23 @@ import typing
 import jinja2
 
 import commands
+import profiler
+import words
 from data import Action, ActionKind, Message, render, templates
 from discord_client import discord_literal
+from sandbox import touches_db
 from storage import db
 
 
+def inflected_query(channel_id: int, q: str, inf: str) -> str:
+    """Narrows `q` to texts that have the `inf` form; legacy "morph" texts are
+    inflected on first use."""
+    if inf in words.case_id and "morph" in db().tag_by_value(channel_id):
+        return f"({q}) and ({inf} or morph)"
+    return f"({q}) and {inf}"
+
+
+@touches_db
 @jinja2.pass_context
 def render_text_item(ctx, q: str | int | list[str | float], inf: str = ""):
     v = ctx.get_all()
@@ -23,21 +35,20 @@ def render_text_item(ctx, q: str | int | list[str | float], inf: str = ""):
         text_id = q
     elif isinstance(q, str):
         if inf:
-            q = f"({q}) and {inf}"
+            q = inflected_query(channel_id, q, inf)
         text_id = db().get_random_text_id(channel_id, q)
     else:
         queries = q[::2]
         weights = [abs(float(x)) for x in q[1::2]]
         query_text: str = str(random.choices(queries, weights=weights, k=1)[0])
         if inf:
-            query_text = f"({query_text}) and {inf}"
+            query_text = inflected_query(channel_id, query_text, inf)
         text_id = db().get_random_text_id(channel_id, query_text)
     if not text_id:
         v["_log"].info("no matching text is found")
         return ""
     if inf:
-        tag_id = db().tag_by_value(channel_id)[inf]
-        return db().get_text_tag_value(channel_id, text_id, tag_id)
+        return db().get_text_form(channel_id, text_id, inf)
     txt = db().get_text(channel_id, text_id)
     if not txt:
         v["_log"].info(f"failed to get text {text_id}")
@@ -49,12 +60,14 @@ def randint(a=0, b=100):
     return random.randint(a, b)
 
 
+@touches_db
 @jinja2.pass_context
 def get_variable(ctx, name: str, category: str = "", default_value: str = ""):
     channel_id = ctx.get("channel_id")
     return db().get_variable(channel_id, name, category, default_value)
 
 
+@touches_db
 @jinja2.pass_context
 def set_variable(ctx, name: str, value: str = "", category: str = "", expires: int = 9 * 3600):
     channel_id = ctx.get("channel_id")
@@ -62,12 +75,14 @@ def set_variable(ctx, name: str, value: str = "", category: str = "", expires: i
     return ""
 
 
+@touches_db
 @jinja2.pass_context
 def get_variables_category_size(ctx, name: str) -> int:
     channel_id = ctx.get("channel_id")
     return db().count_variables_in_category(channel_id, name)
 
 
+@touches_db
 @jinja2.pass_context
 def delete_category(ctx, name: str):
     channel_id = ctx.get("channel_id")
@@ -75,6 +90,7 @@ def delete_category(ctx, name: str):
     return ""
 
 
+@touches_db
 @jinja2.pass_context
 def list_category(ctx, name: str) -> list[tuple[str, str]]:
     channel_id = ctx.get("channel_id")
@@ -94,20 +110,23 @@ def new_message(ctx, s: str):
 
 
 def register_template_globals():
-    """Register all globally available functions to the Jinja SandboxedEnvironment."""
+    """Register all globally available functions to the Jinja SandboxedEnvironment.
+
+    Each is profiled under its template name when `profiler` is on for the channel."""
+    functions = {
+        "txt": render_text_item,
+        "randint": randint,
+        "discord_literal": discord_literal,
+        "get": get_variable,
+        "set": set_variable,
+        "category_size": get_variables_category_size,
+        "list_category": list_category,
+        "delete_category": delete_category,
+        "message": new_message,
+        "timestamp": lambda: int(time.time()),
+        "dt": discord_or_twitch,
+        "discord_name": discord_literal,
+    }
     typing.cast(dict, templates.globals).update(
-        {
-            "txt": render_text_item,
-            "randint": randint,
-            "discord_literal": discord_literal,
-            "get": get_variable,
-            "set": set_variable,
-            "category_size": get_variables_category_size,
-            "list_category": list_category,
-            "delete_category": delete_category,
-            "message": new_message,
-            "timestamp": lambda: int(time.time()),
-            "dt": discord_or_twitch,
-            "discord_name": discord_literal,
-        }
+        {name: profiler.profiled("template", name)(fn) for name, fn in functions.items()}
     )
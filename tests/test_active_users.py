@@ -0,0 +1,82 @@
+"""Tests for active_users.ActiveUsers: swap-remove index, expiry wheel, random pick."""
+
+import collections
+import random
+import sys
+import threading
+
+from active_users import ActiveUsers
+
+
+def test_touch_remove_keeps_index_consistent():
+    users = ActiveUsers(ttl_s=100.0, bucket_s=10.0)
+    for i, name in enumerate("abcde"):
+        users.touch(name, now=float(i))
+    users.remove("b")
+    users.remove("e")
+    users.remove("missing")
+    assert sorted(users) == ["a", "c", "d"]
+    assert len(users) == 3
+    for name in users:
+        assert users._users[users._pos[name]] == name
+
+
+def test_expiry_by_bucket():
+    users = ActiveUsers(ttl_s=100.0, bucket_s=10.0)
+    users.touch("old", now=0.0)
+    users.touch("kept", now=0.0)
+    users.touch("new", now=55.0)
+    users.touch("kept", now=95.0)  # moves to a newer bucket
+    users.expire(now=105.0)
+    assert "old" in users  # bucket [0, 10) is not fully past the TTL yet
+    users.expire(now=110.0)
+    assert sorted(users) == ["kept", "new"]
+    users.expire(now=10_000.0)
+    assert len(users) == 0
+    # The wheel restarts cleanly after going empty.
+    users.touch("back", now=10_001.0)
+    users.expire(now=10_050.0)
+    assert list(users) == ["back"]
+
+
+def test_random_excludes_and_is_uniform():
+    random.seed(1)
+    users = ActiveUsers(ttl_s=100.0)
+    for name in "abcdef":
+        users.touch(name, now=0.0)
+    counts = collections.Counter(
+        users.random(exclude=["b", "e", "zz"], now=1.0) for _ in range(4000)
+    )
+    assert set(counts) == {"a", "c", "d", "f"}
+    assert min(counts.values()) > 850
+    assert users.random(exclude="abcdef", now=1.0) is None
+    assert ActiveUsers(ttl_s=1.0).random() is None
+
+
+def test_random_from_another_thread():
+    users = ActiveUsers(ttl_s=0.002, bucket_s=0.001)
+    stop = threading.Event()
+    errors: list[Exception] = []
+
+    def pick():
+        try:
+            while not stop.is_set():
+                user = users.random(exclude=("u1",))
+                assert user is None or user != "u1"
+        except Exception as e:  # collected for the main thread
+            errors.append(e)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    thread = threading.Thread(target=pick)
+    thread.start()
+    try:
+        for i in range(20000):
+            users.touch(f"u{i % 50}")
+    finally:
+        stop.set()
+        thread.join()
+        sys.setswitchinterval(interval)
+    assert errors == []
+    for name in users:
+        assert users._users[users._pos[name]] == name
@@ -0,0 +1,65 @@
+"""Tests for banner.BannerRenderer: parsing, caches and off-loop rendering."""
+
+import asyncio
+import os
+from io import BytesIO
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from PIL import Image, UnidentifiedImageError
+
+from banner import BannerOverlay, BannerRenderer, parse_banner
+from disk_cache import CacheEntry
+
+FONT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "arial.ttf")
+
+
+def _base_png(tmp_path) -> str:
+    path = str(tmp_path / "base.png")
+    Image.new("RGB", (60, 20), (0, 0, 0)).save(path)
+    return path
+
+
+def test_parse_banner():
+    url, overlays = parse_banner(" http://x/a.png ;;1,2,10,255,0,0,hi, there")
+    assert url == "http://x/a.png"
+    assert overlays == [BannerOverlay(x=1, y=2, size=10, r=255, g=0, b=0, text="hi, there")]
+
+
+def _cache(tmp_path, entry):
+    cache = MagicMock()
+    cache.get = AsyncMock(return_value=entry)
+    cache.invalidate = AsyncMock()
+    cache.path.return_value = _base_png(tmp_path)
+    return cache
+
+
+def test_render_caches_base_image_fonts_and_output(tmp_path):
+    cache = _cache(tmp_path, CacheEntry(url="http://x/a.png", file="base.png", version=1))
+    renderer = BannerRenderer(cache, font_path=FONT)
+    first = asyncio.run(renderer.render("http://x/a.png;;0,0,12,255,255,255,A"))
+    again = asyncio.run(renderer.render("http://x/a.png;;0,0,12,255,255,255,A"))
+    other = asyncio.run(renderer.render("http://x/a.png;;0,0,12,255,255,255,B"))
+    renderer.close()
+    assert first is again
+    assert first != other
+    assert list(renderer._images) == [("http://x/a.png", 1)]
+    assert list(renderer._fonts) == [12]
+    # Overlays are drawn on a copy; the cached base image stays clean.
+    assert renderer._images["http://x/a.png", 1].getextrema() == ((0, 0), (0, 0), (0, 0))
+    assert Image.open(BytesIO(first)).getextrema() != ((0, 0), (0, 0), (0, 0))
+
+
+def test_render_unavailable_or_broken_image(tmp_path):
+    renderer = BannerRenderer(_cache(tmp_path, None), font_path=FONT)
+    assert asyncio.run(renderer.render("http://x/missing.png")) is None
+
+    cache = _cache(tmp_path, CacheEntry(url="http://x/b.png", file="b.png"))
+    cache.path.return_value = str(tmp_path / "not-an-image.png")
+    with open(cache.path.return_value, "w") as f:
+        f.write("<html>")
+    renderer = BannerRenderer(cache, font_path=FONT)
+    with pytest.raises(UnidentifiedImageError):
+        asyncio.run(renderer.render("http://x/b.png"))
+    cache.invalidate.assert_awaited_once_with("http://x/b.png")
+    renderer.close()
@@ -0,0 +1,127 @@
+"""Stress test of the channel cache under concurrent readers and writers."""
+
+import random
+import sys
+import threading
+import time
+
+import pytest
+import ttldict2
+
+import query
+from memory_db import MemoryDB
+from storage import ChannelCache
+
+CHANNELS = (1, 2, 3)
+TAGS = ("a", "b", "c")
+QUERIES = ("a", "b", "a and not b", "b or c", "c")
+
+
+@pytest.fixture
+def fast_switching():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def check_consistency(d: MemoryDB, ch: ChannelCache):
+    assert set(ch.all_text_by_id) == {i for i, (c, _) in d._texts.items() if c == ch.channel_id}
+    assert len(ch.all_texts_list) == len(ch.all_text_by_id)
+    for te in ch.all_texts_list:
+        assert ch.all_text_by_id[te.id] is te
+        assert te.in_all.value is te
+    assert set(ch.query_to_id.values()) == set(ch.queries)
+    for qid, qq in ch.queries.items():
+        assert len(qq.queue) == sum(qid in te.queue_nodes for te in ch.all_text_by_id.values())
+        for te in qq.queue:
+            assert te.queue_nodes[qid].value is te
+            assert query.match_tags(qq.parsed, te.tags)
+    for te in ch.all_text_by_id.values():
+        for qid, node in te.queue_nodes.items():
+            assert node.owner() is ch.queries[qid].queue
+
+
+def worker(d: MemoryDB, seed: int, n: int, errors: list):
+    rng = random.Random(seed)
+    try:
+        for _ in range(n):
+            channel_id = rng.choice(CHANNELS)
+            op = rng.random()
+            ids = list(d.channel(channel_id).all_text_by_id)
+            tags = d.tag_by_value(channel_id)
+            if op < 0.5 or not ids:
+                d.get_random_text_id(channel_id, rng.choice(QUERIES))
+            elif op < 0.7:
+                new = {tags[t]: None for t in TAGS if rng.random() < 0.5}
+                d.set_text_tags(channel_id, rng.choice(ids), new)
+            elif op < 0.8:
+                text_id = d.add_text(channel_id, f"t{rng.randrange(200)}")
+                d.set_text_tags(channel_id, text_id, {tags[rng.choice(TAGS)]: None})
+            elif op < 0.9:
+                d.delete_text(channel_id, rng.choice(ids))
+            elif op < 0.95:
+                d.get_text_form(channel_id, rng.choice(ids), "рд")
+            else:
+                d.expire_old_queries()
+    except Exception as e:  # collected for the main thread
+        errors.append(e)
+
+
+def test_concurrent_channel_cache(fast_switching):
+    d = MemoryDB()
+    for channel_id in CHANNELS:
+        for t in TAGS:
+            d.add_tag(channel_id, t)
+        tags = d.tag_by_value(channel_id)
+        for i in range(50):
+            text_id = d.add_text(channel_id, f"t{i}")
+            d.set_text_tags(channel_id, text_id, {tags[TAGS[i % 3]]: None})
+        # Let queries expire while they are being used.
+        d.channel(channel_id).active_queries = ttldict2.TTLDict(ttl_seconds=0.001)
+    errors: list[Exception] = []
+    threads = [threading.Thread(target=worker, args=(d, seed, 1500, errors)) for seed in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    for channel_id in CHANNELS:
+        check_consistency(d, d.channel(channel_id))
+
+
+def test_channel_is_loaded_once():
+    d = MemoryDB()
+    d.add_tag(7, "a")
+    d.channels.clear()
+    select_tags = d._select_tags
+    d._select_tags = lambda channel_id: time.sleep(0.01) or select_tags(channel_id)
+    got: list[ChannelCache] = []
+    threads = [threading.Thread(target=lambda: got.append(d.channel(7))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(ch is got[0] for ch in got)
+
+
+def test_delete_between_insert_and_cache_update():
+    # A delete of the row add_text() just got back must not run before add_text()
+    # caches it, or the cache keeps an entry for a deleted row.
+    d = MemoryDB()
+    d.add_tag(1, "a")
+    insert_text = d._insert_text
+    deleter: list[threading.Thread] = []
+
+    def insert_then_delete(channel_id, value):
+        got = insert_text(channel_id, value)
+        deleter.append(threading.Thread(target=d.delete_text, args=(channel_id, got)))
+        deleter[0].start()
+        deleter[0].join(timeout=0.05)  # returns at once unless the delete waits for add_text
+        return got
+
+    d._insert_text = insert_then_delete
+    text_id = d.add_text(1, "t")
+    deleter[0].join()
+    assert text_id not in d._texts
+    check_consistency(d, d.channel(1))
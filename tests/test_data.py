@@ -1,6 +1,16 @@
 """Tests for data.py pure logic — no DB or network required."""
 
-from data import Action, ActionKind, EventType, Lazy, dictToCommandData, fold_actions
+import logging
+
+from data import (
+    Action,
+    ActionKind,
+    EventType,
+    InvocationLog,
+    Lazy,
+    dictToCommandData,
+    fold_actions,
+)
 
 # ---------------------------------------------------------------------------
 # fold_actions
@@ -126,3 +136,39 @@ class TestDictToCommandData:
         assert cmd.version == 2
         assert len(cmd.actions) == 1
         assert cmd.actions[0].kind == ActionKind.NEW_MESSAGE
+
+
+# ---------------------------------------------------------------------------
+# InvocationLog
+# ---------------------------------------------------------------------------
+
+
+class _CountingStr:
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return "value"
+
+
+class TestInvocationLog:
+    def test_messages_are_formatted_on_read(self):
+        log = InvocationLog("prefix")
+        log.info("a %s b %s", 1, "x")
+        log.error("plain 100%")
+        assert log.messages == [(logging.INFO, "a 1 b x"), (logging.ERROR, "plain 100%")]
+
+    def test_disabled_level_is_not_formatted(self):
+        root = logging.getLogger()
+        level = root.level
+        root.setLevel(logging.INFO)
+        try:
+            arg = _CountingStr()
+            log = InvocationLog("prefix")
+            log.debug("value %s", arg)
+            assert arg.calls == 0
+            assert log.messages == [(logging.DEBUG, "value value")]
+            assert arg.calls == 1
+        finally:
+            root.setLevel(level)
@@ -0,0 +1,87 @@
+"""Tests for discord_client.deliver_actions: concurrency, ordering, rate-limit backoff."""
+
+import asyncio
+import time
+from unittest.mock import MagicMock, patch
+
+import discord
+
+import metrics
+from data import Action, ActionKind
+from discord_client import deliver_actions
+
+
+def _make_message(delay: float = 0.0):
+    """A fake discord.Message whose REST calls each take `delay` and are recorded."""
+    calls: list[tuple[str, str]] = []
+
+    def recorder(name):
+        async def call(text, **kwargs):
+            await asyncio.sleep(delay)
+            calls.append((name, text))
+
+        return call
+
+    message = MagicMock()
+    message.id = 10
+    message.author.id = 20
+    message.channel.id = 30
+    message.channel.send = recorder("send")
+    message.reply = recorder("reply")
+    message.author.send = recorder("dm")
+    message.add_reaction = recorder("react")
+    return message, calls
+
+
+def test_independent_destinations_are_concurrent():
+    message, calls = _make_message(delay=0.05)
+    actions = [
+        Action(ActionKind.REACT_EMOJI, text="👍"),
+        Action(ActionKind.PRIVATE_MESSAGE, text="psst"),
+        Action(ActionKind.REPLY, text="hi"),
+    ]
+    start = time.monotonic()
+    asyncio.run(deliver_actions(message, actions, start))
+    assert time.monotonic() - start < 0.12
+    assert sorted(calls) == [("dm", "psst"), ("react", "👍"), ("reply", "hi")]
+    hist = metrics.histogram("discord_action_seconds", "")
+    assert hist.count(kind="REPLY") >= 1
+
+
+def test_same_channel_keeps_order():
+    message, calls = _make_message(delay=0.01)
+    actions = [
+        Action(ActionKind.NEW_MESSAGE, text="1"),
+        Action(ActionKind.REPLY, text="2"),
+        Action(ActionKind.NEW_MESSAGE, text="3"),
+    ]
+    asyncio.run(deliver_actions(message, actions, time.monotonic()))
+    assert calls == [("send", "1"), ("reply", "2"), ("send", "3")]
+
+
+def test_rate_limited_action_is_retried_and_failure_does_not_block_others():
+    message, calls = _make_message()
+    attempts = 0
+
+    async def flaky_send(text, **kwargs):
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise discord.RateLimited(0.01)
+        calls.append(("send", text))
+
+    async def broken_dm(text, **kwargs):
+        raise discord.HTTPException(MagicMock(status=403, reason="Forbidden"), "no DMs")
+
+    message.channel.send = flaky_send
+    message.author.send = broken_dm
+    actions = [
+        Action(ActionKind.PRIVATE_MESSAGE, text="psst"),
+        Action(ActionKind.NEW_MESSAGE, text="a"),
+        Action(ActionKind.NEW_MESSAGE, text="b"),
+    ]
+    with patch("discord_client.logging"):
+        asyncio.run(deliver_actions(message, actions, time.monotonic()))
+    assert calls == [("send", "a"), ("send", "b")]
+    assert metrics.counter("discord_action_retries_total", "").value(kind="NEW_MESSAGE") >= 1
+    assert metrics.counter("discord_action_failures_total", "").value(kind="PRIVATE_MESSAGE") >= 1
@@ -0,0 +1,144 @@
+"""Tests for disk_cache.DiskCache against a local aiohttp server."""
+
+import asyncio
+import json
+import os
+import threading
+from unittest.mock import patch
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import http_client
+from disk_cache import INDEX_FILE, DiskCache, DownloadError
+
+
+class Origin:
+    """Serves /img/<name> with ETags and counts requests."""
+
+    def __init__(self):
+        self.bodies = {"a.png": b"a" * 100, "b.png": b"b" * 100, "c.png": b"c" * 100}
+        self.requests: list[tuple[str, str]] = []
+
+    async def handle(self, request):
+        name = request.match_info["name"]
+        self.requests.append((name, request.headers.get("If-None-Match", "")))
+        body = self.bodies.get(name)
+        if body is None:
+            raise web.HTTPNotFound()
+        etag = f'"{hash(body)}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.Response(body=body, headers={"ETag": etag})
+
+
+def _run(tmp_path, scenario):
+    async def run():
+        origin = Origin()
+        app = web.Application()
+        app.router.add_get("/img/{name}", origin.handle)
+        server = TestServer(app)
+        await server.start_server()
+        client = http_client.HttpClient()
+        try:
+            with patch.object(http_client, "client", return_value=client):
+                await scenario(origin, lambda name: str(server.make_url(f"/img/{name}")))
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(run())
+
+
+def test_hit_revalidate_and_change(tmp_path):
+    async def scenario(origin, url):
+        cache = DiskCache(str(tmp_path), revalidate_after_s=3600.0)
+        first = await cache.get(url("a.png"))
+        assert first is not None
+        with open(cache.path(first), "rb") as f:
+            assert f.read() == b"a" * 100
+        assert await cache.get(url("a.png")) is first
+        assert len(origin.requests) == 1
+
+        cache.revalidate_after_s = 0.0
+        version = first.version
+        await cache.get(url("a.png"))
+        assert origin.requests[-1][1] != ""  # conditional request
+        assert first.version == version  # 304 keeps the content
+
+        origin.bodies["a.png"] = b"new"
+        await cache.get(url("a.png"))
+        assert first.version != version
+        assert first.size == 3 and cache.total_bytes == 3
+
+    _run(tmp_path, scenario)
+
+
+def test_negative_cache_and_stale_on_error(tmp_path):
+    async def scenario(origin, url):
+        cache = DiskCache(str(tmp_path), negative_ttl_s=600.0)
+        with pytest.raises(DownloadError):
+            await cache.get(url("missing.png"))
+        assert await cache.get(url("missing.png")) is None
+        assert len(origin.requests) == 1
+
+        entry = await cache.get(url("a.png"))
+        del origin.bodies["a.png"]
+        cache.revalidate_after_s = 0.0
+        assert await cache.get(url("a.png")) is entry  # stale copy beats no copy
+        assert os.path.isfile(cache.path(entry))
+
+    _run(tmp_path, scenario)
+
+
+def test_lru_eviction_and_persistence(tmp_path):
+    async def scenario(origin, url):
+        cache = DiskCache(str(tmp_path), max_bytes=250)
+        a = await cache.get(url("a.png"))
+        await cache.get(url("b.png"))
+        await cache.get(url("a.png"))  # a is now more recent than b
+        c = await cache.get(url("c.png"))
+        assert cache.total_bytes == 200
+        assert sorted(os.listdir(tmp_path)) == sorted([a.file, c.file, INDEX_FILE])
+
+        # Reloading keeps the index and removes files it doesn't know.
+        with open(tmp_path / "legacy.png", "w") as f:
+            f.write("ERROR: old marker")
+        reloaded = DiskCache(str(tmp_path), max_bytes=250)
+        assert reloaded.total_bytes == 200
+        assert not os.path.exists(tmp_path / "legacy.png")
+        assert await reloaded.get(url("c.png")) == c
+        assert len(origin.requests) == 3  # the second get of a.png was a hit
+
+    _run(tmp_path, scenario)
+    with open(tmp_path / INDEX_FILE) as f:
+        assert len(json.load(f)) == 2
+
+
+def test_store_and_invalidate_write_off_the_loop(tmp_path):
+    async def scenario(origin, url):
+        loop_thread = threading.current_thread()
+        writers = set()
+        write_index = DiskCache._write_index
+
+        def record(self, items):
+            writers.add(threading.current_thread())
+            write_index(self, items)
+
+        cache = DiskCache(str(tmp_path), max_bytes=250)
+        with patch.object(DiskCache, "_write_index", record):
+            a = await cache.get(url("a.png"))
+            first = await cache.store("one.png", b"1" * 100)
+            await cache.store("two.png", b"2" * 100)  # evicts a.png
+            assert not os.path.exists(cache.path(a))
+            with open(first, "rb") as f:
+                assert f.read() == b"1" * 100
+            await cache.invalidate("local:one.png")
+            assert not os.path.exists(first)
+        assert writers and loop_thread not in writers
+        assert cache.total_bytes == 100
+        with open(tmp_path / INDEX_FILE) as f:
+            assert [e["file"] for e in json.load(f).values()] == ["two.png"]
+
+    _run(tmp_path, scenario)
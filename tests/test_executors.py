@@ -0,0 +1,84 @@
+"""Tests for the named executors and how commands are routed to them."""
+
+import asyncio
+import contextvars
+import threading
+
+import executors
+import metrics
+from commands.text import TextDownload, TextUpload
+from data import EventType, InvocationLog, Message
+
+queued = metrics.gauge("executor_queued", "")
+
+var: contextvars.ContextVar[str] = contextvars.ContextVar("var", default="")
+
+
+def test_runs_with_callers_context():
+    e = executors.Executor("t_context", 1)
+
+    async def main():
+        var.set("caller")
+        return await e.run(lambda x: (var.get(), threading.current_thread().name, x), 1)
+
+    value, thread, x = asyncio.run(main())
+    assert (value, x) == ("caller", 1)
+    assert thread.startswith("t_context")
+    e.shutdown()
+
+
+def test_queue_depth_and_isolation():
+    batch = executors.Executor("t_batch", 1)
+    other = executors.Executor("t_other", 1)
+    release = threading.Event()
+
+    async def main():
+        jobs = [asyncio.ensure_future(batch.run(release.wait)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        assert (batch.active, batch.queued) == (1, 2)
+        metrics.exposition()
+        assert queued.value(executor="t_batch") == 2
+        # A busy executor doesn't hold up another one.
+        assert await asyncio.wait_for(other.run(lambda: "ok"), 1) == "ok"
+        release.set()
+        await asyncio.gather(*jobs)
+
+    asyncio.run(main())
+    assert (batch.active, batch.queued) == (0, 0)
+    batch.shutdown()
+    other.shutdown()
+
+
+def test_cancelled_before_start():
+    e = executors.Executor("t_cancel", 1)
+    started, release = threading.Event(), threading.Event()
+    running = e.submit(lambda: started.set() or release.wait())
+    waiting = e.submit(lambda: None)
+    started.wait()
+    assert e.queued == 1
+    assert waiting.cancel()
+    assert e.queued == 0
+    release.set()
+    running.result()
+    e.shutdown()
+
+
+def message(text: str) -> Message:
+    return Message(
+        id="1",
+        log=InvocationLog("test"),
+        channel_id=1,
+        txt=text,
+        event=EventType.message,
+        prefix="+",
+        is_discord=True,
+        is_mod=True,
+        private=False,
+        get_variables=dict,
+    )
+
+
+def test_batch_commands_only_when_invoked():
+    for cmd, text in ((TextUpload(), "+upload"), (TextDownload(), "+download red")):
+        assert cmd.executor(message(text)) is executors.BATCH
+        assert cmd.executor(message("hello")) is executors.TEMPLATE
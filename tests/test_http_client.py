@@ -0,0 +1,136 @@
+"""Tests for http_client.HttpClient against a local aiohttp server."""
+
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import http_client
+from http_client import HttpClient, ResponseTooLarge
+
+
+async def _serve():
+    async def small(request):
+        return web.Response(body=b"hello")
+
+    async def big(request):
+        resp = web.StreamResponse()  # chunked, no Content-Length
+        await resp.prepare(request)
+        for _ in range(10):
+            await resp.write(b"x" * 1000)
+        return resp
+
+    async def missing(request):
+        raise web.HTTPNotFound()
+
+    app = web.Application()
+    app.router.add_get("/small", small)
+    app.router.add_get("/big", big)
+    app.router.add_get("/missing", missing)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def test_fetch_download_and_limits(tmp_path):
+    async def run():
+        server = await _serve()
+        client = HttpClient(max_bytes=5000)
+        try:
+            assert await client.fetch(str(server.make_url("/small"))) == b"hello"
+            session = client.session()
+            path = str(tmp_path / "out.bin")
+            await client.download(str(server.make_url("/small")), path)
+            assert client.session() is session  # pooled
+            with open(path, "rb") as f:
+                assert f.read() == b"hello"
+            with pytest.raises(ResponseTooLarge):
+                await client.fetch(str(server.make_url("/big")))
+            with pytest.raises(ResponseTooLarge):
+                await client.download(str(server.make_url("/big")), str(tmp_path / "big"))
+            assert os.listdir(tmp_path) == ["out.bin"]  # no partial files left
+            assert len(await client.fetch(str(server.make_url("/big")), max_bytes=10_000)) == 10_000
+            with pytest.raises(Exception, match="404"):
+                await client.fetch(str(server.make_url("/missing")))
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(run())
+
+
+def test_download_writes_off_the_loop(tmp_path, monkeypatch):
+    threads = []
+    real_open = open
+
+    def recording_open(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return real_open(*args, **kwargs)
+
+    monkeypatch.setattr(http_client, "open", recording_open, raising=False)
+
+    async def run():
+        server = await _serve()
+        client = HttpClient()
+        try:
+            await client.download(str(server.make_url("/small")), str(tmp_path / "out.bin"))
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(run())
+    assert threads and all(t.startswith("http_download") for t in threads)
+    assert (tmp_path / "out.bin").read_bytes() == b"hello"
+
+
+def test_session_on_a_new_loop_closes_the_old_one():
+    client = HttpClient()
+    old_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=old_loop.run_forever)
+    thread.start()
+    try:
+
+        async def session():
+            return client.session()
+
+        old = asyncio.run_coroutine_threadsafe(session(), old_loop).result()
+
+        async def run():
+            new = client.session()
+            assert new is not old
+            await client.close()
+
+        asyncio.run(run())
+        for _ in range(100):
+            if old.closed:
+                break
+            time.sleep(0.01)
+        assert old.closed
+    finally:
+        old_loop.call_soon_threadsafe(old_loop.stop)
+        thread.join()
+        old_loop.close()
+
+
+def test_fetch_blocking_from_worker_thread():
+    async def run():
+        server = await _serve()
+        client = HttpClient()
+        client.attach(asyncio.get_running_loop())
+        try:
+            url = str(server.make_url("/small"))
+            assert await asyncio.to_thread(client.fetch_blocking, url) == b"hello"
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(run())
+
+
+def test_fetch_blocking_requires_loop():
+    with pytest.raises(RuntimeError):
+        HttpClient().fetch_blocking("http://localhost/")
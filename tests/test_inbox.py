@@ -0,0 +1,111 @@
+"""Tests for inbox.Inbox: per-channel order, bounded concurrency, load shedding."""
+
+import asyncio
+
+import metrics
+from inbox import Inbox, Kind
+
+
+class Recorder:
+    def __init__(self):
+        self.done: list[tuple[str, int]] = []
+        self.running = 0
+        self.max_running = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    def event(self, channel: str, i: int):
+        async def process():
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            await self.gate.wait()
+            await asyncio.sleep(0)
+            self.done.append((channel, i))
+            self.running -= 1
+
+        return process
+
+
+def dropped(inbox: str, kind: Kind, reason: str) -> float:
+    counter = metrics.counter("inbox_dropped_total", "")
+    return counter.value(inbox=inbox, kind=kind.value, reason=reason)
+
+
+def test_per_channel_order_and_bounded_concurrency():
+    async def run():
+        r = Recorder()
+        box = Inbox("t-order", max_active=2, burst=2)
+        for i in range(5):
+            for channel in "abc":
+                assert box.submit(channel, r.event(channel, i), Kind.COMMAND)
+        assert len(box) == 15 and box.pending("a") == 5
+        await box.drain()
+        for channel in "abc":
+            assert [i for c, i in r.done if c == channel] == list(range(5))
+        assert r.max_running == 2
+        # Channels take turns: "c" doesn't wait for "a" and "b" to finish.
+        assert r.done.index(("c", 0)) < r.done.index(("a", 4))
+        assert len(box) == 0
+
+    asyncio.run(run())
+
+
+def test_chatter_is_shed_first():
+    async def run():
+        r = Recorder()
+        r.gate.clear()
+        box = Inbox("t-shed", shed_at=2, max_pending=4)
+        box.submit("a", r.event("a", 0), Kind.COMMAND)
+        await asyncio.sleep(0)  # taken by the channel task, waits on the gate
+        assert box.submit("a", r.event("a", 1), Kind.CHATTER)
+        assert box.submit("a", r.event("a", 2), Kind.CHATTER)
+        assert not box.submit("a", r.event("a", 3), Kind.CHATTER)
+        assert box.submit("a", r.event("a", 4), Kind.COMMAND)
+        assert box.submit("a", r.event("a", 5), Kind.EVENT)
+        assert not box.submit("a", r.event("a", 6), Kind.COMMAND)
+        # Another channel is unaffected.
+        assert box.submit("b", r.event("b", 0), Kind.CHATTER)
+        r.gate.set()
+        await box.drain()
+        assert [i for c, i in r.done if c == "a"] == [0, 1, 2, 4, 5]
+        assert dropped("t-shed", Kind.CHATTER, "full") == 1
+        assert dropped("t-shed", Kind.COMMAND, "full") == 1
+
+    asyncio.run(run())
+
+
+def test_stale_chatter_is_dropped():
+    async def run():
+        r = Recorder()
+        r.gate.clear()
+        box = Inbox("t-stale", chatter_ttl_s=0.01)
+        box.submit("a", r.event("a", 0), Kind.COMMAND)
+        await asyncio.sleep(0)
+        box.submit("a", r.event("a", 1), Kind.CHATTER)
+        box.submit("a", r.event("a", 2), Kind.COMMAND)
+        await asyncio.sleep(0.02)
+        r.gate.set()
+        await box.drain()
+        assert r.done == [("a", 0), ("a", 2)]
+        assert dropped("t-stale", Kind.CHATTER, "stale") == 1
+        hist = metrics.histogram("inbox_wait_seconds", "")
+        assert hist.count(inbox="t-stale", kind="command") == 2
+
+    asyncio.run(run())
+
+
+def test_failure_does_not_stop_the_channel():
+    async def run():
+        r = Recorder()
+        box = Inbox("t-fail")
+
+        async def fail():
+            raise ValueError("boom")
+
+        box.submit("a", fail, Kind.COMMAND)
+        box.submit("a", r.event("a", 1), Kind.COMMAND)
+        await box.drain()
+        assert r.done == [("a", 1)]
+        box.close()
+
+    asyncio.run(run())
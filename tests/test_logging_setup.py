@@ -0,0 +1,62 @@
+"""Tests for main.setup_logging(): queue-based pipeline and per-handler levels."""
+
+import logging
+import logging.handlers
+import sys
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def root_logger(monkeypatch):
+    monkeypatch.delenv("NTFY_TOPIC", raising=False)
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_records_reach_files_through_listener(root_logger, tmp_path):
+    prefix = str(tmp_path / "bot")
+    listener = main.setup_logging(prefix, also_log_to_stdout=False)
+    assert [type(h) for h in root_logger.handlers[-1:]] == [main.UnformattedQueueHandler]
+    logging.debug("debug line")
+    logging.info("info line")
+    logging.error("error line")
+    listener.stop()
+    debug = (tmp_path / "bot.debug.log").read_text(encoding="utf-8")
+    info = (tmp_path / "bot.info.log").read_text(encoding="utf-8")
+    errors = (tmp_path / "bot.errors.log").read_text(encoding="utf-8")
+    assert "debug line" in debug and "error line" in debug
+    assert "debug line" not in info and "info line" in info
+    assert "info line" not in errors and "error line" in errors
+
+
+def test_root_level_is_lowest_enabled_handler_level(root_logger, tmp_path):
+    listener = main.setup_logging(
+        str(tmp_path / "bot"), also_log_to_stdout=False, debug_level="OFF"
+    )
+    listener.stop()
+    assert root_logger.level == logging.INFO
+    assert not (tmp_path / "bot.debug.log").exists()
+    assert not root_logger.isEnabledFor(logging.DEBUG)
+
+
+def test_records_are_formatted_on_the_listener(root_logger, tmp_path):
+    listener = main.setup_logging(str(tmp_path / "bot"), also_log_to_stdout=False)
+    handler = root_logger.handlers[-1]
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = root_logger.makeRecord("x", logging.ERROR, "f", 1, "a %s", (["b"],), None)
+        record.exc_info = sys.exc_info()
+    prepared = handler.prepare(record)
+    assert prepared.msg == "a ['b']" and prepared.args is None
+    assert prepared.exc_info is not None and prepared.exc_text is None
+    handler.handle(record)
+    listener.stop()
+    errors = (tmp_path / "bot.errors.log").read_text(encoding="utf-8")
+    assert "a ['b']" in errors and "ValueError: boom" in errors
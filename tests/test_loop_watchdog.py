@@ -0,0 +1,50 @@
+"""Tests for the event loop lag watchdog."""
+
+import asyncio
+import time
+
+import metrics
+from loop_watchdog import LoopWatchdog
+
+
+def blocking_callback():
+    time.sleep(0.3)
+
+
+def test_captures_blocking_stack():
+    blocks = metrics.counter("event_loop_blocks_total", "")
+    lag = metrics.histogram("event_loop_lag_seconds", "")
+    before = blocks.value(where="test_loop_watchdog.py:blocking_callback")
+    observed = lag.count()
+
+    async def main():
+        watchdog = LoopWatchdog(asyncio.get_running_loop(), interval_s=0.01, threshold_s=0.1)
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        blocking_callback()
+        await asyncio.sleep(0.05)
+        watchdog.stop()
+        await asyncio.sleep(0.05)
+        return watchdog
+
+    watchdog = asyncio.run(main())
+    (block,) = watchdog.recent()
+    assert block.where == "test_loop_watchdog.py:blocking_callback"
+    assert "in main" in block.stack and "time.sleep(0.3)" in block.stack
+    assert 0.1 <= block.blocked_s < 0.3
+    assert blocks.value(where=block.where) == before + 1
+    assert lag.count() > observed
+    assert lag.quantile(1.0) >= 0.1
+
+
+def test_quiet_loop_reports_nothing():
+    async def main():
+        watchdog = LoopWatchdog(asyncio.get_running_loop(), interval_s=0.01, threshold_s=0.1)
+        watchdog.start()
+        await asyncio.sleep(0.2)
+        return watchdog
+
+    # The heartbeat task is cancelled when asyncio.run() ends, which stops the watchdog.
+    watchdog = asyncio.run(main())
+    time.sleep(0.2)
+    assert watchdog.recent() == []
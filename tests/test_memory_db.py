@@ -0,0 +1,134 @@
+"""Tests for the in-memory storage backend."""
+
+import asyncio
+import time
+
+import pytest
+
+import commands
+import storage
+import templates
+from data import EventType, InvocationLog, Message, dictToCommandData
+from memory_db import MemoryDB
+
+templates.register_template_globals()
+
+
+@pytest.fixture
+def mem():
+    previous = storage._db
+    d = MemoryDB()
+    storage.set_db(d)
+    commands.commands_cache.clear()
+    yield d
+    commands.commands_cache.clear()
+    storage.set_db(previous)
+
+
+def add_texts(d: MemoryDB, channel_id: int) -> dict[str, int]:
+    for t in ("fruit", "red", "рд"):
+        d.add_tag(channel_id, t)
+    tags = d.tag_by_value(channel_id)
+    ids = {}
+    for value, tt in [
+        ("apple", {"fruit": None, "red": None, "рд": "apple's"}),
+        ("pear", {"fruit": None}),
+    ]:
+        ids[value] = d.add_text(channel_id, value)
+        d.set_text_tags(channel_id, ids[value], {tags[k]: v for k, v in tt.items()})
+    return ids
+
+
+def test_channels(mem):
+    a, prefix = mem.twitch_channel_info(None, "alice")
+    assert prefix == "+"
+    assert mem.twitch_channel_info(None, "alice") == (a, "+")
+    b, _ = mem.discord_channel_info(None, "guild")
+    assert b == a + 1
+    mem.set_twitch_prefix(a, "!")
+    assert mem.twitch_channel_info(None, "alice") == (a, "!")
+    mem.set_discord_allowed_channels(b, {"general"})
+    assert mem.get_discord_allowed_channels(b) == {"general"}
+    assert mem.get_discord_allowed_channels(a) == set()
+
+
+def test_texts_and_queries(mem):
+    ids = add_texts(mem, 1)
+    assert mem.add_text(1, "apple") == ids["apple"]
+    assert mem.find_text(1, "pear") == ids["pear"]
+    assert mem.get_text(2, ids["pear"]) is None
+    assert mem.get_random_text_id(1, "red") == ids["apple"]
+    assert mem.get_random_text_id(1, "fruit and not red") == ids["pear"]
+    assert mem.get_text_form(1, ids["apple"], "рд") == "apple's"
+    assert [t[1] for t in mem.text_search(1, "ap")] == ["apple"]
+    assert mem.set_text(1, "green apple", ids["apple"]) == "apple"
+    assert {t[1] for t in mem.all_texts(1)} == {"green apple", "pear"}
+    assert mem.delete_text(1, ids["pear"]) == 1
+    assert mem.get_random_text_id(1, "fruit and not red") is None
+    # The channel cache rebuilt from the rows matches the incrementally updated one.
+    mem.channels.clear()
+    assert mem.get_random_text_id(1, "red") == ids["apple"]
+    assert mem.delete_tag(1, mem.tag_by_value(1)["red"]) == 1
+    assert mem.get_text_tag_values(1, ids["apple"]).keys() == {
+        mem.tag_by_value(1)["fruit"],
+        mem.tag_by_value(1)["рд"],
+    }
+
+
+def test_variables(mem):
+    now = int(time.time())
+    mem.set_variable(1, "a", "1", "c", now + 100)
+    mem.set_variable(1, "b", "2", "c", now - 100)
+    assert mem.get_variable(1, "a", "c", "x") == "1"
+    assert mem.get_variable(1, "b", "c", "x") == "x"
+    assert mem.count_variables_in_category(1, "c") == 1
+    assert mem.list_variables(1, "c") == [("a", "1")]
+    assert mem.expire_variables() == 1
+    mem.set_variable(1, "a", "", "c", now + 100)
+    assert mem.get_variable(1, "a", "c", "x") == "x"
+    mem.set_variable(1, "a", "1", "c", now + 100)
+    assert mem.delete_category(1, "c") == 1
+
+
+def test_commands(mem):
+    cmd = dictToCommandData(
+        {"name": "hi", "pattern": "!prefixhi\\b", "actions": [{"kind": "message", "text": "x"}]}
+    )
+    first = mem.set_command(mem.cursor(), 1, "me", cmd)
+    assert mem.set_command(mem.cursor(), 1, "me", cmd) == first
+    assert [c.name for c in mem.get_commands(1, "+")] == ["hi"]
+    assert mem.get_commands(1, "+")[0].actions[0].kind == cmd.actions[0].kind
+    mem.delete_command(1, "hi")
+    assert mem.get_commands(1, "+") == []
+
+
+def test_cursor_does_not_run_sql(mem):
+    with mem.cursor() as cur, pytest.raises(NotImplementedError):
+        cur.execute("SELECT 1")
+
+
+def test_process_message(mem):
+    channel_id, prefix = mem.twitch_channel_info(None, "alice")
+    add_texts(mem, channel_id)
+    text = "{% set n = get('n', '', '0') | int + 1 %}{{ set('n', n | string) }}{{ n }} {{ txt('red') }}"
+    cmd = dictToCommandData(
+        {"name": "c", "pattern": "!prefixc\\b", "actions": [{"kind": "message", "text": text}]}
+    )
+    mem.set_command(mem.cursor(), channel_id, "me", cmd)
+    log = InvocationLog("test")
+    variables = {"author": "bob", "text": "+c", "media": "twitch", "channel_id": channel_id}
+    variables.update(prefix=prefix, bot="bot", is_mod=False, _log=log, _private=False, _id="1")
+    msg = Message(
+        id="1",
+        log=log,
+        channel_id=channel_id,
+        txt="+c",
+        event=EventType.message,
+        prefix=prefix,
+        is_discord=False,
+        is_mod=False,
+        private=False,
+        get_variables=lambda: variables,
+    )
+    assert [a.text for a in asyncio.run(commands.process_message(msg))] == ["1 apple"]
+    assert [a.text for a in asyncio.run(commands.process_message(msg))] == ["2 apple"]
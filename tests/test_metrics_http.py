@@ -0,0 +1,57 @@
+"""Tests for the Prometheus exposition and the /metrics route."""
+
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import metrics
+import metrics_http
+import words
+
+
+def test_exposition_counter_and_gauge():
+    metrics.counter("test_expo_total", "Things\nthat happened").inc(2, kind='a"b')
+    metrics.gauge("test_expo_gauge", "Level").set(0.5)
+    text = metrics.exposition()
+    assert "# HELP test_expo_total Things\\nthat happened\n" in text
+    assert "# TYPE test_expo_total counter\n" in text
+    assert 'test_expo_total{kind="a\\"b"} 2\n' in text
+    assert "# TYPE test_expo_gauge gauge\ntest_expo_gauge 0.5\n" in text
+
+
+def test_exposition_histogram_buckets_are_cumulative():
+    h = metrics.histogram("test_expo_seconds", "Latency", buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 0.7, 3.0):
+        h.observe(v, op="x")
+    lines = [x for x in metrics.exposition().splitlines() if x.startswith("test_expo_seconds")]
+    assert lines == [
+        'test_expo_seconds_bucket{op="x",le="0.1"} 1',
+        'test_expo_seconds_bucket{op="x",le="1"} 3',
+        'test_expo_seconds_bucket{op="x",le="+Inf"} 4',
+        'test_expo_seconds_sum{op="x"} 4.25',
+        'test_expo_seconds_count{op="x"} 4',
+    ]
+
+
+def test_collectors_run_before_exposition():
+    words.parse_word("кот")
+    words.parse_word("кот")
+    text = metrics.exposition()
+    hits = words.cache_info()["parse"].hits
+    assert f'words_cache_hits{{cache="parse"}} {hits}\n' in text
+
+
+def test_route():
+    metrics.counter("test_route_total", "Route test").inc()
+
+    async def get() -> tuple[str, str]:
+        app = web.Application()
+        metrics_http.add_route(app)
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get("/metrics")
+            return resp.headers["Content-Type"], await resp.text()
+
+    content_type, text = asyncio.run(get())
+    assert content_type == metrics_http.CONTENT_TYPE
+    assert "test_route_total 1\n" in text
@@ -1,6 +1,7 @@
 """Tests for NtfyHandler — push notification logging handler."""
 
 import logging
+import threading
 import time
 import urllib.error
 from unittest.mock import MagicMock, patch
@@ -43,6 +44,7 @@ def test_emit_posts_to_correct_url():
         mock_open.return_value.__enter__ = lambda s: s
         mock_open.return_value.__exit__ = MagicMock(return_value=False)
         handler.emit(record)
+        handler.flush()
     assert mock_open.called
     req = mock_open.call_args[0][0]
     assert req.full_url == "https://ntfy.sh/test-topic"
@@ -56,6 +58,7 @@ def test_emit_sets_title_header():
         mock_open.return_value.__enter__ = lambda s: s
         mock_open.return_value.__exit__ = MagicMock(return_value=False)
         handler.emit(record)
+        handler.flush()
     req = mock_open.call_args[0][0]
     assert req.get_header("Title") == "[ERROR] test.logger"
 
@@ -67,6 +70,7 @@ def test_emit_sets_rotating_light_tag_for_error():
         mock_open.return_value.__enter__ = lambda s: s
         mock_open.return_value.__exit__ = MagicMock(return_value=False)
         handler.emit(record)
+        handler.flush()
     req = mock_open.call_args[0][0]
     assert req.get_header("Tags") == "rotating_light"
 
@@ -78,6 +82,7 @@ def test_emit_sets_high_priority_for_critical():
         mock_open.return_value.__enter__ = lambda s: s
         mock_open.return_value.__exit__ = MagicMock(return_value=False)
         handler.emit(record)
+        handler.flush()
     req = mock_open.call_args[0][0]
     assert req.get_header("Priority") == "high"
 
@@ -94,7 +99,9 @@ def test_second_identical_emit_is_suppressed():
         mock_open.return_value.__enter__ = lambda s: s
         mock_open.return_value.__exit__ = MagicMock(return_value=False)
         handler.emit(record)
+        handler.flush()
         handler.emit(record)
+        handler.flush()
     assert mock_open.call_count == 1
 
 
@@ -105,10 +112,12 @@ def test_emit_after_window_expiry_is_sent():
         mock_open.return_value.__enter__ = lambda s: s
         mock_open.return_value.__exit__ = MagicMock(return_value=False)
         handler.emit(record)
+        handler.flush()
         # backdate the seen timestamp to simulate window expiry
         fp = NtfyHandler._fingerprint(record)
         handler._seen[fp] = time.monotonic() - 2
         handler.emit(record)
+        handler.flush()
     assert mock_open.call_count == 2
 
 
@@ -120,7 +129,9 @@ def test_different_call_sites_not_deduplicated():
         mock_open.return_value.__enter__ = lambda s: s
         mock_open.return_value.__exit__ = MagicMock(return_value=False)
         handler.emit(r1)
+        handler.flush()
         handler.emit(r2)
+        handler.flush()
     assert mock_open.call_count == 2
 
 
@@ -146,7 +157,9 @@ def test_same_exception_type_and_message_deduplicates():
         mock_open.return_value.__enter__ = lambda s: s
         mock_open.return_value.__exit__ = MagicMock(return_value=False)
         handler.emit(r1)
+        handler.flush()
         handler.emit(r2)
+        handler.flush()
     assert mock_open.call_count == 1
 
 
@@ -175,7 +188,9 @@ def test_different_exception_types_not_deduplicated():
         mock_open.return_value.__enter__ = lambda s: s
         mock_open.return_value.__exit__ = MagicMock(return_value=False)
         handler.emit(r1)
+        handler.flush()
         handler.emit(r2)
+        handler.flush()
     assert mock_open.call_count == 2
 
 
@@ -192,6 +207,7 @@ def test_network_failure_does_not_propagate():
         patch.object(handler, "handleError") as mock_handle,
     ):
         handler.emit(record)
+        handler.flush()
     mock_handle.assert_called_once_with(record)
 
 
@@ -204,6 +220,7 @@ def test_seen_not_updated_on_network_failure():
         patch.object(handler, "handleError"),
     ):
         handler.emit(record)
+        handler.flush()
     assert fp not in handler._seen
 
 
@@ -215,10 +232,12 @@ def test_retry_allowed_after_failed_send():
         patch.object(handler, "handleError"),
     ):
         handler.emit(record)
+        handler.flush()
     with patch("urllib.request.urlopen") as mock_open:
         mock_open.return_value.__enter__ = lambda s: s
         mock_open.return_value.__exit__ = MagicMock(return_value=False)
         handler.emit(record)
+        handler.flush()
     assert mock_open.call_count == 1
 
 
@@ -275,4 +294,86 @@ def test_body_truncated_to_4096_bytes():
 
         mock_open.side_effect = capture
         handler.emit(record)
+        handler.flush()
     assert len(captured["data"]) <= 4096
+
+
+# ---------------------------------------------------------------------------
+# Background delivery
+# ---------------------------------------------------------------------------
+
+
+def _blocking_urlopen(release: threading.Event, calls: list):
+    def fake_urlopen(req, timeout):
+        calls.append(req)
+        release.wait(5)
+        cm = MagicMock()
+        cm.__enter__ = lambda s: s
+        cm.__exit__ = MagicMock(return_value=False)
+        return cm
+
+    return fake_urlopen
+
+
+def test_emit_does_not_wait_for_network():
+    handler = make_handler()
+    release = threading.Event()
+    calls: list = []
+    with patch("urllib.request.urlopen", side_effect=_blocking_urlopen(release, calls)):
+        start = time.monotonic()
+        handler.emit(make_record())
+        assert time.monotonic() - start < 1.0
+        release.set()
+        assert handler.flush()
+    assert len(calls) == 1
+    assert handler.sent == 1
+
+
+def test_queued_duplicates_are_coalesced():
+    handler = make_handler()
+    release = threading.Event()
+    calls: list = []
+    with patch("urllib.request.urlopen", side_effect=_blocking_urlopen(release, calls)):
+        handler.emit(make_record(lineno=1))  # occupies the worker
+        while not calls:
+            time.sleep(0.01)
+        for _ in range(3):
+            handler.emit(make_record(lineno=2))
+        release.set()
+        handler.flush()
+    assert len(calls) == 2
+    assert handler.coalesced == 2
+    assert b"(repeated 3 times)" in calls[1].data
+
+
+def test_records_queued_during_post_are_batched():
+    handler = make_handler()
+    release = threading.Event()
+    calls: list = []
+    with patch("urllib.request.urlopen", side_effect=_blocking_urlopen(release, calls)):
+        handler.emit(make_record(lineno=1))
+        while not calls:
+            time.sleep(0.01)
+        handler.emit(make_record(lineno=2))
+        handler.emit(make_record(lineno=3))
+        release.set()
+        handler.flush()
+    assert len(calls) == 2
+    assert calls[1].get_header("Title") == "[ERROR] test.logger (+1 more)"
+    assert handler.sent == 3
+
+
+def test_full_queue_drops_and_counts():
+    handler = make_handler(max_queue=1)
+    release = threading.Event()
+    calls: list = []
+    with patch("urllib.request.urlopen", side_effect=_blocking_urlopen(release, calls)):
+        handler.emit(make_record(lineno=1))
+        while not calls:
+            time.sleep(0.01)
+        handler.emit(make_record(lineno=2))  # fills the queue
+        handler.emit(make_record(lineno=3))  # dropped
+        release.set()
+        handler.flush()
+    assert handler.dropped == 1
+    assert len(calls) == 2
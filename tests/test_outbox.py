@@ -0,0 +1,88 @@
+"""Tests for outbox.Outbox: priorities, coalescing, deadlines, background delivery."""
+
+import asyncio
+
+import metrics
+from outbox import Outbox, Priority
+
+
+class Recorder:
+    def __init__(self):
+        self.sent: list[str] = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def send(self, text: str):
+        await self.gate.wait()
+        self.sent.append(text)
+
+
+def test_put_returns_immediately_and_delivers_in_background():
+    async def run():
+        r = Recorder()
+        r.gate.clear()
+        box = Outbox(r.send, name="t-bg")
+        box.put("hello")
+        assert r.sent == []
+        r.gate.set()
+        await box.drain()
+        assert r.sent == ["hello"]
+
+    asyncio.run(run())
+
+
+def test_replies_before_cron_and_coalescing():
+    async def run():
+        r = Recorder()
+        r.gate.clear()
+        box = Outbox(r.send, name="t-prio", max_len=12)
+        box.put("first")  # taken by the delivery task, blocks on the gate
+        await asyncio.sleep(0)
+        box.put("cron", Priority.CRON)
+        box.put("a")
+        box.put("b")
+        box.put("long reply")  # would exceed max_len when merged
+        r.gate.set()
+        await box.drain()
+        assert r.sent == ["first", "a b", "long reply", "cron"]
+        assert metrics.counter("outbox_coalesced_total", "").value(outbox="t-prio") == 1
+
+    asyncio.run(run())
+
+
+def test_stale_and_overflow_messages_are_dropped():
+    async def run():
+        r = Recorder()
+        r.gate.clear()
+        box = Outbox(r.send, name="t-drop", max_pending=2)
+        box.put("first")
+        await asyncio.sleep(0)
+        box.put("stale", ttl_s=-1.0)
+        box.put("kept")
+        box.put("overflow")
+        r.gate.set()
+        await box.drain()
+        assert r.sent == ["first", "kept"]
+        dropped = metrics.counter("outbox_dropped_total", "")
+        assert dropped.value(outbox="t-drop", reason="stale") == 1
+        assert dropped.value(outbox="t-drop", reason="full") == 1
+
+    asyncio.run(run())
+
+
+def test_send_failure_does_not_stop_delivery():
+    async def run():
+        sent = []
+
+        async def send(text):
+            if text == "bad":
+                raise RuntimeError("boom")
+            sent.append(text)
+
+        box = Outbox(send, name="t-fail", max_len=3)
+        box.put("bad")
+        box.put("ok")
+        await box.drain()
+        assert sent == ["ok"]
+
+    asyncio.run(run())
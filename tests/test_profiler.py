@@ -0,0 +1,132 @@
+"""Tests for the opt-in per-channel profiler and the profile command."""
+
+import asyncio
+
+import pytest
+
+import commands
+import profiler
+import storage
+import templates
+from data import EventType, InvocationLog, Message, dictToCommandData
+from memory_db import MemoryDB
+
+templates.register_template_globals()
+
+
+@pytest.fixture
+def channel():
+    previous = storage._db
+    d = MemoryDB()
+    storage.set_db(d)
+    commands.commands_cache.clear()
+    channel_id, _ = d.twitch_channel_info(None, "alice")
+    d.add_tag(channel_id, "red")
+    text_id = d.add_text(channel_id, "apple")
+    d.set_text_tags(channel_id, text_id, {d.tag_by_value(channel_id)["red"]: None})
+    text = "{{ get('n', '', '0') }} {{ txt('red') }}"
+    cmd = dictToCommandData(
+        {"name": "c", "pattern": "!prefixc\\b", "actions": [{"kind": "message", "text": text}]}
+    )
+    d.set_command(d.cursor(), channel_id, "me", cmd)
+    yield channel_id
+    profiler.disable(channel_id)
+    profiler.reset(channel_id)
+    commands.commands_cache.clear()
+    storage.set_db(previous)
+
+
+def message(channel_id: int, text: str, is_mod=False, private=False) -> Message:
+    log = InvocationLog("test")
+    variables = {"author": "bob", "text": text, "media": "discord", "channel_id": channel_id}
+    variables.update(prefix="+", bot="bot", is_mod=is_mod, _log=log, _private=private, _id="1")
+    return Message(
+        id="1",
+        log=log,
+        channel_id=channel_id,
+        txt=text,
+        event=EventType.message,
+        prefix="+",
+        is_discord=True,
+        is_mod=is_mod,
+        private=private,
+        get_variables=lambda: variables,
+    )
+
+
+def run(msg: Message) -> list[str]:
+    return [a.text for a in asyncio.run(commands.process_message(msg))]
+
+
+def sections(channel_id: int) -> dict[tuple[str, str], profiler.Stats]:
+    return {(s.kind, s.name): s for s in profiler.stats(channel_id)}
+
+
+def test_off_by_default(channel):
+    assert run(message(channel, "+c")) == ["0 apple"]
+    assert profiler.stats(channel) == []
+
+
+def test_attributes_commands_templates_and_db(channel):
+    profiler.enable(channel)
+    run(message(channel, "+c"))
+    run(message(channel, "+c"))
+    run(message(channel, "chatter"))
+    got = sections(channel)
+    assert got[("command", "c")].calls == 2
+    assert got[("regex", "c")].calls == 3
+    assert got[("template", "txt")].calls == 2
+    assert got[("template", "get")].calls == 2
+    assert got[("db", "get_random_text_id")].calls == 2
+    s = got[("command", "c")]
+    assert s.wall_s >= s.max_wall_s > 0
+    assert s.wall_s >= got[("template", "txt")].wall_s
+
+
+def test_other_channels_and_expiry(channel):
+    profiler.enable(channel + 1)
+    run(message(channel, "+c"))
+    assert profiler.stats(channel) == []
+    profiler.enable(channel, duration_s=0)
+    run(message(channel, "+c"))
+    assert profiler.stats(channel) == []
+    assert profiler.remaining_s(channel) == 0
+    profiler.disable(channel + 1)
+
+
+def test_ring_buffer_is_bounded(channel, monkeypatch):
+    monkeypatch.setattr(profiler, "BUFFER_SIZE", 4)
+    profiler.reset(channel)
+    profiler.enable(channel)
+    for _ in range(3):
+        run(message(channel, "+c"))
+    assert sum(s.calls for s in profiler.stats(channel)) == 4
+
+
+def test_profile_command(channel):
+    mod = {"is_mod": True, "private": True}
+    assert run(message(channel, "+profile on 5", **mod)) == ["profiling on for 5 minutes"]
+    run(message(channel, "+c"))
+    (report,) = run(message(channel, "+profile", **mod))
+    assert report.startswith("profiling on for 5 more minutes")
+    assert "template txt" in " ".join(report.split())
+    # Not for non-mods or in public.
+    assert run(message(channel, "+profile off", is_mod=True)) == []
+    assert run(message(channel, "+profile off", **mod)) == ["profiling off"]
+    assert run(message(channel, "+profile reset", **mod)) == ["profile cleared"]
+    assert run(message(channel, "+profile", **mod)) == ["profiling off\n```\nno samples\n```"]
+
+
+@pytest.mark.parametrize("minutes", ["nan", "inf", "-5", "0", "x"])
+def test_profile_command_rejects_bad_minutes(channel, minutes):
+    mod = {"is_mod": True, "private": True}
+    (reply,) = run(message(channel, f"+profile on {minutes}", **mod))
+    assert reply.startswith('"+profile on [<minutes')
+    assert profiler.remaining_s(channel) == 0
+
+
+def test_profile_command_caps_minutes(channel):
+    mod = {"is_mod": True, "private": True}
+    assert run(message(channel, "+profile on 1e9", **mod)) == ["profiling on for 1440 minutes"]
+    assert profiler.remaining_s(channel) <= profiler.MAX_DURATION_S
+    profiler.disable(channel)
@@ -0,0 +1,58 @@
+"""Tests for rate_limit: token buckets and the per-channel send scheduler."""
+
+import asyncio
+
+import metrics
+import rate_limit
+from rate_limit import Rate, SendScheduler, TokenBucket
+
+
+def test_token_bucket_burst_then_wait():
+    b = TokenBucket(Rate(count=2, period_s=1.0, burst=3), now=0.0)
+    assert [b.reserve(now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Reservations queue up behind each other: 0.5s, then 1.0s.
+    assert b.reserve(now=0.0) == 0.5
+    assert b.reserve(now=0.0) == 1.0
+    # After the backlog drains, the bucket refills up to the burst size only.
+    assert b.reserve(now=100.0) == 0.0
+    assert b.tokens == 2.0
+
+
+def test_token_bucket_set_rate_caps_tokens():
+    b = TokenBucket(Rate(count=100, period_s=30.0, burst=20), now=0.0)
+    b.set_rate(Rate(count=20, period_s=30.0, burst=5), now=0.0)
+    assert b.tokens == 5.0
+
+
+def test_scheduler_quiet_channel_not_delayed_by_busy_one():
+    async def run():
+        slow = Rate(count=1, period_s=10.0, burst=1)
+        fast = Rate(count=1000, period_s=1.0, burst=1000)
+        s = SendScheduler(normal=slow, elevated=fast, global_rate=fast, name="test-quiet")
+        await s.acquire("busy")
+        busy = asyncio.create_task(s.acquire("busy"))
+        await asyncio.sleep(0)
+        assert s.waiting["busy"] == 1
+        waited = await asyncio.wait_for(s.acquire("quiet"), timeout=1.0)
+        assert waited < 0.1
+        # Elevated rate applies immediately to the busy channel's next message.
+        busy.cancel()
+        assert await asyncio.wait_for(s.acquire("other", elevated=True), timeout=1.0) < 0.1
+
+    asyncio.run(run())
+
+
+def test_scheduler_global_cap_and_metrics():
+    async def run():
+        fast = Rate(count=1000, period_s=1.0, burst=1000)
+        s = SendScheduler(
+            normal=fast, elevated=fast, global_rate=Rate(count=20, period_s=1.0, burst=1), name="g"
+        )
+        assert await s.acquire("a") < 0.01
+        # Different channel, but the global bucket is empty: ~1/20s wait.
+        assert await s.acquire("b") >= 0.04
+
+    asyncio.run(run())
+    hist = metrics.histogram("send_wait_seconds", "", buckets=metrics.WAIT_BUCKETS)
+    assert hist.count(client="g") == 2
+    assert rate_limit._queue_depth.value(client="g", channel="b") == 0
@@ -0,0 +1,152 @@
+"""Tests for the per-render budgets of the template sandbox."""
+
+import pytest
+
+import metrics
+import templates
+from commands import PersistentCommand
+from data import EventType, InvocationLog, Message, dictToCommandData, render
+from sandbox import BudgetedSandbox, BudgetExceeded, RenderBudget, touches_db
+
+templates.register_template_globals()
+
+
+def exceeded(text: str, budget: RenderBudget | None = None, **vars) -> str:
+    with pytest.raises(BudgetExceeded) as e:
+        render(text, {"_budget": budget or RenderBudget(), **vars})
+    return e.value.budget
+
+
+def test_ordinary_templates_fit():
+    assert render("{% for i in range(3) %}{{ i * 2 }}{% endfor %} {{ 'ab' * 2 }}", {}) == "024 abab"
+    assert render("{{ range(5) | length }} {{ range(4) | list | sum }} {{ 2 ** 10 }}", {}) == (
+        "5 6 1024"
+    )
+
+
+def test_loop_operations():
+    nested = "{% for i in range(100) %}{% for j in range(100000) %}{% endfor %}{% endfor %}"
+    assert exceeded(nested) == "operations"
+
+
+def test_output_size():
+    assert exceeded("{% for i in range(5000) %}0123456789{% endfor %}") == "output"
+    # Checked before the string is built.
+    assert exceeded("{{ 'x' * 1000000000 }}") == "output"
+    assert exceeded("{{ [1, 2] * 100000 }}") == "output"
+    assert exceeded("{{ 7 ** 100000000 }}") == "output"
+
+
+def test_every_loop_iteration_counts():
+    nested = "{% for a in s %}{% for b in s %}{% for c in s %}{% endfor %}{% endfor %}{% endfor %}"
+    assert exceeded(nested, s="x" * 600) == "operations"
+    assert exceeded("{% for a in s %}{% endfor %}", RenderBudget(operations=99), s=[0] * 100) == (
+        "operations"
+    )
+    recursive = (
+        "{% for x in tree recursive %}{% if x is iterable %}{{ loop(x) }}{% endif %}{% endfor %}"
+    )
+    assert exceeded(recursive, RenderBudget(operations=50), tree=[[[0] * 100]]) == "operations"
+    # Loop features still work on the counted iterables.
+    text = "{% for x in s if x > 1 %}{{ loop.index }}/{{ loop.length }} {% else %}-{% endfor %}"
+    assert render(text, {"s": [1, 2, 3]}) == "1/2 2/2"
+    assert render(text, {"s": []}) == "-"
+
+
+def test_loop_deadline():
+    assert exceeded("{% for a in s %}{% endfor %}", RenderBudget(time_s=0), s="xy") == "time"
+
+
+def test_filter_and_format_output_size():
+    assert exceeded("{{ ('x' | center(200000000)) | length }}") == "output"
+    assert exceeded("{{ 'x' | indent(200000000, true) }}") == "output"
+    assert exceeded("{{ ('x' * 5000) | wordwrap(1, wrapstring='y' * 5000) | length }}") == "output"
+    assert exceeded("{{ '%200000000s' | format(1) }}") == "output"
+    assert exceeded("{{ '%.*f' | format(200000000, 1) }}") == "output"
+    assert exceeded("{{ '{:>200000000}'.format(1) }}") == "output"
+    assert exceeded("{{ '{:{w}}'.format(1, w=200000000) }}") == "output"
+    assert exceeded("{{ 'x'.ljust(200000000) }}") == "output"
+    text = (
+        "{{ 'a' | center(5) }}|{{ '%.1f' | format(1.25) }}|"
+        "{{ '{:>3}'.format(7) }}|{{ 'a\nb' | indent(2) }}"
+    )
+    assert render(text, {}) == "a  |1.2|  7|a\n  b"
+
+
+@pytest.mark.parametrize(
+    "grow",
+    [
+        "ns.s + ns.s",
+        "ns.s ~ ns.s",
+        "[ns.s, ns.s] | join",
+        "ns.s | replace('a', 'aa')",
+        "ns.s.replace('a', ns.s)",
+        "ns.s.join([ns.s, ns.s])",
+    ],
+)
+def test_doubling_in_a_loop(grow):
+    text = (
+        '{% set ns = namespace(s="ab") %}'
+        f"{{% for i in range(40) %}}{{% set ns.s = {grow} %}}{{% endfor %}}"
+    )
+    assert exceeded(text) == "output"
+
+
+def test_concatenation_within_budget():
+    text = "{{ 1 + 2 }} {{ 'a' ~ 1 ~ 'b' }} {{ [1] + [2] }} {{ [1, 2] | join('-') }}"
+    assert render(text, {}) == "3 a1b [1, 2] 1-2"
+
+
+def test_time():
+    assert exceeded("{{ randint() }}", RenderBudget(time_s=0)) == "time"
+
+
+def test_db_calls():
+    env = BudgetedSandbox()
+    env.globals["lookup"] = touches_db(lambda: "v")
+    env.globals["pure"] = lambda: "p"
+    budget = RenderBudget(db_calls=2)
+    t = env.from_string("{{ pure() }}{{ pure() }}{{ pure() }}{{ lookup() }}{{ lookup() }}")
+    assert t.render(_budget=budget) == "pppvv"
+    with pytest.raises(BudgetExceeded):
+        t.render(_budget=budget)
+
+
+def test_budget_is_shared_with_nested_renders():
+    budget = RenderBudget(operations=50)
+    render("{% for i in range(30) %}{% endfor %}", {"_budget": budget})
+    with pytest.raises(BudgetExceeded):
+        render("{% for i in range(30) %}{% endfor %}", {"_budget": budget})
+
+
+def test_persistent_command_aborts_cleanly():
+    text = "{% for i in range(1000) %}{% for j in range(1000) %}{% endfor %}{% endfor %}done"
+    cmd = PersistentCommand(
+        dictToCommandData(
+            {
+                "name": "loop",
+                "pattern": "!prefixloop",
+                "actions": [{"kind": "message", "text": text}],
+            }
+        ),
+        "+",
+    )
+    log = InvocationLog("test")
+    variables = {"is_mod": False, "_log": log, "channel_id": 1}
+    msg = Message(
+        id="1",
+        log=log,
+        channel_id=1,
+        txt="+loop",
+        event=EventType.message,
+        prefix="+",
+        is_discord=True,
+        is_mod=False,
+        private=False,
+        get_variables=lambda: variables,
+    )
+    counter = metrics.counter("template_budget_exceeded_total", "")
+    before = counter.value(budget="operations")
+    assert cmd.run(msg) == ([], True)
+    assert counter.value(budget="operations") == before + 1
+    assert any("aborted rendering 'loop': operations budget" in m for _, m in log.messages)
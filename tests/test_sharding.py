@@ -0,0 +1,45 @@
+"""Tests for sharding.Shard: every channel has exactly one owner."""
+
+import subprocess
+import sys
+
+import pytest
+
+from sharding import Shard
+
+
+def test_partition_covers_everything_once():
+    for count in (1, 2, 3, 8):
+        shards = [Shard(i, count) for i in range(count)]
+        for channel_id in range(1, 200):
+            assert sum(s.owns_channel(channel_id) for s in shards) == 1
+        for guild_id in ("81384788765712384", "41771983423143937", str(1 << 22)):
+            assert sum(s.owns_channel(1, guild_id) for s in shards) == 1
+
+
+def test_dual_platform_channel_goes_with_its_guild():
+    # https://discord.com/developers/docs/topics/gateway#sharding-sharding-formula
+    guild_id = 197038439483310086
+    discord_shard = (guild_id >> 22) % 5
+    for channel_id in range(1, 20):
+        owners = [i for i in range(5) if Shard(i, 5).owns_channel(channel_id, str(guild_id))]
+        assert owners == [discord_shard]
+
+
+def test_primary_and_ports():
+    assert Shard().primary and Shard().port(4343) == 4343
+    assert not Shard(2, 3).primary and Shard(2, 3).port(4343) == 4345
+    assert str(Shard(2, 3)) == "shard 2/3"
+
+
+@pytest.mark.parametrize("id,count", [(1, 1), (-1, 2), (0, 0)])
+def test_bad_shard(id, count):
+    with pytest.raises(ValueError):
+        Shard(id, count)
+
+
+def test_twitch_shards_require_a_conduit():
+    args = [sys.executable, "main.py", "--twitch", "bot", "--shard_id", "1", "--shard_count", "2"]
+    result = subprocess.run(args, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 2
+    assert "--twitch_conduit_id is required" in result.stderr
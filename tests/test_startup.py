@@ -0,0 +1,49 @@
+"""Tests for the startup timing report."""
+
+import builtins
+import logging
+import sys
+
+import startup
+
+
+def test_phase_accumulates():
+    with startup.phase("test phase"):
+        pass
+    first = startup.timings()["test phase"]
+    with startup.phase("test phase"):
+        pass
+    assert startup.timings()["test phase"] >= first
+    assert startup._seconds.value(phase="test phase") == startup.timings()["test phase"]
+
+
+def test_imports_charged_to_top_level_package(tmp_path, monkeypatch):
+    pkg = tmp_path / "startup_pkg"
+    pkg.mkdir()
+    (pkg / "__init__.py").write_text("import startup_dep\n")
+    (tmp_path / "startup_dep.py").write_text("X = 1\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    startup.time_imports()
+    try:
+        import startup_pkg
+    finally:
+        startup.imports_done()
+    assert startup_pkg.startup_dep.X == 1
+    t = startup.timings()
+    assert "import startup_pkg" in t
+    # Nested imports count towards the package that pulled them in.
+    assert "import startup_dep" not in t
+    assert "imports (total)" in t
+    assert builtins.__import__ is startup._original_import
+    sys.modules.pop("startup_pkg", None)
+    sys.modules.pop("startup_dep", None)
+
+
+def test_report_lists_slowest_first(caplog):
+    with startup.phase("slow"):
+        sum(range(200_000))
+    with caplog.at_level(logging.INFO):
+        startup.report()
+    text = caplog.records[-1].getMessage()
+    assert text.startswith("startup took")
+    assert "slow" in text
@@ -84,8 +84,8 @@ class MockDB:
     def tag_by_value(self, channel_id):
         return {"рд": 1, "дт": 2}
 
-    def get_text_tag_value(self, channel_id, text_id, tag_id):
-        return self.text_tags.get(text_id, {}).get(tag_id, "")
+    def get_text_form(self, channel_id, text_id, inf):
+        return self.text_tags.get(text_id, {}).get(self.tag_by_value(channel_id)[inf], "")
 
     def get_text(self, channel_id, text_id):
         return self.texts.get(text_id, "")
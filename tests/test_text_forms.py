@@ -0,0 +1,157 @@
+"""Tests for the per-text inflected forms table in the channel cache."""
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import storage
+import words
+from storage import DB
+
+
+class FakeCursor:
+    """Answers the handful of queries the channel cache and forms lookups issue."""
+
+    def __init__(self, data: "FakeData"):
+        self.data = data
+        self.rows: list[tuple] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql: str, args=()):
+        self.data.queries.append(sql)
+        d = self.data
+        if sql == "SELECT 1":
+            self.rows = [(1,)]
+        elif sql.startswith("SELECT id, value FROM tags"):
+            self.rows = list(d.tags.items())
+        elif sql.startswith("SELECT id FROM texts"):
+            self.rows = [(i,) for i in d.texts]
+        elif sql.startswith("SELECT tt.text_id, tt.tag_id, tt.value"):
+            self.rows = [(t, g, v) for t, tv in d.text_tags.items() for g, v in tv.items()]
+        elif sql.startswith("SELECT value FROM texts"):
+            self.rows = [(d.texts[args[1]],)] if args[1] in d.texts else []
+        elif sql.startswith("SELECT tt.tag_id, tt.value"):
+            self.rows = list(d.text_tags.get(args[1], {}).items())
+        elif sql.startswith("SELECT tt.value"):
+            value = d.text_tags.get(args[1], {}).get(args[2])
+            self.rows = [(value,)] if args[2] in d.text_tags.get(args[1], {}) else []
+        elif sql.startswith("UPDATE texts"):
+            d.texts[args[2]] = args[0]
+            self.rows = []
+        elif sql.startswith("DELETE FROM text_tags"):
+            d.text_tags[args[0]] = {}
+            self.rows = []
+        elif sql.startswith("INSERT INTO text_tags"):
+            d.text_tags.setdefault(args[0], {})[args[1]] = args[2]
+            self.rows = []
+        else:
+            raise AssertionError(f"unexpected query {sql}")
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeData:
+    def __init__(self):
+        self.tags = {1: "рд", 2: "тв,мн", 3: "morph", 4: "fruit", 5: "_NOUN"}
+        self.texts = {10: "яблоко", 11: "кошка", 12: "груша"}
+        self.text_tags: dict[int, dict[int, str | None]] = {
+            10: {1: "яблока", 2: "яблоками", 4: None},
+            11: {3: None, 5: None},
+            12: {1: None, 4: "сорт"},
+        }
+        self.queries: list[str] = []
+
+
+@pytest.fixture
+def fake_db():
+    data = FakeData()
+    conn = MagicMock()
+    conn.closed = 0
+    conn.cursor.side_effect = lambda: FakeCursor(data)
+    with patch("storage.psycopg2.connect", return_value=conn):
+        d = DB("postgresql://fake/db")
+    return d, data
+
+
+def lookups():
+    return {r: storage._text_form_lookups.value(result=r) for r in ("table", "inflected", "db")}
+
+
+def test_forms_table_loaded_with_texts(fake_db):
+    d, _ = fake_db
+    ch = d.channel(1)
+    forms = ch.all_text_by_id[10].forms
+    assert forms is not None
+    assert len(forms) == len(words.case_tags)
+    assert forms[words.case_id["рд"]] == "яблока"
+    assert forms[words.case_id["тв,мн"]] == "яблоками"
+    assert forms[words.case_id["дт"]] is None
+    # No case tag values: no table.
+    assert ch.all_text_by_id[11].forms is None
+    assert ch.all_text_by_id[12].forms is None
+
+
+def test_stored_form_does_not_query(fake_db):
+    d, data = fake_db
+    d.channel(1)
+    data.queries.clear()
+    assert d.get_text_form(1, 10, "рд") == "яблока"
+    assert d.get_text_form(1, 10, "тв,мн") == "яблоками"
+    assert [q for q in data.queries if q != "SELECT 1"] == []
+
+
+def test_legacy_text_inflected_once(fake_db):
+    d, data = fake_db
+    d.channel(1)
+    data.queries.clear()
+    with patch("storage.words.inflect_word", wraps=words.inflect_word) as inflect:
+        assert d.get_text_form(1, 11, "рд") == "кошки"
+        assert d.get_text_form(1, 11, "рд") == "кошки"
+    inflect.assert_called_once_with("кошка", "рд", ["NOUN"])
+    assert sum(q.startswith("SELECT value FROM texts") for q in data.queries) == 1
+    assert d.channel(1).all_text_by_id[11].forms[words.case_id["рд"]] == "кошки"
+
+
+def test_non_case_inflection_reads_tag_value(fake_db):
+    d, _ = fake_db
+    assert d.get_text_form(1, 12, "fruit") == "сорт"
+    assert d.get_text_form(1, 12, "unknown") is None
+
+
+def test_set_text_tags_refreshes_forms(fake_db):
+    d, _ = fake_db
+    d.channel(1)
+    d.set_text_tags(1, 12, {1: "груши", 4: None})
+    assert d.get_text_form(1, 12, "рд") == "груши"
+    d.set_text_tags(1, 10, {4: None})
+    assert d.channel(1).all_text_by_id[10].forms is None
+
+
+def test_set_text_drops_inflected_forms(fake_db):
+    d, _ = fake_db
+    d.channel(1)
+    assert d.get_text_form(1, 11, "рд") == "кошки"
+    d.set_text(1, "собака", 11)
+    assert d.get_text_form(1, 11, "рд") == "собаки"
+    # Stored values survive a text edit.
+    d.set_text(1, "яблочко", 10)
+    assert d.get_text_form(1, 10, "рд") == "яблока"
+
+
+def test_lookup_metrics(fake_db):
+    d, _ = fake_db
+    before = lookups()
+    d.get_text_form(1, 10, "рд")
+    d.get_text_form(1, 12, "fruit")
+    after = lookups()
+    assert after["table"] - before["table"] == 1
+    assert after["db"] - before["db"] == 1
@@ -4,6 +4,7 @@ These tests do NOT need a live Twitch connection or DB.
 They import TwitchClient pieces by monkey-patching dependencies.
 """
 
+import asyncio
 import sys
 import time
 import types
@@ -11,6 +12,7 @@ from unittest.mock import MagicMock
 
 import ttldict2
 
+from active_users import ActiveUsers
 from data import EventType, InvocationLog, Message
 
 
@@ -99,7 +101,7 @@ def make_channel_info(throttle_seconds: float = 1.0):
     from twitch_client import ChannelInfo
 
     return ChannelInfo(
-        active_users=ttldict2.TTLDict(ttl_seconds=3600.0),
+        active_users=ActiveUsers(ttl_s=3600.0),
         prefix="!",
         channel_id=42,
         twitch_user_id="99999",
@@ -191,8 +193,8 @@ class TestMentionHelpers:
 
         bot = object.__new__(TwitchClient)
         info = make_channel_info()
-        info.active_users["alice"] = 1
-        info.active_users["bob"] = 1
+        info.active_users.touch("alice")
+        info.active_users.touch("bob")
         result = bot.random_mention(info, "alice")
         assert result == "@bob"
 
@@ -210,7 +212,7 @@ class TestMentionHelpers:
 
         bot = object.__new__(TwitchClient)
         info = make_channel_info()
-        info.active_users["carol"] = 1
+        info.active_users.touch("carol")
         result = bot.any_mention("@dave hello", info, "author")
         assert result == "@dave"
 
@@ -219,7 +221,7 @@ class TestMentionHelpers:
 
         bot = object.__new__(TwitchClient)
         info = make_channel_info()
-        info.active_users["eve"] = 1
+        info.active_users.touch("eve")
         result = bot.any_mention("no mention here", info, "author")
         assert result == "@eve"
 
@@ -239,6 +241,46 @@ class TestUserThrottling:
         info = make_channel_info(throttle_seconds=60.0)
         assert "newuser" not in info.throttled_users
 
+    def test_user_marked_when_message_is_admitted(self, monkeypatch):
+        import inbox
+        import twitch_client
+        from data import Action, ActionKind
+        from twitch_client import TwitchClient
+
+        processed = []
+
+        async def process_message(msg):
+            processed.append(msg.txt)
+            return [Action(ActionKind.REPLY, "hi")] if msg.txt.startswith("!") else []
+
+        monkeypatch.setattr(twitch_client.commands, "process_message", process_message)
+        monkeypatch.setattr(twitch_client, "db", MagicMock())
+        bot = object.__new__(TwitchClient)
+        bot.bot_user_id = "1"
+        bot.inbox = inbox.Inbox("test")
+        bot.queue_message = MagicMock()
+        info = make_channel_info(throttle_seconds=60.0)
+        bot.channels = {"chan": info}
+
+        def payload(user, text):
+            p = MagicMock(text=text, badges=[])
+            p.chatter.id, p.chatter.name = "2", user
+            p.broadcaster.name = "chan"
+            return p
+
+        async def run():
+            # Both arrive before the first is processed; only the first is admitted.
+            await bot.event_message(payload("spamuser", "!a"))
+            await bot.event_message(payload("spamuser", "!b"))
+            await bot.event_message(payload("chatter", "just chatting"))
+            await bot.inbox.drain()
+            bot.inbox.close()
+
+        asyncio.run(run())
+        assert processed == ["!a", "just chatting"]
+        assert "spamuser" in info.throttled_users
+        assert "chatter" not in info.throttled_users  # no reply, no throttle
+
 
 # ---------------------------------------------------------------------------
 # Cron filtering (last_activity check)
@@ -4,6 +4,7 @@ import asyncio
 import time
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import rate_limit
 from twitch_client import _MSG_DEDUP_SECS, ChannelInfo, TwitchClient
 
 
@@ -23,9 +24,9 @@ def _make_info(**kwargs) -> ChannelInfo:
 
 def _make_client() -> TwitchClient:
     client = MagicMock(spec=TwitchClient)
-    client.throttler = MagicMock()
-    client.throttler.__aenter__ = AsyncMock(return_value=None)
-    client.throttler.__aexit__ = AsyncMock(return_value=False)
+    rate = rate_limit.Rate(count=100, period_s=1.0, burst=100)
+    client.send_scheduler = rate_limit.SendScheduler(rate, rate, rate, name="test")
+    client.bot_user_id = "999"
     client.user = MagicMock()
     client.send_message = TwitchClient.send_message.__get__(client, TwitchClient)
     return client
@@ -166,3 +167,38 @@ def test_send_message_logs_error_if_retry_also_fails():
 
     assert broadcaster.send_message.await_count == 2
     assert info.last_sent_text == ""
+
+
+# ---------------------------------------------------------------------------
+# Rate tier
+# ---------------------------------------------------------------------------
+
+
+def test_send_message_uses_elevated_rate_when_bot_is_moderator():
+    client = _make_client()
+    info = _make_info(bot_elevated=True)
+    client.send_scheduler.acquire = AsyncMock(return_value=0.0)
+    with patch.object(client, "create_partialuser", return_value=_make_broadcaster()):
+        asyncio.run(client.send_message(info, "hello"))
+    client.send_scheduler.acquire.assert_awaited_once_with("1", True)
+
+
+def test_update_bot_badges():
+    client = _make_client()
+    info = _make_info()
+    client.channels = {"chan": info}
+    client.update_bot_badges = TwitchClient.update_bot_badges.__get__(client, TwitchClient)
+    payload = MagicMock()
+    payload.broadcaster.name = "Chan"
+    payload.badges = [MagicMock(set_id="vip", id="1")]
+    client.update_bot_badges(payload)
+    assert info.bot_elevated
+    payload.badges = [MagicMock(set_id="subscriber", id="moderator")]
+    client.update_bot_badges(payload)
+    assert not info.bot_elevated
+    payload.badges = [MagicMock(set_id="moderator", id="1")]
+    client.update_bot_badges(payload)
+    assert info.bot_elevated
+    payload.badges = []
+    client.update_bot_badges(payload)
+    assert not info.bot_elevated
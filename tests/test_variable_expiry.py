@@ -0,0 +1,53 @@
+"""Tests for batched DB.expire_variables()."""
+
+from unittest.mock import MagicMock, patch
+
+import metrics
+from storage import DB
+
+
+def make_db(rowcounts: list[int]) -> tuple[DB, MagicMock]:
+    conn = MagicMock()
+    conn.closed = 0
+    cur = MagicMock()
+    cur.__enter__.return_value = cur
+    counts = iter(rowcounts)
+
+    def execute(sql, params=None):
+        if sql.strip().startswith("DELETE"):
+            cur.rowcount = next(counts)
+
+    cur.execute.side_effect = execute
+    conn.cursor.return_value = cur
+    with patch("storage.psycopg2.connect", return_value=conn):
+        db = DB("postgresql://fake/db")
+    return db, cur
+
+
+def delete_calls(cur: MagicMock) -> list:
+    return [c for c in cur.execute.call_args_list if c.args[0].strip().startswith("DELETE")]
+
+
+def test_expire_stops_on_short_batch():
+    db, cur = make_db([10, 10, 3])
+    assert db.expire_variables(batch_size=10, max_batches=100) == 23
+    calls = delete_calls(cur)
+    assert len(calls) == 3
+    assert calls[0].args[1][1] == 10  # LIMIT
+
+
+def test_expire_respects_max_batches():
+    db, cur = make_db([10] * 20)
+    assert db.expire_variables(batch_size=10, max_batches=4) == 40
+    assert len(delete_calls(cur)) == 4
+
+
+def test_expire_updates_metrics():
+    counter = metrics.counter("variables_expired_total", "")
+    hist = metrics.histogram("variables_expiry_pass_seconds", "")
+    before_rows = counter.value()
+    before_passes = hist.count()
+    db, _ = make_db([7])
+    db.expire_variables(batch_size=10)
+    assert counter.value() - before_rows == 7
+    assert hist.count() - before_passes == 1
@@ -0,0 +1,29 @@
+"""Tests for the word list batch tool."""
+
+import io
+
+import word_processing
+
+INPUT = "кот\tanimal\nзвезда\tsky\nкот\tpet\nбыстро\tx\n"
+
+
+def test_rows_in_input_order():
+    out = io.StringIO()
+    n_lines, n_words = word_processing.process(io.StringIO(INPUT), out, workers=1, chunk_size=2)
+    assert (n_lines, n_words) == (4, 3)
+    first = out.getvalue().split("\n")[0].split("\t")
+    assert first[0] == "кот"
+    assert first[1] == "animal _NOUN _anim _masc _sing morph"
+    assert first[2] == "animal"
+    assert first[4].startswith('"кот,кота,коту,кота,котом,коте,коты,котов')
+    # Repeated words reuse the analysis, with their own manual tags.
+    assert "\nкот\tpet _NOUN" in out.getvalue()
+    # No nominative parse: empty suggestion columns.
+    assert out.getvalue().endswith("быстро\tx\t\t\t\n")
+
+
+def test_process_pool_matches_single_process():
+    single, pooled = io.StringIO(), io.StringIO()
+    word_processing.process(io.StringIO(INPUT * 5), single, workers=1, chunk_size=3)
+    word_processing.process(io.StringIO(INPUT * 5), pooled, workers=2, chunk_size=3)
+    assert pooled.getvalue() == single.getvalue()
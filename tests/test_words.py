@@ -0,0 +1,51 @@
+"""Tests for words: inflection results and memoization."""
+
+import dawg_python.wrapper
+
+import words
+from commands import morph_text
+
+
+def test_inflect_word():
+    assert words.inflect_word("кот", "рд") == "кота"
+    assert words.inflect_word("кот", "тв,мн") == "котами"
+    assert words.inflect_word("стекло", "рд", ["NOUN"]) == "стекла"
+
+
+def test_inflect_word_is_memoized():
+    words.inflect_word("собака", "дт", ["NOUN"])
+    before = words.cache_info()
+    for _ in range(3):
+        assert words.inflect_word("собака", "дт", ["NOUN"]) == "собаке"
+    after = words.cache_info()
+    assert after["inflect"].hits == before["inflect"].hits + 3
+    assert after["parse"].misses == before["parse"].misses
+
+
+def test_morph_text_returns_independent_copies():
+    first = morph_text("рыжий кот")
+    first["рд"] = "changed"
+    assert morph_text(" рыжий кот ")["рд"] == "рыжего кота"
+
+
+def test_prewarm_loads_shared_analyzer():
+    words.prewarm().join(timeout=30)
+    assert words._morph is not None
+    assert words.get_morph() is words._morph
+    # Dictionaries are mapped from the files rather than copied into arrays.
+    assert isinstance(words._morph.dictionary.words.dct._units, memoryview)
+    assert words.inflect_word("кролик", "тв") == "кроликом"
+
+
+def test_mapped_dawgs_only_while_loading():
+    read = dawg_python.wrapper.Dictionary.read
+    with words._mapped_dawgs():
+        assert dawg_python.wrapper.Dictionary.read is not read
+    assert dawg_python.wrapper.Dictionary.read is read
+
+
+def test_unknown_dawg_version_is_not_patched(monkeypatch):
+    monkeypatch.setattr(words, "_MAPPED_DAWG_VERSIONS", ("0.0.",))
+    read = dawg_python.wrapper.Dictionary.read
+    with words._mapped_dawgs():
+        assert dawg_python.wrapper.Dictionary.read is read
@@ -17,27 +17,43 @@ limitations under the License.
 import asyncio
 import dataclasses
 import logging
-import random
 import re
 import time
 import traceback
 
 import ttldict2
 import twitchio
-from asyncio_throttle import Throttler
 from twitchio import eventsub
 from twitchio.web import AiohttpAdapter
 
 import commands
+import executors
+import inbox
+import metrics
+import metrics_http
+import rate_limit
+import sharding
+from active_users import ActiveUsers
 from data import ActionKind, EventType, InvocationLog, Lazy, Message
+from outbox import Outbox, Priority
 from storage import cursor, db
 
 _MSG_DEDUP_SECS = 30.0
+# Twitch chat limits: 20 messages per 30s per channel, 100 when the bot is a moderator,
+# VIP or the broadcaster, plus an account-wide cap across all channels.
+_SEND_RATE = rate_limit.Rate(count=20, period_s=30.0, burst=5)
+_ELEVATED_SEND_RATE = rate_limit.Rate(count=100, period_s=30.0, burst=20)
+_GLOBAL_SEND_RATE = rate_limit.Rate(count=100, period_s=30.0, burst=20)
+_ELEVATED_BADGES = {"moderator", "vip", "broadcaster"}
+
+_throttled = metrics.counter(
+    "twitch_throttled_messages_total", "Chat messages ignored while their author is throttled"
+)
 
 
 @dataclasses.dataclass
 class ChannelInfo:
-    active_users: ttldict2.TTLDict
+    active_users: ActiveUsers
     throttled_users: ttldict2.TTLDict  # user -> time
     prefix: str
     channel_id: int
@@ -46,6 +62,7 @@ class ChannelInfo:
     last_activity: float
     last_sent_text: str = ""
     last_sent_at: float = 0.0
+    bot_elevated: bool = False  # bot is a moderator/VIP/broadcaster here
 
 
 def is_moderator(payload: twitchio.ChatMessage) -> bool:
@@ -64,9 +81,17 @@ class TwitchClient(twitchio.AutoClient):
     Stores auth tokens in database and executes custom commands defined in the database.
     """
 
-    def __init__(self, twitch_bot: str, dev_message: str | None = None, domain: str | None = None):
+    def __init__(
+        self,
+        twitch_bot: str,
+        dev_message: str | None = None,
+        domain: str | None = None,
+        shard: sharding.Shard | None = None,
+        conduit_id: str | None = None,
+    ):
         self.dev_message = dev_message
-        logging.info(f"creating twitch bot {twitch_bot}")
+        self.shard = shard = shard or sharding.Shard()
+        logging.info(f"creating twitch bot {twitch_bot} ({shard})")
 
         with cursor() as cur:
             cur.execute(
@@ -91,7 +116,7 @@ class TwitchClient(twitchio.AutoClient):
         with cursor() as cur:
             cur.execute(
                 "SELECT channel_id, twitch_channel_name, twitch_command_prefix, "
-                "twitch_events, twitch_throttle "
+                "twitch_events, twitch_throttle, discord_guild_id "
                 "FROM channels WHERE twitch_bot = %s",
                 (self.channel_name,),
             )
@@ -102,7 +127,10 @@ class TwitchClient(twitchio.AutoClient):
                     twitch_command_prefix,
                     twitch_events,
                     twitch_throttle,
+                    discord_guild_id,
                 ) = row
+                if not shard.owns_channel(channel_id, discord_guild_id):
+                    continue
                 if not twitch_throttle:
                     twitch_throttle = 0.0
                 events: list[EventType] = []
@@ -110,7 +138,7 @@ class TwitchClient(twitchio.AutoClient):
                     for x in twitch_events.split(","):
                         events.append(EventType[x.strip()])
                 self.channels[twitch_channel_name] = ChannelInfo(
-                    active_users=ttldict2.TTLDict(ttl_seconds=3600.0),
+                    active_users=ActiveUsers(ttl_s=3600.0),
                     prefix=twitch_command_prefix,
                     channel_id=channel_id,
                     twitch_user_id="",
@@ -120,20 +148,31 @@ class TwitchClient(twitchio.AutoClient):
                 )
 
         logging.info(f"channels: {list(self.channels.keys())}")
-        self.throttler = Throttler(rate_limit=1, period=1)
+        self.send_scheduler = rate_limit.SendScheduler(
+            normal=_SEND_RATE,
+            elevated=_ELEVATED_SEND_RATE,
+            global_rate=_GLOBAL_SEND_RATE,
+            name="twitch",
+        )
+        self.outboxes: dict[int, Outbox] = {}
+        self.inbox = inbox.Inbox("twitch")
 
         adapter = AiohttpAdapter(
             host="0.0.0.0",
-            port=4343,
+            port=shard.port(4343),
             domain=domain,
         )
+        metrics_http.add_route(adapter)
 
+        # Shards must not take over each other's conduit.
+        options = {"conduit_id": conduit_id} if conduit_id else {}
         # twitchio 3.x: Client(client_id, client_secret, bot_id=...)
         super().__init__(
             client_id=self.app_id,
             client_secret=self.app_secret,
             bot_id=self.bot_user_id,
             adapter=adapter,
+            **options,
         )
 
     # ------------------------------------------------------------------
@@ -143,14 +182,14 @@ class TwitchClient(twitchio.AutoClient):
     async def add_token(self, token: str, refresh: str):
         resp = await super().add_token(token, refresh)
         if resp.user_id:
-            await asyncio.to_thread(db().save_twitch_token, resp.user_id, token, refresh)
+            await executors.DB.run(db().save_twitch_token, resp.user_id, token, refresh)
             logging.info(f"[auth] Added token to the database for user: {resp.user_id}")
         else:
             logging.warning("no user_id in response")
         return resp
 
     async def load_tokens(self, path: str | None = None) -> None:
-        tokens = await asyncio.to_thread(db().load_twitch_tokens)
+        tokens = await executors.DB.run(db().load_twitch_tokens)
         logging.info(f"loaded {len(tokens)} auth tokens")
         for token, refresh in tokens:
             try:
@@ -276,6 +315,7 @@ class TwitchClient(twitchio.AutoClient):
             # Ignore the bot's own messages
             chatter_id = str(payload.chatter.id)
             if chatter_id == str(self.bot_user_id):
+                self.update_bot_badges(payload)
                 return
 
             if not payload.broadcaster.name:
@@ -298,13 +338,13 @@ class TwitchClient(twitchio.AutoClient):
             author: str = author_raw
             text: str = payload.text
 
-            info.active_users[author] = 1
+            info.active_users.touch(author)
             info.throttled_users.drop_old_items()
             if author in info.throttled_users:
+                _throttled.inc()
                 return
-            info.active_users.drop_old_items()
 
-            log.debug(f'{author} "{text}"')
+            log.debug('%s "%s"', author, text)
 
             is_mod: bool = is_moderator(payload)
             message_id: str = str(time.time_ns())
@@ -347,12 +387,25 @@ class TwitchClient(twitchio.AutoClient):
                 get_variables=get_vars,
             )
 
-            actions = await commands.process_message(msg)
-            await asyncio.to_thread(db().add_log, channel_id, log)
-            for a in actions:
-                if a.kind == ActionKind.NEW_MESSAGE or a.kind == ActionKind.REPLY:
-                    await self.send_message(info, a.text)
-            if actions and not is_mod:
+            async def process():
+                actions = []
+                try:
+                    actions = await commands.process_message(msg)
+                    await executors.DB.run(db().add_log, channel_id, log)
+                    for a in actions:
+                        if a.kind == ActionKind.NEW_MESSAGE or a.kind == ActionKind.REPLY:
+                            self.queue_message(info, a.text, Priority.REPLY)
+                finally:
+                    if not is_mod:
+                        if actions:  # restart the throttle from the reply
+                            info.throttled_users[author] = "+"
+                        else:
+                            info.throttled_users.pop(author, None)
+
+            kind = inbox.Kind.COMMAND if text.startswith(prefix) else inbox.Kind.CHATTER
+            # Marked on admission, so that the user's next messages are dropped while this
+            # one is queued; released if it gets no reply.
+            if self.inbox.submit(channel_id, process, kind) and not is_mod:
                 info.throttled_users[author] = "+"
 
         except Exception as e:
@@ -375,7 +428,7 @@ class TwitchClient(twitchio.AutoClient):
             reward_title: str = payload.reward.title
             channel_id = info.channel_id
             log = InvocationLog(f"twitch channel {channel_name} ({channel_id})")
-            log.info(f'reward "{reward_title}" for user {author}')
+            log.info('reward "%s" for user %s', reward_title, author)
 
             is_mod = False
             message_id = str(time.time_ns())
@@ -418,11 +471,14 @@ class TwitchClient(twitchio.AutoClient):
                 get_variables=get_vars,
             )
 
-            actions = await commands.process_message(msg)
-            await asyncio.to_thread(db().add_log, channel_id, log)
-            for a in actions:
-                if a.kind == ActionKind.NEW_MESSAGE or a.kind == ActionKind.REPLY:
-                    await self.send_message(info, a.text)
+            async def process():
+                actions = await commands.process_message(msg)
+                await executors.DB.run(db().add_log, channel_id, log)
+                for a in actions:
+                    if a.kind == ActionKind.NEW_MESSAGE or a.kind == ActionKind.REPLY:
+                        self.queue_message(info, a.text, Priority.EVENT)
+
+            self.inbox.submit(channel_id, process, inbox.Kind.EVENT)
 
         except Exception as e:
             logging.error(f"[redemption] {e}\n{traceback.format_exc()}")
@@ -482,15 +538,43 @@ class TwitchClient(twitchio.AutoClient):
                 get_variables=get_vars,
             )
 
-            actions = await commands.process_message(msg)
-            await asyncio.to_thread(db().add_log, channel_id, log)
-            for a in actions:
-                if a.kind == ActionKind.NEW_MESSAGE or a.kind == ActionKind.REPLY:
-                    await self.send_message(info, a.text)
+            async def process():
+                actions = await commands.process_message(msg)
+                await executors.DB.run(db().add_log, channel_id, log)
+                for a in actions:
+                    if a.kind == ActionKind.NEW_MESSAGE or a.kind == ActionKind.REPLY:
+                        self.queue_message(info, a.text, Priority.EVENT)
+
+            self.inbox.submit(channel_id, process, inbox.Kind.EVENT)
 
         except Exception as e:
             logging.error(f"[hype_train_end] {e}\n{traceback.format_exc()}")
 
+    def update_bot_badges(self, payload: twitchio.ChatMessage) -> None:
+        """Learns the bot's send rate tier in a channel from the badges on its own messages."""
+        if not payload.broadcaster.name:
+            return
+        info = self.channels.get(payload.broadcaster.name.lower())
+        if not info:
+            return
+        # `set_id` is the badge type ("vip"); `id` is its version ("1").
+        badge_types = {b.set_id for b in payload.badges or []}
+        info.bot_elevated = bool(badge_types & _ELEVATED_BADGES)
+
+    def queue_message(self, info: ChannelInfo, txt: str, priority: Priority) -> None:
+        """Queues `txt` for background delivery to the channel; returns immediately."""
+        box = self.outboxes.get(info.channel_id)
+        if box is None:
+            box = Outbox(lambda t: self.send_message(info, t), name=f"twitch {info.channel_id}")
+            self.outboxes[info.channel_id] = box
+        box.put(txt, priority)
+
+    async def close(self, **options) -> None:
+        self.inbox.close()
+        for box in self.outboxes.values():
+            box.close()
+        await super().close(**options)
+
     async def send_message(self, info: ChannelInfo, txt: str) -> None:
         if not info.twitch_user_id:
             logging.warning(f"send_message: no broadcaster user ID for channel {info.channel_id}")
@@ -504,31 +588,32 @@ class TwitchClient(twitchio.AutoClient):
         if txt == info.last_sent_text and now - info.last_sent_at < _MSG_DEDUP_SECS:
             logging.warning(f"[send_message] skipping duplicate within {_MSG_DEDUP_SECS}s: {txt!r}")
             return
-        async with self.throttler:
-            logging.info(f"> {txt!r}")
-            broadcaster = self.create_partialuser(user_id=info.twitch_user_id, user_login="")
-            for attempt in range(2):
-                try:
-                    await broadcaster.send_message(sender=self.user, message=txt)
-                    info.last_sent_text = txt
-                    info.last_sent_at = time.time()
+        elevated = info.bot_elevated or info.twitch_user_id == str(self.bot_user_id)
+        await self.send_scheduler.acquire(str(info.channel_id), elevated)
+        logging.info(f"> {txt!r}")
+        broadcaster = self.create_partialuser(user_id=info.twitch_user_id, user_login="")
+        for attempt in range(2):
+            try:
+                await broadcaster.send_message(sender=self.user, message=txt)
+                info.last_sent_text = txt
+                info.last_sent_at = time.time()
+                break
+            except Exception as e:
+                err = str(e)
+                if "user_timed_out" in err:
+                    logging.warning(
+                        f"[send_message] bot is timed out in channel {info.channel_id}, dropping"
+                    )
                     break
-                except Exception as e:
-                    err = str(e)
-                    if "user_timed_out" in err:
-                        logging.warning(
-                            f"[send_message] bot is timed out in channel {info.channel_id}, dropping"
-                        )
-                        break
-                    if "msg_duplicate" in err:
-                        logging.warning(f"[send_message] duplicate rejected by Twitch: {txt!r}")
-                        break
-                    if ("429" in err or "Too Many Requests" in err) and attempt == 0:
-                        logging.warning("[send_message] rate limited (429), retrying after backoff")
-                        await asyncio.sleep(2)
-                        continue
-                    logging.error(f"[send_message] failed: {e}")
+                if "msg_duplicate" in err:
+                    logging.warning(f"[send_message] duplicate rejected by Twitch: {txt!r}")
                     break
+                if ("429" in err or "Too Many Requests" in err) and attempt == 0:
+                    logging.warning("[send_message] rate limited (429), retrying after backoff")
+                    await asyncio.sleep(2)
+                    continue
+                logging.error(f"[send_message] failed: {e}")
+                break
 
     def any_mention(self, txt: str, info: ChannelInfo, author: str) -> str:
         direct = self.mentions(txt)
@@ -539,8 +624,7 @@ class TwitchClient(twitchio.AutoClient):
         return " ".join(result) if result else ""
 
     def random_mention(self, info: ChannelInfo, author: str) -> str:
-        users = [x for x in info.active_users if x != author]
-        return "@" + (random.choice(users) if users else author)
+        return "@" + (info.active_users.random(exclude=(author,)) or author)
 
     async def on_cron(self) -> None:
         for channel_name, info in self.channels.items():
@@ -584,7 +668,7 @@ class TwitchClient(twitchio.AutoClient):
             )
 
             actions = await commands.process_message(msg)
-            await asyncio.to_thread(db().add_log, info.channel_id, log)
+            await executors.DB.run(db().add_log, info.channel_id, log)
             for a in actions:
                 if a.kind == ActionKind.NEW_MESSAGE:
-                    await self.send_message(info, a.text)
+                    self.queue_message(info, a.text, Priority.CRON)
@@ -14,64 +14,153 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Analyze words"""
+"""Analyze words.
 
+Reads `word<TAB>manual tags` lines and appends a row with suggested morph tags and
+inflection tables per word to the output file. The input is streamed in chunks
+through a process pool (each worker has its own analyzer); every distinct word is
+analyzed once, and rows are written in input order.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
 import logging
+import multiprocessing
+import os
 import sys
+import time
+from collections.abc import Iterable, Iterator
 
 from words import get_morph
 
-if __name__ == "__main__":
-    morph = get_morph()
-    cases = ["nomn", "gent", "datv", "accs", "ablt", "loct"]
+cases = ["nomn", "gent", "datv", "accs", "ablt", "loct"]
+
+# Suggested tag sets and inflection tables, one per nominative parse.
+Analysis = tuple[list[str], list[str]]
+
+
+def analyze_word(s: str) -> Analysis:
+    suggested = []
+    ii = []
+    for p in get_morph().parse(s):
+        # Sorted, so that output doesn't depend on the (per process) set order.
+        tags = sorted(p.tag.grammemes)
+        if "nomn" not in tags:
+            continue
+        if ("ADJF" in tags) or ("ADJS" in tags) or ("PRTF" in tags) or ("PRTS" in tags):
+            tags.append("FEAT")
+        if "ms-f" in tags:
+            tags.append("masc")
+            tags.append("femn")
+        tags = ["_" + x for x in tags if x != "nomn"]
+        tags.append("morph")
+        logging.debug(f"morph parse {p} {p.tag.grammemes} {tags}")
+        suggested.append(" ".join(tags))
+        inf = []
+        for grammemes in itertools.chain(({c} for c in cases), ({c, "plur"} for c in cases)):
+            x = p.inflect(grammemes)
+            inf.append(x.word if x else "X")
+        ii.append(",".join(inf))
+    return suggested, ii
+
+
+def analyze_words(ww: list[str]) -> list[Analysis]:
+    return [analyze_word(s) for s in ww]
+
+
+def format_row(s: str, manual_tags: str, analysis: Analysis) -> str:
+    suggested, ii = analysis
+    row = [s]
+    if suggested:
+        row.append(manual_tags + " " + suggested[0])
+        row.append(manual_tags)
+        row.append('"' + "\n".join(suggested) + '"')
+        row.append('"' + "\n".join(ii) + '"')
+    else:
+        row.extend([manual_tags, "", "", ""])
+    return "\t".join(row)
+
+
+def chunks(lines: Iterable[str], size: int) -> Iterator[list[tuple[str, str]]]:
+    chunk: list[tuple[str, str]] = []
+    for line in lines:
+        s, manual_tags = line.strip().split("\t")
+        chunk.append((s, manual_tags))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _init_worker():
+    get_morph()
+
+
+def process(lines: Iterable[str], out, workers: int = 0, chunk_size: int = 1000) -> tuple[int, int]:
+    """Writes a row per input line to `out`; returns (lines, distinct words)."""
+    workers = workers or os.cpu_count() or 1
+    analyses: dict[str, Analysis] = {}
+    submitted: set[str] = set()
+    n_lines = 0
+    # Chunks in input order with the analysis of the words first seen in them.
+    in_flight: collections.deque[
+        tuple[list[tuple[str, str]], list[str], concurrent.futures.Future | list[Analysis]]
+    ] = collections.deque()
+    pool = None
+    if workers > 1:
+        # Not fork: the parent may have threads, and workers load their own analyzer anyway.
+        pool = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("forkserver"), initializer=_init_worker
+        )
+
+    def write_oldest():
+        nonlocal n_lines
+        chunk, new, result = in_flight.popleft()
+        if isinstance(result, concurrent.futures.Future):
+            result = result.result()
+        analyses.update(zip(new, result, strict=True))
+        out.write("".join(format_row(s, t, analyses[s]) + "\n" for s, t in chunk))
+        n_lines += len(chunk)
+
+    try:
+        for chunk in chunks(lines, chunk_size):
+            new = list(dict.fromkeys(s for s, _ in chunk if s not in submitted))
+            submitted.update(new)
+            result = pool.submit(analyze_words, new) if pool else analyze_words(new)
+            in_flight.append((chunk, new, result))
+            if len(in_flight) > 2 * workers:
+                write_oldest()
+        while in_flight:
+            write_oldest()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return n_lines, len(analyses)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--workers", type=int, default=0, help="default: one per CPU")
+    parser.add_argument("--chunk_size", type=int, default=1000)
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
     with (
-        open(sys.argv[1], encoding="utf-8") as f,
-        open(sys.argv[2], encoding="utf-8", mode="a") as fw,
+        open(args.input, encoding="utf-8") as f,
+        open(args.output, encoding="utf-8", mode="a", buffering=1 << 20) as fw,
     ):
-        for line in f:
-            row = []
-            s, manual_tags = line.strip().split("\t")
-            mm = morph.parse(s)
-            masc = [x for x in mm if ("masc" in x.tag or "ms-f" in x.tag)]
-            row.append(s)
-            suggested = []
-            ii = []
-            for p in morph.parse(s):
-                tags = list(p.tag.grammemes)
-                if "nomn" not in tags:
-                    continue
-                if ("ADJF" in tags) or ("ADJS" in tags) or ("PRTF" in tags) or ("PRTS" in tags):
-                    tags.append("FEAT")
-                if "ms-f" in tags:
-                    tags.append("masc")
-                    tags.append("femn")
-                tags = ["_" + x for x in tags if x != "nomn"]
-                tags.append("morph")
-                logging.debug(f"morph parse {p} {p.tag.grammemes} {tags}")
-                suggested.append(" ".join(tags))
-                inf = []
-                for c in cases:
-                    x = p.inflect({c})
-                    if not x:
-                        inf.append("X")
-                    else:
-                        inf.append(x.word)
-                for c in cases:
-                    x = p.inflect({c, "plur"})
-                    if not x:
-                        inf.append("X")
-                    else:
-                        inf.append(x.word)
-                ii.append(",".join(inf))
-            if suggested:
-                row.append(manual_tags + " " + suggested[0])
-                row.append(manual_tags)
-                row.append('"' + "\n".join(suggested) + '"')
-                row.append('"' + "\n".join(ii) + '"')
-            else:
-                row.append(manual_tags)
-                row.append("")
-                row.append("")
-                row.append("")
-            fw.write("\t".join(row) + "\n")
-            # fw.write('\t'.join([p.inflect({c}).word for c in cases]) + '\n')
+        n_lines, n_words = process(f, fw, args.workers, args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{n_lines} lines, {n_words} distinct words in {elapsed:.1f} s: "
+        f"{n_lines / elapsed:.0f} lines/s, {n_words / elapsed:.0f} words/s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
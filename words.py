@@ -14,21 +14,115 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import array
+import contextlib
+import functools
+import importlib.metadata
 import logging
+import mmap
+import struct
+import threading
+from collections.abc import Iterator
 
+import dawg_python.wrapper
 import pymorphy3
 
+import metrics
+import startup
+
 # Docs: https://pymorphy2.readthedocs.io/en/latest/user/index.html
 _morph = None
+_morph_lock = threading.Lock()
 
 
 def get_morph():
     global _morph
     if _morph is None:
-        _morph = pymorphy3.MorphAnalyzer(lang="ru")
+        # The first caller loads the dictionaries; concurrent callers (e.g. a command
+        # arriving while `prewarm()` is still loading) wait for it instead of loading twice.
+        with _morph_lock:
+            if _morph is None:
+                try:
+                    with _mapped_dawgs():
+                        _morph = pymorphy3.MorphAnalyzer(lang="ru")
+                except Exception:
+                    logging.exception("mapping the morph dictionaries failed, copying them")
+                    _morph = pymorphy3.MorphAnalyzer(lang="ru")
     return _morph
 
 
+def prewarm() -> threading.Thread:
+    """Loads the analyzer on a background thread, so that the first `!new` doesn't."""
+
+    def load():
+        with startup.phase("morph analyzer"):
+            get_morph().parse("кролик")
+        logging.info("morph analyzer loaded in %.1f ms", startup.timings()["morph analyzer"] * 1000)
+
+    t = threading.Thread(target=load, name="morph-prewarm", daemon=True)
+    t.start()
+    return t
+
+
+def _mapped(fp, count: int, fmt: str) -> memoryview:
+    """`count` items of `fmt` at the current position of `fp`, mapped read-only."""
+    offset = fp.tell()
+    size = count * struct.calcsize(fmt)
+    m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    fp.seek(offset + size)
+    return memoryview(m)[offset : offset + size].cast(fmt)
+
+
+# `_mapped_dawgs()` replaces internals of dawg_python (installed by dawg2-python, which
+# pymorphy3 depends on); it was written against these releases.
+_MAPPED_DAWG_VERSIONS = ("0.8.", "0.9.")
+
+
+def _can_map_dawgs() -> bool:
+    try:
+        version = importlib.metadata.version("dawg2-python")
+    except importlib.metadata.PackageNotFoundError:
+        return False
+    d, g = dawg_python.wrapper.Dictionary, dawg_python.wrapper.Guide
+    return (
+        version.startswith(_MAPPED_DAWG_VERSIONS)
+        and callable(getattr(d, "read", None))
+        and callable(getattr(g, "read", None))
+        and isinstance(getattr(d(), "_units", None), array.array)
+        and isinstance(getattr(g(), "_units", None), array.array)
+    )
+
+
+def _read_dictionary(self, fp):
+    base_size = struct.unpack("=I", fp.read(4))[0]
+    self._units = _mapped(fp, base_size, "I")
+
+
+def _read_guide(self, fp):
+    base_size = struct.unpack("=I", fp.read(4))[0]
+    self._units = _mapped(fp, base_size * 2, "B")
+
+
+@contextlib.contextmanager
+def _mapped_dawgs() -> Iterator[None]:
+    """Makes dawg_python map DAWG files (~15 MB of the Russian dictionaries) instead of
+    copying them into arrays, so the pages come from the OS page cache and are shared
+    by every bot process on the machine.
+
+    With a dawg_python it wasn't written for, the dictionaries are copied as usual."""
+    if not _can_map_dawgs():
+        logging.info("unknown dawg_python version, not mapping the morph dictionaries")
+        yield
+        return
+    d, g = dawg_python.wrapper.Dictionary, dawg_python.wrapper.Guide
+    saved = d.read, g.read
+    d.read, g.read = _read_dictionary, _read_guide
+    try:
+        yield
+    finally:
+        d.read, g.read = saved
+
+
 morph_tags: dict[str, str] = {
     "_actv": "actv",
     "_ADJF": "ADJF",
@@ -67,15 +161,56 @@ morph_tags: dict[str, str] = {
 
 cases = ["nomn", "gent", "datv", "accs", "ablt", "loct"]
 case_tags = ["рд", "дт", "вн", "тв", "пр", "мн", "рд,мн", "дт,мн", "вн,мн", "тв,мн", "пр,мн"]
+# Position of each inflection in `case_tags`, e.g. for per-text tables of forms.
+case_id = {t: i for i, t in enumerate(case_tags)}
+
+
+# Texts and their inflections repeat a lot (`TextDownload` inflects every morph text to
+# every case, `morph_text` every word), while parsing and inflecting are pure functions
+# of their arguments, so results are memoized in bounded LRU caches.
+PARSE_CACHE_SIZE = 8192
+INFLECT_CACHE_SIZE = 32768
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_word(w: str) -> tuple:
+    """All pymorphy3 parses of `w`, most likely first."""
+    return tuple(get_morph().parse(w))
+
+
+@functools.lru_cache(maxsize=256)
+def grammemes(inf: str) -> frozenset[str]:
+    """Latin grammeme set for an inflection like "рд,мн"."""
+    return frozenset(get_morph().cyr2lat(inf).split(","))
 
 
 def inflect_word(s: str, inf: str, tagFilter: list[str] = [], n: int | None = None) -> str:
-    morph = get_morph()
-    inf = morph.cyr2lat(inf)
-    ss = set(inf.split(","))
+    return _inflect_word(s, inf, tuple(tagFilter), n)
+
+
+def cache_info() -> dict:
+    return {"parse": parse_word.cache_info(), "inflect": _inflect_word.cache_info()}
+
+
+_cache_hits = metrics.gauge("words_cache_hits", "Morphology cache hits since start")
+_cache_misses = metrics.gauge("words_cache_misses", "Morphology cache misses since start")
+_cache_entries = metrics.gauge("words_cache_entries", "Entries in a morphology cache")
+
+
+@metrics.on_collect
+def _collect_cache_info():
+    for name, info in cache_info().items():
+        _cache_hits.set(info.hits, cache=name)
+        _cache_misses.set(info.misses, cache=name)
+        _cache_entries.set(info.currsize, cache=name)
+
+
+@functools.lru_cache(maxsize=INFLECT_CACHE_SIZE)
+def _inflect_word(s: str, inf: str, tagFilter: tuple[str, ...], n: int | None) -> str:
+    ss = set(grammemes(inf))
     if logging.getLogger().isEnabledFor(logging.DEBUG):
         logging.debug(f'inflecting "{s}" to "{inf}"({ss}) filter={tagFilter}')
-    mm = morph.parse(s)
+    mm = parse_word(s)
     if not mm:
         return s
     p = mm[0]